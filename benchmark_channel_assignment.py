@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src.lib import Channels, PipelineConfiguration, Timestamps
+
+BENCHMARK_USER = "benchmark"
+
+
+def generate_messages(messages_count, seed):
+    """
+    Generates synthetic messages, sent at random times between the project start and end dates.
+
+    :param messages_count: Number of messages to generate.
+    :type messages_count: int
+    :param seed: Seed for the random number generator. The same seed always generates the same messages.
+    :type seed: int
+    :return: Generated messages.
+    :rtype: list of TracedData
+    """
+    rng = random.Random(seed)
+    metadata = Metadata(BENCHMARK_USER, Metadata.get_call_location(), time.time())
+
+    project_seconds = int((PipelineConfiguration.PROJECT_END_DATE -
+                           PipelineConfiguration.PROJECT_START_DATE).total_seconds())
+    messages = []
+    for i in range(messages_count):
+        sent_on = PipelineConfiguration.PROJECT_START_DATE + timedelta(
+            seconds=rng.randrange(project_seconds), microseconds=rng.randrange(1000000))
+        messages.append(TracedData({
+            "rqa_s01e01_raw": f"message {i}",
+            "sent_on": sent_on.isoformat()
+        }, metadata))
+
+    return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the time taken to set the channel keys of messages one "
+                                                 "message at a time with the time taken to set them all at once "
+                                                 "using numpy, on synthetic data. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[100000, 1000000],
+                        help="Numbers of messages to benchmark with (default: 100000 1000000)")
+
+    args = parser.parse_args()
+
+    for messages_count in args.messages_counts:
+        # Each mode appends to the TracedData it is given, so give each its own copy of the same messages.
+        # The timestamp memo is cleared before each mode so that both pay for parsing the timestamps.
+        messages = generate_messages(messages_count, seed=0)
+        Timestamps._epoch_micros_memo.clear()
+        start = time.perf_counter()
+        Channels.set_channel_keys(BENCHMARK_USER, messages, "sent_on")
+        scalar_time = time.perf_counter() - start
+        scalar_data = messages
+
+        messages = generate_messages(messages_count, seed=0)
+        Timestamps._epoch_micros_memo.clear()
+        start = time.perf_counter()
+        Channels.set_channel_keys(BENCHMARK_USER, messages, "sent_on", vectorised=True)
+        vectorised_time = time.perf_counter() - start
+        vectorised_data = messages
+
+        # Check that both modes set the same keys on every message
+        assert len(scalar_data) == len(vectorised_data)
+        for scalar_td, vectorised_td in zip(scalar_data, vectorised_data):
+            assert dict(scalar_td.items()) == dict(vectorised_td.items()), "Modes disagree on the channel keys"
+
+        print(f"{messages_count} messages:")
+        print(f"  One message at a time: {scalar_time:.2f}s")
+        print(f"  Vectorised:            {vectorised_time:.2f}s")
+        print(f"  Speed-up:              {scalar_time / vectorised_time:.2f}x")
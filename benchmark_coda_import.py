@@ -0,0 +1,154 @@
+import argparse
+import json
+import random
+import tempfile
+import time
+from os import path
+
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src.lib import PipelineConfiguration, CodaDatasetCache, CodaImport
+
+BENCHMARK_USER = "benchmark"
+
+
+def generate_data_and_coda_files(messages_count, coded_rate, coda_dir, seed):
+    """
+    Generates synthetic messages, one Coda messages file per RQA, demog, and follow-up coding plan, and the imports
+    which ApplyManualCodes would make from those files.
+
+    :param messages_count: Number of messages to generate.
+    :type messages_count: int
+    :param coded_rate: Probability that each message has been labelled in Coda.
+    :type coded_rate: float
+    :param coda_dir: Directory to write the Coda files to.
+    :type coda_dir: str
+    :param seed: Seed for the random number generator. The same seed always generates the same data and files.
+    :type seed: int
+    :return: Tuple of (messages, imports).
+    :rtype: (list of TracedData, list of CodaImport)
+    """
+    rng = random.Random(seed)
+    metadata = Metadata(BENCHMARK_USER, Metadata.get_call_location(), time.time())
+    rqa_plans = PipelineConfiguration.RQA_CODING_PLANS
+    survey_plans = PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS
+
+    messages = []
+    coda_messages = {plan.coda_filename: [] for plan in rqa_plans + survey_plans}
+
+    def add_message_to_coda(plan, message_id, schemes):
+        if rng.random() >= coded_rate:
+            return
+        labels = []
+        for scheme in schemes:
+            code = rng.choice(scheme.codes)
+            label = CleaningUtils.make_label_from_cleaner_code(scheme, code, BENCHMARK_USER).to_dict()
+            label["Checked"] = True
+            labels.append(label)
+        coda_messages[plan.coda_filename].append({"MessageID": message_id, "Text": "", "Labels": labels})
+
+    for i in range(messages_count):
+        rqa_plan = rng.choice(rqa_plans)
+        message = {rqa_plan.raw_field: f"message {i}", rqa_plan.id_field: f"rqa-message-{i}"}
+        schemes = [rqa_plan.code_scheme]
+        if rqa_plan.binary_code_scheme is not None:
+            schemes.append(rqa_plan.binary_code_scheme)
+        add_message_to_coda(rqa_plan, f"rqa-message-{i}", schemes)
+
+        for survey_plan in survey_plans:
+            message[survey_plan.raw_field] = f"answer {i}"
+            message[survey_plan.id_field] = f"{survey_plan.raw_field}-{i}"
+            add_message_to_coda(survey_plan, f"{survey_plan.raw_field}-{i}", [survey_plan.code_scheme])
+
+        messages.append(TracedData(message, metadata))
+
+    for coda_filename, messages_to_write in coda_messages.items():
+        with open(path.join(coda_dir, coda_filename), "w") as f:
+            json.dump(messages_to_write, f)
+
+    coda_imports = []
+    for plan in rqa_plans:
+        coda_path = path.join(coda_dir, plan.coda_filename)
+        coda_imports.append(CodaImport(plan.id_field, {plan.coded_field: plan.code_scheme}, coda_path,
+                                       multi_coded=True, required_key=plan.raw_field))
+        if plan.binary_code_scheme is not None:
+            coda_imports.append(CodaImport(plan.id_field, {plan.binary_coded_field: plan.binary_code_scheme},
+                                           coda_path, required_key=plan.raw_field))
+    for plan in survey_plans:
+        coda_imports.append(CodaImport(plan.id_field, {plan.coded_field: plan.code_scheme},
+                                       path.join(coda_dir, plan.coda_filename)))
+
+    return messages, coda_imports
+
+
+def import_one_at_a_time(coda_dataset_cache, data, coda_imports):
+    for coda_import in coda_imports:
+        import_data = data
+        if coda_import.required_key is not None:
+            import_data = [td for td in data if coda_import.required_key in td]
+
+        if coda_import.multi_coded:
+            coda_dataset_cache.import_coda_2_to_traced_data_iterable_multi_coded(
+                BENCHMARK_USER, import_data, coda_import.message_id_key, coda_import.scheme_key_map,
+                coda_import.coda_path)
+        else:
+            coda_dataset_cache.import_coda_2_to_traced_data_iterable(
+                BENCHMARK_USER, import_data, coda_import.message_id_key, coda_import.scheme_key_map,
+                coda_import.coda_path)
+
+
+def without_label_times(value):
+    # NOT_REVIEWED labels are timestamped when they are made, so ignore label times when comparing the two imports.
+    if isinstance(value, dict):
+        return {k: without_label_times(v) for k, v in value.items() if k != "DateTimeUTC"}
+    if isinstance(value, list):
+        return [without_label_times(v) for v in value]
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the time taken to import labels from Coda files one "
+                                                 "coding plan at a time with the time taken to import them all in "
+                                                 "a single pass, on synthetic data. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[100000, 1000000],
+                        help="Numbers of messages to benchmark with (default: 100000 1000000)")
+    parser.add_argument("--coded-rate", type=float, default=0.8,
+                        help="Probability that each message has been labelled in Coda (default: 0.8)")
+
+    args = parser.parse_args()
+
+    for messages_count in args.messages_counts:
+        with tempfile.TemporaryDirectory() as coda_dir:
+            # Each mode appends to the TracedData it is given, so give each its own copy of the same data.
+            # The Coda files are parsed before each mode runs, so that only the imports are timed.
+            coda_dataset_cache = CodaDatasetCache()
+            data, coda_imports = generate_data_and_coda_files(messages_count, args.coded_rate, coda_dir, seed=0)
+            for coda_import in coda_imports:
+                coda_dataset_cache.get_dataset(coda_import.coda_path)
+
+            start = time.perf_counter()
+            import_one_at_a_time(coda_dataset_cache, data, coda_imports)
+            one_at_a_time_time = time.perf_counter() - start
+            one_at_a_time_data = data
+
+            data, coda_imports = generate_data_and_coda_files(messages_count, args.coded_rate, coda_dir, seed=0)
+            for coda_import in coda_imports:
+                coda_dataset_cache.get_dataset(coda_import.coda_path)
+            start = time.perf_counter()
+            coda_dataset_cache.import_all(BENCHMARK_USER, data, coda_imports)
+            single_pass_time = time.perf_counter() - start
+            single_pass_data = data
+
+        # Check that both modes set the same labels on every message
+        assert len(one_at_a_time_data) == len(single_pass_data)
+        for one_at_a_time_td, single_pass_td in zip(one_at_a_time_data, single_pass_data):
+            assert without_label_times(dict(one_at_a_time_td.items())) == \
+                without_label_times(dict(single_pass_td.items())), "Modes disagree on the imported labels"
+
+        print(f"{messages_count} messages, {len(coda_imports)} imports:")
+        print(f"  One import at a time: {one_at_a_time_time:.2f}s")
+        print(f"  Single pass:          {single_pass_time:.2f}s")
+        print(f"  Speed-up:             {one_at_a_time_time / single_pass_time:.2f}x")
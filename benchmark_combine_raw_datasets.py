@@ -0,0 +1,98 @@
+import argparse
+import random
+import time
+
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src import CombineRawDatasets
+
+BENCHMARK_USER = "benchmark"
+
+
+def generate_datasets(messages_count, respondents_count, surveys_count, response_rate, seed):
+    """
+    Generates synthetic messages and surveys datasets, in the shape of those exported by fetch_raw_data.py.
+
+    :param messages_count: Number of messages to generate.
+    :type messages_count: int
+    :param respondents_count: Number of respondents to spread the messages and survey responses over.
+    :type respondents_count: int
+    :param surveys_count: Number of surveys datasets to generate.
+    :type surveys_count: int
+    :param response_rate: Probability that each respondent responded to each survey.
+    :type response_rate: float
+    :param seed: Seed for the random number generator. The same seed always generates the same datasets.
+    :type seed: int
+    :return: Tuple of (messages datasets, surveys datasets).
+    :rtype: (list of list of TracedData, list of list of TracedData)
+    """
+    rng = random.Random(seed)
+    metadata = Metadata(BENCHMARK_USER, Metadata.get_call_location(), time.time())
+
+    messages_dataset = []
+    for i in range(messages_count):
+        messages_dataset.append(TracedData({
+            "avf_phone_id": f"avf-phone-uuid-{rng.randrange(respondents_count)}",
+            "rqa_s01e01_raw": f"message {i}",
+            "sent_on": "2019-07-01T12:00:00+03:00"
+        }, metadata))
+
+    surveys_datasets = []
+    for survey in range(surveys_count):
+        surveys_dataset = []
+        for respondent in range(respondents_count):
+            if rng.random() < response_rate:
+                surveys_dataset.append(TracedData({
+                    "avf_phone_id": f"avf-phone-uuid-{respondent}",
+                    f"survey_{survey}_raw": f"answer {respondent}",
+                    f"survey_{survey}_time": "2019-07-01T12:00:00+03:00"
+                }, metadata))
+        surveys_datasets.append(surveys_dataset)
+
+    return [messages_dataset], surveys_datasets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the time taken to combine the raw datasets by joining all "
+                                                 "the surveys datasets in a single pass with the time taken by "
+                                                 "joining one surveys dataset at a time, on synthetic data. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[100000, 1000000],
+                        help="Numbers of messages to benchmark with (default: 100000 1000000)")
+    parser.add_argument("--messages-per-respondent", type=float, default=4,
+                        help="Average number of messages sent by each respondent (default: 4)")
+    parser.add_argument("--surveys", type=int, default=5,
+                        help="Number of surveys datasets (default: 5)")
+    parser.add_argument("--response-rate", type=float, default=0.6,
+                        help="Probability that each respondent responded to each survey (default: 0.6)")
+
+    args = parser.parse_args()
+
+    for messages_count in args.messages_counts:
+        respondents_count = max(1, int(messages_count / args.messages_per_respondent))
+
+        # Each implementation appends to the TracedData it is given, so give each its own copy of the same datasets.
+        messages_datasets, surveys_datasets = generate_datasets(
+            messages_count, respondents_count, args.surveys, args.response_rate, seed=0)
+        start = time.perf_counter()
+        one_at_a_time_data = CombineRawDatasets.combine_raw_datasets_one_survey_at_a_time(
+            BENCHMARK_USER, messages_datasets, surveys_datasets)
+        one_at_a_time_time = time.perf_counter() - start
+
+        messages_datasets, surveys_datasets = generate_datasets(
+            messages_count, respondents_count, args.surveys, args.response_rate, seed=0)
+        start = time.perf_counter()
+        single_pass_data = CombineRawDatasets.combine_raw_datasets(BENCHMARK_USER, messages_datasets, surveys_datasets)
+        single_pass_time = time.perf_counter() - start
+
+        # Check that both implementations produced the same data, in the same order
+        assert len(one_at_a_time_data) == len(single_pass_data)
+        for one_at_a_time_td, single_pass_td in zip(one_at_a_time_data, single_pass_data):
+            assert dict(one_at_a_time_td.items()) == dict(single_pass_td.items()), \
+                "Implementations disagree on the combined data"
+
+        print(f"{messages_count} messages, {respondents_count} respondents, {args.surveys} surveys:")
+        print(f"  One survey at a time: {one_at_a_time_time:.2f}s")
+        print(f"  Single pass:          {single_pass_time:.2f}s")
+        print(f"  Speed-up:             {one_at_a_time_time / single_pass_time:.2f}x")
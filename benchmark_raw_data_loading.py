@@ -0,0 +1,51 @@
+import argparse
+import os
+import time
+
+from src.lib import PipelineConfiguration, RawDataLoader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the time taken to load the raw data files serially with "
+                                                 "the time taken to load them using a process pool. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("pipeline_configuration_file_path", metavar="pipeline-configuration-file",
+                        help="Path to the pipeline configuration json file")
+    parser.add_argument("raw_data_dir", metavar="raw-data-dir",
+                        help="Path to a directory containing the raw data files exported by fetch_raw_data.py")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes to use for the parallel load (default: the number of CPUs)")
+
+    args = parser.parse_args()
+
+    pipeline_configuration_file_path = args.pipeline_configuration_file_path
+    raw_data_dir = args.raw_data_dir
+    processes = args.processes
+
+    with open(pipeline_configuration_file_path) as f:
+        pipeline_configuration = PipelineConfiguration.from_configuration_file(f)
+
+    raw_data_paths = [f"{raw_data_dir}/{flow_name}.jsonl"
+                      for flow_name in pipeline_configuration.activation_flow_names +
+                      pipeline_configuration.survey_flow_names]
+
+    start = time.perf_counter()
+    serial_datasets = RawDataLoader.load_traced_data_files(raw_data_paths, processes=1)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel_datasets = RawDataLoader.load_traced_data_files(raw_data_paths, processes=processes)
+    parallel_time = time.perf_counter() - start
+
+    # Check that both loaders produced the same data, in the same order
+    assert len(serial_datasets) == len(parallel_datasets)
+    for path, serial_dataset, parallel_dataset in zip(raw_data_paths, serial_datasets, parallel_datasets):
+        assert len(serial_dataset) == len(parallel_dataset), f"Loaders disagree on the number of TracedData in {path}"
+        for serial_td, parallel_td in zip(serial_dataset, parallel_dataset):
+            assert dict(serial_td.items()) == dict(parallel_td.items()), f"Loaders disagree on the data in {path}"
+
+    td_count = sum(len(dataset) for dataset in serial_datasets)
+    print(f"Loaded {td_count} TracedData from {len(raw_data_paths)} files")
+    print(f"Serial:              {serial_time:.2f}s")
+    print(f"Parallel ({processes} processes): {parallel_time:.2f}s")
+    print(f"Speed-up:            {serial_time / parallel_time:.2f}x")
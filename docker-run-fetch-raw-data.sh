@@ -10,6 +10,12 @@ while [[ $# -gt 0 ]]; do
             PROFILE_CPU=true
             CPU_PROFILE_OUTPUT_PATH="$2"
             shift 2;;
+        --full-refetch)
+            FULL_REFETCH_ARG="--full-refetch"
+            shift;;
+        --contacts-cache)
+            CONTACTS_CACHE_PATH="$2"
+            shift 2;;
         --)
             shift
             break;;
@@ -21,7 +27,7 @@ done
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 5 ]]; then
     echo "Usage: ./docker-run-fetch-raw-data.sh
-    [--profile-cpu <profile-output-path>]
+    [--profile-cpu <profile-output-path>] [--full-refetch] [--contacts-cache <contacts-cache-path>]
     <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path>
     <phone-number-uuid-table-file-path> <raw-data-dir>"
     exit
@@ -42,10 +48,13 @@ if [[ "$PROFILE_CPU" = true ]]; then
     PROFILE_CPU_CMD="pyflame -o /data/cpu.prof -t"
     SYS_PTRACE_CAPABILITY="--cap-add SYS_PTRACE"
 fi
-CMD="pipenv run $PROFILE_CPU_CMD python -u fetch_raw_data.py \
+if [[ -n "$CONTACTS_CACHE_PATH" ]]; then
+    CONTACTS_CACHE_ARG="--contacts-cache-path /data/contacts-cache.jsonl"
+fi
+CMD="pipenv run $PROFILE_CPU_CMD python -u fetch_raw_data.py $FULL_REFETCH_ARG $CONTACTS_CACHE_ARG \
     \"$USER\" /credentials/google-cloud-credentials.json \
     /data/pipeline-configuration.json \
-    /data/phone-number-uuid-table.json /data/Raw\ Data
+    /data/phone-number-uuid-table.db /data/Raw\ Data
 "
 container="$(docker container create ${SYS_PTRACE_CAPABILITY} -w /app "$IMAGE_NAME" /bin/bash -c "$CMD")"
 
@@ -58,7 +67,14 @@ trap finish EXIT
 # Copy input data into the container
 docker cp "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$container:/credentials/google-cloud-credentials.json"
 docker cp "$PIPELINE_CONFIGURATION" "$container:/data/pipeline-configuration.json"
-docker cp "$PHONE_UUID_TABLE_PATH" "$container:/data/phone-number-uuid-table.json"
+docker cp "$PHONE_UUID_TABLE_PATH" "$container:/data/phone-number-uuid-table.db"
+if [[ -d "$RAW_DATA_DIR" ]]; then
+    # Copy in the raw data from the previous fetch, so that only runs modified since then need to be downloaded.
+    docker cp "$RAW_DATA_DIR" "$container:/data/Raw Data"
+fi
+if [[ -f "$CONTACTS_CACHE_PATH" ]]; then
+    docker cp "$CONTACTS_CACHE_PATH" "$container:/data/contacts-cache.jsonl"
+fi
 
 # Run the container
 docker start -a -i "$container"
@@ -67,7 +83,12 @@ docker start -a -i "$container"
 mkdir -p "$RAW_DATA_DIR"
 docker cp "$container:/data/Raw Data/." "$RAW_DATA_DIR"
 
-docker cp "$container:/data/phone-number-uuid-table.json" "$PHONE_UUID_TABLE_PATH"
+docker cp "$container:/data/phone-number-uuid-table.db" "$PHONE_UUID_TABLE_PATH"
+
+if [[ -n "$CONTACTS_CACHE_PATH" ]]; then
+    mkdir -p "$(dirname "$CONTACTS_CACHE_PATH")"
+    docker cp "$container:/data/contacts-cache.jsonl" "$CONTACTS_CACHE_PATH"
+fi
 
 if [[ "$PROFILE_CPU" = true ]]; then
     mkdir -p "$(dirname "$CPU_PROFILE_OUTPUT_PATH")"
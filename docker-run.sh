@@ -10,6 +10,18 @@ while [[ $# -gt 0 ]]; do
             PROFILE_CPU=true
             CPU_PROFILE_OUTPUT_PATH="$2"
             shift 2;;
+        --raw-data-snapshot)
+            RAW_DATA_SNAPSHOT_PATH="$2"
+            shift 2;;
+        --checkpoint-dir)
+            CHECKPOINT_DIR="$2"
+            shift 2;;
+        --resume-from-stage)
+            RESUME_FROM_STAGE="$2"
+            shift 2;;
+        --stage-cache-dir)
+            STAGE_CACHE_DIR="$2"
+            shift 2;;
         --)
             shift
             break;;
@@ -21,7 +33,8 @@ done
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 12 ]]; then
     echo "Usage: ./docker-run.sh
-    [--profile-cpu <profile-output-path>]
+    [--profile-cpu <profile-output-path>] [--raw-data-snapshot <raw-data-snapshot-path>]
+    [--checkpoint-dir <checkpoint-dir>] [--resume-from-stage <stage-name>] [--stage-cache-dir <stage-cache-dir>]
     <user> <pipeline-configuration-file-path> <google-cloud-credentials-file-path> <phone-number-uuid-table-path>
     <raw-data-dir> <prev-coded-dir> <json-output-path> <icr-output-dir> <coded-output-dir> <messages-output-csv>
     <individuals-output-csv> <production-output-csv> <advert-phone-numbers-csv>"
@@ -56,15 +69,48 @@ if [[ "$PROFILE_CPU" = true ]]; then
     PROFILE_CPU_CMD="pyflame -o /data/cpu.prof -t"
     SYS_PTRACE_CAPABILITY="--cap-add SYS_PTRACE"
 fi
-CMD="pipenv run $PROFILE_CPU_CMD python -u pipeline.py \
+if [[ -n "$RAW_DATA_SNAPSHOT_PATH" ]]; then
+    RAW_DATA_SNAPSHOT_ARG="--raw-data-snapshot-path /data/raw-data-snapshot.pickle"
+fi
+if [[ -n "$CHECKPOINT_DIR" ]]; then
+    CHECKPOINT_ARGS="--checkpoint-dir /data/checkpoints"
+fi
+if [[ -n "$RESUME_FROM_STAGE" ]]; then
+    CHECKPOINT_ARGS="$CHECKPOINT_ARGS --resume-from-stage $RESUME_FROM_STAGE"
+fi
+if [[ -n "$STAGE_CACHE_DIR" ]]; then
+    STAGE_CACHE_ARG="--stage-cache-dir /data/stage-cache"
+fi
+CMD="pipenv run $PROFILE_CPU_CMD python -u pipeline.py $RAW_DATA_SNAPSHOT_ARG $CHECKPOINT_ARGS $STAGE_CACHE_ARG \
+    --stage-report-output-path /data/stage-report.json \
     \"$USER\" configurations/pipeline_config.json /credentials/google-cloud-credentials.json \
-    /data/phone-number-uuid-table-input.json /data/raw-data /data/prev-coded \
+    /data/phone-number-uuid-table-input.db /data/raw-data /data/prev-coded \
     /data/output.json /data/output-icr /data/coded /data/output-messages.csv \
     /data/output-individuals.csv /data/output-production.csv /data/advert-phone-numbers.csv"
 
 container="$(docker container create ${SYS_PTRACE_CAPABILITY} -w /app "$IMAGE_NAME" /bin/bash -c "$CMD")"
 
 function finish {
+    # Copy the checkpoints out even if the pipeline failed, so that the next run can resume from them.
+    if [[ -n "$CHECKPOINT_DIR" ]]; then
+        echo "copying checkpoints from '$container:/data/checkpoints/' to '$CHECKPOINT_DIR'"
+        mkdir -p "$CHECKPOINT_DIR"
+        docker cp "$container:/data/checkpoints/." "$CHECKPOINT_DIR" || true
+    fi
+
+    # Likewise for the stage report, so that a failed run reports the stages it completed.
+    OUTPUT_STAGE_REPORT="$(dirname "$OUTPUT_JSON")/stage_report.json"
+    echo "copying stage report from '$container:/data/stage-report.json' to '$OUTPUT_STAGE_REPORT'"
+    mkdir -p "$(dirname "$OUTPUT_STAGE_REPORT")"
+    docker cp "$container:/data/stage-report.json" "$OUTPUT_STAGE_REPORT" || true
+
+    # Likewise for the stage cache, which records every stage that succeeded.
+    if [[ -n "$STAGE_CACHE_DIR" ]]; then
+        echo "copying stage cache from '$container:/data/stage-cache/' to '$STAGE_CACHE_DIR'"
+        mkdir -p "$STAGE_CACHE_DIR"
+        docker cp "$container:/data/stage-cache/." "$STAGE_CACHE_DIR" || true
+    fi
+
     # Tear down the container when done.
     docker container rm "$container" >/dev/null
 }
@@ -72,11 +118,36 @@ trap finish EXIT
 
 # Copy input data into the container
 docker cp "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$container:/credentials/google-cloud-credentials.json"
-docker cp "$INPUT_PHONE_UUID_TABLE" "$container:/data/phone-number-uuid-table-input.json"
+docker cp "$INPUT_PHONE_UUID_TABLE" "$container:/data/phone-number-uuid-table-input.db"
 docker cp "$INPUT_RAW_DATA_DIR" "$container:/data/raw-data"
 if [[ -d "$PREV_CODED_DIR" ]]; then
     docker cp "$PREV_CODED_DIR" "$container:/data/prev-coded"
 fi
+if [[ -f "$RAW_DATA_SNAPSHOT_PATH" ]]; then
+    docker cp "$RAW_DATA_SNAPSHOT_PATH" "$container:/data/raw-data-snapshot.pickle"
+fi
+if [[ -d "$CHECKPOINT_DIR" ]]; then
+    docker cp "$CHECKPOINT_DIR" "$container:/data/checkpoints"
+fi
+if [[ -d "$STAGE_CACHE_DIR" ]]; then
+    docker cp "$STAGE_CACHE_DIR" "$container:/data/stage-cache"
+fi
+if [[ -n "$RESUME_FROM_STAGE" ]]; then
+    # The stages before the one being resumed from are skipped, so copy in the outputs they wrote on the previous run,
+    # so that they can be uploaded and copied back out again.
+    function copy_previous_output {
+        if [[ -e "$1" ]]; then
+            docker cp "$1" "$container:$2"
+        fi
+    }
+    copy_previous_output "$OUTPUT_JSON" /data/output.json
+    copy_previous_output "$OUTPUT_ICR_DIR" /data/output-icr
+    copy_previous_output "$OUTPUT_AUTO_CODED_DIR" /data/coded
+    copy_previous_output "$OUTPUT_PRODUCTION_CSV" /data/output-production.csv
+    copy_previous_output "$OUTPUT_ADVERT_PHONE_NUMBERS_CSV" /data/advert-phone-numbers.csv
+    copy_previous_output "$OUTPUT_INDIVIDUALS_CSV" /data/output-individuals.csv
+    copy_previous_output "$OUTPUT_MESSAGES_CSV" /data/output-messages.csv
+fi
 
 # Run the container
 docker start -a -i "$container"
@@ -114,3 +185,9 @@ if [[ "$PROFILE_CPU" = true ]]; then
     mkdir -p "$(dirname "$CPU_PROFILE_OUTPUT_PATH")"
     docker cp "$container:/data/cpu.prof" "$CPU_PROFILE_OUTPUT_PATH"
 fi
+
+if [[ -n "$RAW_DATA_SNAPSHOT_PATH" ]]; then
+    echo "copying raw data snapshot from '$container:/data/raw-data-snapshot.pickle' to '$RAW_DATA_SNAPSHOT_PATH'"
+    mkdir -p "$(dirname "$RAW_DATA_SNAPSHOT_PATH")"
+    docker cp "$container:/data/raw-data-snapshot.pickle" "$RAW_DATA_SNAPSHOT_PATH"
+fi
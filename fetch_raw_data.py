@@ -1,14 +1,327 @@
 import argparse
+import heapq
+import io
 import json
+import math
 import os
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from core_data_modules.traced_data.io import TracedDataJsonIO
-from core_data_modules.util import PhoneNumberUuidTable, IOUtils
+from core_data_modules.util import IOUtils
 from google.cloud import storage
-from rapid_pro_tools.rapid_pro_client import RapidProClient
+from temba_client.v2 import Run
+
+from src.lib import PipelineConfiguration, PagingRapidProClient, FlowRunsCache, ContactsCache, \
+    SQLitePhoneNumberUuidTable
+
+
+# Number of cached runs to read and convert at a time, when re-exporting the runs which were not re-downloaded.
+CACHED_RUNS_PAGE_SIZE = 1000
+
+# Maximum number of TracedData to hold in memory at once when coalescing a survey flow.
+COALESCE_BUCKET_SIZE = 50000
+
+
+class _DownloadedRuns(object):
+    def __init__(self, spool_f):
+        """
+        Runs downloaded from Rapid Pro, spooled to a temporary file so that they are not all held in memory at once.
+
+        :param spool_f: Temporary file to spool the runs to, opened for reading and writing in text mode.
+        :type spool_f: file-like
+        """
+        self._spool_f = spool_f
+        self._pages = []  # of (position in spool_f, number of runs) for each page, in the order they were added
+        self.run_ids = set()
+
+    def add_page(self, raw_runs):
+        """
+        :param raw_runs: Page of runs to add.
+        :type raw_runs: list of temba_client.v2.types.Run
+        """
+        self._pages.append((self._spool_f.tell(), len(raw_runs)))
+        for run in raw_runs:
+            self._spool_f.write(json.dumps(run.serialize()))
+            self._spool_f.write("\n")
+            self.run_ids.add(run.id)
+
+    def iter_pages_reversed(self):
+        """
+        Reads the runs back, one page at a time, in the reverse of the order they were added.
+
+        :return: Pages of runs.
+        :rtype: iterator of list of temba_client.v2.types.Run
+        """
+        for position, runs_count in reversed(self._pages):
+            self._spool_f.seek(position)
+            page = [Run.deserialize(json.loads(self._spool_f.readline())) for _ in range(runs_count)]
+            page.reverse()
+            yield page
+
+
+def download_raw_runs(rapid_pro, flow_name, spool_f, cursor=None):
+    """
+    Downloads the raw runs in a flow to a temporary file.
+
+    :param rapid_pro: Rapid Pro client to download runs with.
+    :type rapid_pro: PagingRapidProClient
+    :param flow_name: Name of the flow to download the runs of.
+    :type flow_name: str
+    :param spool_f: Temporary file to spool the runs to, opened for reading and writing in text mode.
+    :type spool_f: file-like
+    :param cursor: If set, only the runs modified since this time are downloaded.
+    :type cursor: datetime.datetime | None
+    :return: The downloaded runs.
+    :rtype: _DownloadedRuns
+    """
+    flow_id = rapid_pro.get_flow_id(flow_name)
+    if cursor is not None:
+        print(f"Fetching runs for flow '{flow_name}' modified since {cursor.isoformat()}...")
+
+    downloaded_runs = _DownloadedRuns(spool_f)
+    for page in rapid_pro.iter_raw_runs_pages_for_flow_id(flow_id, last_modified_after_inclusive=cursor):
+        downloaded_runs.add_page(page)
+
+    if cursor is not None:
+        print(f"Downloaded {len(downloaded_runs.run_ids)} new or updated runs for flow '{flow_name}'")
+    return downloaded_runs
+
+
+def iter_raw_runs_pages(runs_cache, downloaded_runs, cursor=None):
+    """
+    Iterates over all the raw runs in a flow, one page at a time, in ascending order of modified_on.
+
+    If a cursor is given, the runs in the cache which were not re-downloaded are returned first, followed by the
+    downloaded runs. Runs modified at the cursor are re-downloaded, so every cached run which was not re-downloaded was
+    modified before all of the downloaded runs. Otherwise, only the downloaded runs are returned.
+
+    :param runs_cache: Cache of runs from previous fetches of this flow.
+    :type runs_cache: FlowRunsCache
+    :param downloaded_runs: Runs downloaded by `download_raw_runs`.
+    :type downloaded_runs: _DownloadedRuns
+    :param cursor: Cursor that `downloaded_runs` were downloaded since, or None if every run in the flow was downloaded.
+    :type cursor: datetime.datetime | None
+    :return: Pages of the runs in the flow.
+    :rtype: iterator of list of temba_client.v2.types.Run
+    """
+    if cursor is not None:
+        yield from runs_cache.iter_raw_runs_pages(CACHED_RUNS_PAGE_SIZE, exclude_run_ids=downloaded_runs.run_ids)
+
+    # Rapid Pro returns the most recently modified runs first, so reverse them.
+    yield from downloaded_runs.iter_pages_reversed()
+
+
+def coalesce_traced_runs_file(user, rapid_pro, input_path, output_path, traced_runs_count, coalesce_key="avf_phone_id"):
+    """
+    Coalesces the TracedData in a JSONL file by `coalesce_key`, using bounded memory.
+
+    The input is first partitioned by the hash of each TracedData's `coalesce_key` into buckets of roughly
+    COALESCE_BUCKET_SIZE TracedData, so that every TracedData with the same key lands in the same bucket. Each bucket
+    is then loaded and coalesced in turn, and the coalesced buckets are merged so that the output has one TracedData
+    per key in the order each key was first seen, as when coalescing the whole file at once. Only the keys, and not
+    their TracedData, are held in memory for the whole file.
+
+    :param user: Identifier of the user running this program, for TracedData Metadata.
+    :type user: str
+    :param rapid_pro: Rapid Pro client to coalesce the TracedData in each bucket with.
+    :type rapid_pro: RapidProClient
+    :param input_path: Path to a JSONL file of TracedData to coalesce.
+    :type input_path: str
+    :param output_path: Path to write the coalesced TracedData to.
+    :type output_path: str
+    :param traced_runs_count: Number of TracedData in the input file.
+    :type traced_runs_count: int
+    :param coalesce_key: Key of the TracedData to coalesce by. Every TracedData in the input file must have this key.
+    :type coalesce_key: str
+    """
+    bucket_count = max(1, math.ceil(traced_runs_count / COALESCE_BUCKET_SIZE))
+
+    seen_keys = set()
+    # For each bucket, the position in the order keys were first seen of each key in that bucket, in ascending order.
+    bucket_key_positions = [[] for _ in range(bucket_count)]
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path) or None) as buckets_dir:
+        bucket_paths = [f"{buckets_dir}/{i}.jsonl" for i in range(bucket_count)]
+        bucket_files = [open(path, "w") for path in bucket_paths]
+        try:
+            with open(input_path, "r") as f:
+                for line in f:
+                    td = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(io.StringIO(line))[0]
+                    key = td[coalesce_key]
+                    bucket = zlib.crc32(key.encode("utf-8")) % bucket_count
+                    if key not in seen_keys:
+                        bucket_key_positions[bucket].append(len(seen_keys))
+                        seen_keys.add(key)
+                    bucket_files[bucket].write(line)
+        finally:
+            for bucket_file in bucket_files:
+                bucket_file.close()
+
+        coalesced_paths = [f"{buckets_dir}/{i}_coalesced.jsonl" for i in range(bucket_count)]
+        for path, coalesced_path, key_positions in zip(bucket_paths, coalesced_paths, bucket_key_positions):
+            with open(path, "r") as f:
+                traced_runs = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
+            traced_runs = rapid_pro.coalesce_traced_runs_by_key(user, traced_runs, coalesce_key)
+            assert len(traced_runs) == len(key_positions)
+            with open(coalesced_path, "w") as f:
+                TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, f)
+
+        # Each coalesced bucket has one TracedData per line, in the order its keys were first seen, so merge the
+        # buckets' lines by those keys' positions.
+        coalesced_files = [open(path, "r") for path in coalesced_paths]
+        try:
+            with open(output_path, "w") as output_f:
+                for _, line in heapq.merge(*[zip(key_positions, f)
+                                             for key_positions, f in zip(bucket_key_positions, coalesced_files)]):
+                    output_f.write(line)
+        finally:
+            for coalesced_file in coalesced_files:
+                coalesced_file.close()
+
+
+class _SharedExportState(object):
+    def __init__(self, contacts_cache, phone_number_uuid_table, flow_count):
+        """
+        State shared between the workers exporting each flow.
+
+        The contacts cache and phone number <-> UUID table are only read or updated while holding `lock`. New contacts
+        are downloaded without holding the lock, then merged into the cache while holding it. Flows convert
+        their runs in configuration order (flow i waits for `conversion_complete[i - 1]`), so the contacts are
+        refreshed and new phone numbers are added to the table in exactly the same order as they would be by a
+        sequential export.
+        """
+        self.lock = threading.Lock()
+        self.contacts_cache = contacts_cache
+        self.phone_number_uuid_table = phone_number_uuid_table
+        self.conversion_complete = [threading.Event() for _ in range(flow_count)]
+
+
+def export_flow(user, rapid_pro, pipeline_configuration, flow_index, flow_name, coalesce, raw_data_dir, shared_state,
+                full_refetch=False):
+    """
+    Downloads the runs for a flow, converts them to TracedData, and exports them to `<raw_data_dir>/<flow_name>.jsonl`.
+
+    The runs are downloaded to a temporary file, then converted and written one page at a time in ascending order of
+    modified_on, so memory use does not depend on the size of the flow. If `coalesce` is set, the exported runs are
+    then coalesced by avf_phone_id in bounded memory.
+
+    This is safe to run concurrently for different flows which share the same `shared_state`. The downloading and
+    coalescing of different flows overlap, but flows are converted one at a time, in configuration order.
+    """
+    output_file_path = f"{raw_data_dir}/{flow_name}.jsonl"
+    traced_runs_path = f"{output_file_path}.tmp"
+    print(f"Exporting flow '{flow_name}' to '{output_file_path}'...")
+
+    runs_cache = FlowRunsCache(raw_data_dir, flow_name)
+    cursor = None if full_refetch else runs_cache.load_cursor()
+
+    traced_runs_count = 0
+    IOUtils.ensure_dirs_exist_for_file(output_file_path)
+    with tempfile.TemporaryFile("w+", dir=raw_data_dir) as spool_f:
+        try:
+            downloaded_runs = download_raw_runs(rapid_pro, flow_name, spool_f, cursor)
+
+            if flow_index > 0:
+                shared_state.conversion_complete[flow_index - 1].wait()
+
+            # Opening the cache for writing invalidates the cursor until writing is complete, so the cursor was read
+            # above, before this.
+            with runs_cache.open_writer() as runs_cache_writer, open(traced_runs_path, "w") as f:
+                for raw_runs in iter_raw_runs_pages(runs_cache, downloaded_runs, cursor):
+                    runs_cache_writer.write(raw_runs)
+
+                    # The contacts cache was refreshed when the export started, so only needs refreshing again if
+                    # this page has runs from contacts which were created or modified after that.
+                    new_contacts = None
+                    with shared_state.lock:
+                        contacts_missing = not shared_state.contacts_cache.has_contacts_for_runs(raw_runs)
+                        if contacts_missing:
+                            contacts_newest_modified_on = shared_state.contacts_cache.newest_modified_on()
+                    if contacts_missing:
+                        # Download the new contacts without holding the lock, so that the other flows' workers
+                        # aren't blocked on the download.
+                        new_contacts = ContactsCache.download_contacts(rapid_pro, contacts_newest_modified_on)
+
+                    with shared_state.lock:
+                        if new_contacts is not None:
+                            shared_state.contacts_cache.merge(new_contacts)
+                        traced_runs = rapid_pro.convert_runs_to_traced_data(
+                            user, raw_runs, shared_state.contacts_cache.contacts_for_runs(raw_runs),
+                            shared_state.phone_number_uuid_table, pipeline_configuration.rapid_pro_test_contact_uuids
+                        )
+
+                    TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, f)
+                    traced_runs_count += len(traced_runs)
+
+            with shared_state.lock:
+                shared_state.phone_number_uuid_table.commit()
+        finally:
+            # Release the next flow even if this one failed, so that the failure is reported rather than deadlocking.
+            shared_state.conversion_complete[flow_index].set()
+
+    if coalesce:
+        coalesce_traced_runs_file(user, rapid_pro, traced_runs_path, output_file_path, traced_runs_count)
+        os.remove(traced_runs_path)
+    else:
+        os.replace(traced_runs_path, output_file_path)
+    print(f"Exported {traced_runs_count} runs for flow '{flow_name}'")
+
+
+def export_flows(user, rapid_pro_factory, pipeline_configuration, raw_data_dir, phone_number_uuid_table,
+                 contacts_cache_path=None, full_refetch=False, max_workers=4):
+    """
+    Exports all the activation and survey flows in the pipeline configuration, using a pool of up to `max_workers`
+    threads so that the flows' runs are downloaded concurrently.
+
+    :param rapid_pro_factory: Function which returns a new Rapid Pro client. Each worker thread constructs its own
+                              client with this.
+    :type rapid_pro_factory: function of () -> PagingRapidProClient
+    :param phone_number_uuid_table: Phone number <-> UUID table to de-identify the runs with. New phone numbers are
+                                    committed to this table after each flow is exported.
+    :type phone_number_uuid_table: SQLitePhoneNumberUuidTable
+    :param contacts_cache_path: Path to a file to persist the Rapid Pro contacts to between fetches, or None.
+                                If None, all the contacts are downloaded on every fetch.
+    :type contacts_cache_path: str | None
+    """
+    thread_local = threading.local()
+
+    def get_rapid_pro():
+        if not hasattr(thread_local, "rapid_pro"):
+            thread_local.rapid_pro = rapid_pro_factory()
+        return thread_local.rapid_pro
+
+    # Survey flows are coalesced by avf_phone_id, so that there is one TracedData per respondent per survey.
+    flows = [(show, False) for show in pipeline_configuration.activation_flow_names] + \
+            [(survey, True) for survey in pipeline_configuration.survey_flow_names]
+
+    contacts_cache = ContactsCache(contacts_cache_path)
+    contacts_cache.load()
+    new_contacts_count = contacts_cache.refresh(get_rapid_pro())
+    print(f"Downloaded {new_contacts_count} new or modified contacts")
+    shared_state = _SharedExportState(contacts_cache, phone_number_uuid_table, len(flows))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                lambda i, flow_name, coalesce: export_flow(
+                    user, get_rapid_pro(), pipeline_configuration, i, flow_name, coalesce, raw_data_dir,
+                    shared_state, full_refetch),
+                i, flow_name, coalesce
+            )
+            for i, (flow_name, coalesce) in enumerate(flows)
+        ]
+
+        # Wait for the flows in configuration order, re-raising the first failure.
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            contacts_cache.save()
 
-from src.lib import PipelineConfiguration
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetches all the raw data for this project from Rapid Pro. "
@@ -21,9 +334,17 @@ if __name__ == "__main__":
     parser.add_argument("pipeline_configuration_file_path", metavar="pipeline-configuration-file",
                         help="Path to the pipeline configuration json file")
     parser.add_argument("phone_number_uuid_table_path", metavar="phone-number-uuid-table-path",
-                        help="Path to a ")
+                        help="Path to the SQLite phone number <-> UUID table to de-identify the runs with")
     parser.add_argument("raw_data_dir", metavar="raw-data-dir",
                         help="Path to a directory to save the raw data to")
+    parser.add_argument("--full-refetch", action="store_true",
+                        help="Download every run in every flow, instead of only the runs modified since the last "
+                             "fetch into raw-data-dir")
+    parser.add_argument("--max-workers", type=int, default=4,
+                        help="Maximum number of flows to export concurrently")
+    parser.add_argument("--contacts-cache-path", metavar="contacts-cache-path",
+                        help="Path to a file to cache the Rapid Pro contacts in between fetches. If set, only the "
+                             "contacts modified since the last fetch are downloaded")
 
     args = parser.parse_args()
 
@@ -32,6 +353,9 @@ if __name__ == "__main__":
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     phone_number_uuid_table_path = args.phone_number_uuid_table_path
     raw_data_dir = args.raw_data_dir
+    full_refetch = args.full_refetch
+    max_workers = args.max_workers
+    contacts_cache_path = args.contacts_cache_path
 
     # Read the settings from the configuration file
     with open(pipeline_configuration_file_path) as f:
@@ -51,46 +375,10 @@ if __name__ == "__main__":
     rapid_pro_token = credentials_blob.download_as_string().strip().decode("utf-8")
     print("Downloaded Rapid Pro token.")
 
-    with open(phone_number_uuid_table_path) as f:
-        phone_number_uuid_table = PhoneNumberUuidTable.load(f)
-
-    rapid_pro = RapidProClient(pipeline_configuration.rapid_pro_domain, rapid_pro_token)
-    raw_contacts = rapid_pro.get_raw_contacts()
-
-    # Download all the runs for each of the radio shows
-    for show in pipeline_configuration.activation_flow_names:
-        output_file_path = f"{raw_data_dir}/{show}.jsonl"
-        print(f"Exporting show '{show}' to '{output_file_path}'...")
-
-        flow_id = rapid_pro.get_flow_id(show)
-        raw_runs = rapid_pro.get_raw_runs_for_flow_id(flow_id)
-        raw_contacts = rapid_pro.update_raw_contacts_with_latest_modified(raw_contacts)
-        traced_runs = rapid_pro.convert_runs_to_traced_data(
-            user, raw_runs, raw_contacts, phone_number_uuid_table, pipeline_configuration.rapid_pro_test_contact_uuids)
-
-        with open(phone_number_uuid_table_path, "w") as f:
-            phone_number_uuid_table.dump(f)
-
-        IOUtils.ensure_dirs_exist_for_file(output_file_path)
-        with open(output_file_path, "w") as f:
-            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, f)
-
-
-    # Download all the runs for each of the follow-up and demog surveys
-    for survey in pipeline_configuration.survey_flow_names:
-        output_file_path = f"{raw_data_dir}/{survey}.jsonl"
-        print(f"Exporting survey '{survey}' to '{output_file_path}'...")
-
-        flow_id = rapid_pro.get_flow_id(survey)
-        raw_runs = rapid_pro.get_raw_runs_for_flow_id(flow_id)
-        raw_contacts = rapid_pro.update_raw_contacts_with_latest_modified(raw_contacts)
-        traced_runs = rapid_pro.convert_runs_to_traced_data(
-            user, raw_runs, raw_contacts, phone_number_uuid_table, pipeline_configuration.rapid_pro_test_contact_uuids)
-        traced_runs = rapid_pro.coalesce_traced_runs_by_key(user, traced_runs, "avf_phone_id")
-
-        with open(phone_number_uuid_table_path, "w") as f:
-            phone_number_uuid_table.dump(f)
+    phone_number_uuid_table = SQLitePhoneNumberUuidTable(phone_number_uuid_table_path)
 
-        IOUtils.ensure_dirs_exist_for_file(output_file_path)
-        with open(output_file_path, "w") as f:
-            TracedDataJsonIO.export_traced_data_iterable_to_jsonl(traced_runs, f)
+    export_flows(
+        user, lambda: PagingRapidProClient(pipeline_configuration.rapid_pro_domain, rapid_pro_token),
+        pipeline_configuration, raw_data_dir, phone_number_uuid_table, contacts_cache_path, full_refetch, max_workers
+    )
+    phone_number_uuid_table.close()
@@ -0,0 +1,24 @@
+import argparse
+
+from src.lib import SQLitePhoneNumberUuidTable
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrates a JSON phone number <-> UUID table to the SQLite table "
+                                                 "used by fetch_raw_data.py and pipeline.py. "
+                                                 "This script must be run from its parent directory.")
+
+    parser.add_argument("json_table_path", metavar="json-table-path",
+                        help="Path to the JSON phone number <-> UUID table to migrate from")
+    parser.add_argument("sqlite_table_path", metavar="sqlite-table-path",
+                        help="Path to the SQLite phone number <-> UUID table to migrate to. "
+                             "If this table already exists, mappings it already contains are left unchanged")
+
+    args = parser.parse_args()
+
+    json_table_path = args.json_table_path
+    sqlite_table_path = args.sqlite_table_path
+
+    print(f"Migrating phone number <-> UUID table '{json_table_path}' to '{sqlite_table_path}'...")
+    table = SQLitePhoneNumberUuidTable.migrate_from_json(json_table_path, sqlite_table_path)
+    print(f"Migrated. The SQLite table now contains {len(table.uuids())} phone numbers")
+    table.close()
@@ -1,10 +1,11 @@
 import argparse
+import glob
 import json
 import os
 from urllib.parse import urlparse
 
 from core_data_modules.traced_data.io import TracedDataJsonIO
-from core_data_modules.util import PhoneNumberUuidTable, IOUtils
+from core_data_modules.util import IOUtils
 from google.cloud import storage
 from storage.google_drive import drive_client_wrapper
 from core_data_modules.logging import Logger
@@ -13,11 +14,19 @@ from src import CombineRawDatasets, TranslateRapidProKeys, AutoCodeShowMessages,
     ProductionFile, AutoCodeSurveys, ApplyManualCodes, AnalysisFile, AdvertPhoneNumbers, WSCorrection, \
     FilterNOP
 
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, SQLitePhoneNumberUuidTable, RawDataLoader, RawDataSnapshot, \
+    StageCheckpoints, StageCache, PipelineStage, PipelineStageRunner, StageReport, CodaDatasetCache, PipelineTracer, \
+    CleanerCache, CodingPlanRegistry
 
 Logger.set_project_name("IMAQAL")
 log = Logger(__name__)
 
+PIPELINE_STAGE_NAMES = [
+     "CombineRawDatasets", "TranslateRapidProKeys", "WSCorrection", "AutoCodeShowMessages", "ProductionFile",
+     "AutoCodeSurveys", "ApplyManualCodes", "AdvertPhoneNumbers", "FilterNOP", "AnalysisFile", "WriteTracedData",
+     "UploadToDrive"
+]
+
 if __name__ == "__main__":
      parser = argparse.ArgumentParser(description="Runs the post-fetch phase of the ReDSS pipeline",
                                      # Support \n and long lines
@@ -30,7 +39,7 @@ if __name__ == "__main__":
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket")
      parser.add_argument("phone_number_uuid_table_path", metavar="phone-number-uuid-table-path",
-                        help="JSON file containing the phone number <-> UUID lookup table for the messages/surveys "
+                        help="SQLite file containing the phone number <-> UUID lookup table for the messages/surveys "
                              "datasets")
 
      parser.add_argument("raw_data_dir", metavar="raw-data-dir",
@@ -55,6 +64,42 @@ if __name__ == "__main__":
                              "radio show production")
      parser.add_argument("advert_phone_numbers_csv_output_path", metavar="advert_phone_numbers_csv_output_path",
                             help="Path to a CSV file to write phone numbers to send adverts to "),
+     parser.add_argument("--raw-data-loader-processes", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes to load the raw data files with. "
+                             "If 1, the files are loaded serially (default: the number of CPUs)")
+     parser.add_argument("--ws-correction-processes", type=int, default=1,
+                        help="Number of processes to move wrong scheme messages with. "
+                             "If 1, the messages are moved serially. Each uid's TracedData are pickled to and from "
+                             "the worker processes, so more processes are only faster when moving the messages costs "
+                             "more than pickling them (default: 1)")
+     parser.add_argument("--raw-data-snapshot-path", metavar="raw-data-snapshot-path",
+                        help="Path to a binary snapshot of the loaded raw data. If the snapshot is up to date with the "
+                             "files in raw-data-dir, the raw data is loaded from it instead of from those files. "
+                             "Otherwise, the raw data is loaded from raw-data-dir and the snapshot is rebuilt")
+
+     parser.add_argument("--checkpoint-dir", metavar="checkpoint-dir",
+                        help="Directory to save a checkpoint of the data output by each stage to, so that a later run "
+                             "can resume from part way through the pipeline using --resume-from-stage")
+     parser.add_argument("--resume-from-stage", metavar="stage-name", choices=PIPELINE_STAGE_NAMES,
+                        help="Name of the stage to resume the pipeline from. The data output by the stage before this "
+                             "one is reloaded from its checkpoint in checkpoint-dir, and only this and the remaining "
+                             "stages are run. Stages are, in order:\n" + "\n".join(PIPELINE_STAGE_NAMES))
+
+     parser.add_argument("--stage-cache-dir", metavar="stage-cache-dir",
+                        help="Directory to cache the outputs of each stage in. If set, stages whose inputs haven't "
+                             "changed since the last run which used this cache are skipped, and their outputs are "
+                             "restored from the cache")
+
+     parser.add_argument("--stage-report-output-path", metavar="stage-report-output-path",
+                        help="Path to write a JSON report of the time, memory and throughput of each stage to "
+                             "(default: stage_report.json, in the same directory as json-output-path)")
+     parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the peak memory allocated by each stage, as measured by tracemalloc. "
+                             "This slows the pipeline down")
+     parser.add_argument("--trace-output-path", metavar="trace-output-path",
+                        help="Path to write a JSON Lines trace of the moves made by WS correction to, with one event "
+                             "per uid. If not set, no trace is made. Stages restored from the stage cache are not "
+                             "traced")
 
      args = parser.parse_args()
 
@@ -77,6 +122,18 @@ if __name__ == "__main__":
      csv_by_individual_output_path = args.csv_by_individual_output_path
      production_csv_output_path = args.production_csv_output_path
      advert_phone_numbers_csv_output_path = args.advert_phone_numbers_csv_output_path
+     raw_data_loader_processes = args.raw_data_loader_processes
+     ws_correction_processes = args.ws_correction_processes
+     raw_data_snapshot_path = args.raw_data_snapshot_path
+     checkpoint_dir = args.checkpoint_dir
+     resume_from_stage = args.resume_from_stage
+     stage_cache_dir = args.stage_cache_dir
+     stage_report_output_path = args.stage_report_output_path
+     trace_memory = args.trace_memory
+     trace_output_path = args.trace_output_path
+
+     if stage_report_output_path is None:
+          stage_report_output_path = os.path.join(os.path.dirname(json_output_path), "stage_report.json")
 
      # Load the pipeline configuration file
      print("Loading Pipeline Configuration File...")
@@ -100,71 +157,63 @@ if __name__ == "__main__":
 
      # Load phone number <-> UUID table
      print("Loading Phone Number <-> UUID Table...")
-     with open(phone_number_uuid_table_path, "r") as f:
-          phone_number_uuid_table = PhoneNumberUuidTable.load(f)
-
-     # Load messages
-     messages_datasets = []
-     for i, activation_flow_name in enumerate(pipeline_configuration.activation_flow_names):
-          raw_activation_path = f"{raw_data_dir}/{activation_flow_name}.jsonl"
-          log.info(f"Loading {raw_activation_path}...")
-          with open(raw_activation_path, "r") as f:
-               messages = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
-          log.debug(f"Loaded {len(messages)} messages")
-          messages_datasets.append(messages)
-
-     # Load surveys
-     survey_datasets = []
-     for i, survey_flow_name in enumerate(pipeline_configuration.survey_flow_names):
-          raw_survey_path = f"{raw_data_dir}/{survey_flow_name}.jsonl"
-          log.info(f"Loading {raw_survey_path}...")
-          with open(raw_survey_path, "r") as f:
-               messages = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
-          log.debug(f"Loaded {len(messages)} messages")
-          survey_datasets.append(messages)
-
-     # Add survey data to the messages
-     print("Combining Datasets...")
-     data = CombineRawDatasets.combine_raw_datasets(user, messages_datasets, survey_datasets)
-
-     print("Translating Rapid Pro Keys...")
-     data = TranslateRapidProKeys.translate_rapid_pro_keys(user, data, pipeline_configuration, prev_coded_dir_path)
-
-     print("Redirecting WS messages...")
-     data = WSCorrection.move_wrong_scheme_messages(user, data, prev_coded_dir_path)
-
-     print("Auto Coding Messages...")
-     data = AutoCodeShowMessages.auto_code_show_messages(user, data, icr_output_dir, coded_dir_path)
-
-     print("Exporting production CSV...")
-     data = ProductionFile.generate(data, production_csv_output_path)
-
-     print("Auto Coding Surveys...")
-     data = AutoCodeSurveys.auto_code_surveys(user, data, phone_number_uuid_table, coded_dir_path)
-
-     print("Applying manual codes...")
-     data = ApplyManualCodes.apply_manual_codes(user, data, prev_coded_dir_path)
-
-     print("Exporting advert CSV...")
-     advert_phone_numbers = AdvertPhoneNumbers.generate(data, phone_number_uuid_table, advert_phone_numbers_csv_output_path)
-
-     print("Filtering out RQA Messages labelled as Noise_Other_Project...")
-     data = FilterNOP.filter_rqa_noise_other_project(data)
-
-     print("Generating Analysis CSVs...")
-     data = AnalysisFile.generate(user, data, csv_by_message_output_path, csv_by_individual_output_path)
-
-     print("Writing TracedData to file...")
-     IOUtils.ensure_dirs_exist_for_file(json_output_path)
-     with open(json_output_path, "w") as f:
-          TracedDataJsonIO.export_traced_data_iterable_to_jsonl(data, f)
-
-     # Upload to Google Drive, if requested.
-     # Note: This should happen as late as possible in order to reduce the risk of the remainder of the pipeline failing
-     # after a Drive upload has occurred. Failures could result in inconsistent outputs or outputs with no
-     # traced data log.
-     if pipeline_configuration.drive_upload is not None:
-          print("Uploading CSVs to Google Drive...")
+     phone_number_uuid_table = SQLitePhoneNumberUuidTable(phone_number_uuid_table_path)
+
+     stage_cache = None
+     if stage_cache_dir is not None:
+          # Changes to the pipeline's code invalidate every cached stage.
+          # The code is found relative to this file, so that it is fingerprinted whichever directory this is run from.
+          code_dir = os.path.dirname(os.path.abspath(__file__))
+          code_paths = [os.path.join(code_dir, "pipeline.py")] + \
+               sorted(glob.glob(os.path.join(code_dir, "src", "**", "*.py"), recursive=True))
+          stage_cache = StageCache(stage_cache_dir, StageCache.fingerprint_files(code_paths))
+
+     # Shared by the stages which import the previously coded Coda files, so that each file is only parsed once
+     coda_dataset_cache = CodaDatasetCache()
+     tracer = PipelineTracer(trace_output_path)
+     cleaner_cache = CleanerCache()
+
+     raw_data_paths = [f"{raw_data_dir}/{flow_name}.jsonl"
+                       for flow_name in pipeline_configuration.activation_flow_names +
+                       pipeline_configuration.survey_flow_names]
+
+     def load_raw_datasets():
+          # Load messages and surveys
+          raw_datasets = None
+          if raw_data_snapshot_path is not None:
+               raw_datasets = RawDataSnapshot.load(raw_data_snapshot_path, raw_data_paths)
+          if raw_datasets is None:
+               raw_datasets = RawDataLoader.load_traced_data_files(raw_data_paths, raw_data_loader_processes)
+               if raw_data_snapshot_path is not None:
+                    RawDataSnapshot.save(raw_data_snapshot_path, raw_data_paths, raw_datasets)
+          messages_datasets = raw_datasets[:len(pipeline_configuration.activation_flow_names)]
+          survey_datasets = raw_datasets[len(pipeline_configuration.activation_flow_names):]
+          return messages_datasets, survey_datasets
+
+     def combine_raw_datasets(data):
+          # Add survey data to the messages
+          messages_datasets, survey_datasets = load_raw_datasets()
+          return CombineRawDatasets.combine_raw_datasets(user, messages_datasets, survey_datasets)
+
+     def generate_advert_phone_numbers(data):
+          AdvertPhoneNumbers.generate(data, phone_number_uuid_table, advert_phone_numbers_csv_output_path)
+          return data
+
+     def write_traced_data(data):
+          IOUtils.ensure_dirs_exist_for_file(json_output_path)
+          with open(json_output_path, "w") as f:
+               TracedDataJsonIO.export_traced_data_iterable_to_jsonl(data, f)
+          return data
+
+     def upload_to_drive(data):
+          # Upload to Google Drive, if requested.
+          # Note: This should happen as late as possible in order to reduce the risk of the remainder of the pipeline
+          # failing after a Drive upload has occurred. Failures could result in inconsistent outputs or outputs with no
+          # traced data log.
+          if pipeline_configuration.drive_upload is None:
+               print("Skipping uploading to Google Drive (because the pipeline configuration json does not contain the "
+                     "key 'DriveUploadPaths')")
+               return data
 
           production_csv_drive_dir = os.path.dirname(pipeline_configuration.drive_upload.production_upload_path)
           production_csv_drive_file_name = os.path.basename(pipeline_configuration.drive_upload.production_upload_path)
@@ -183,14 +232,81 @@ if __name__ == "__main__":
           drive_client_wrapper.update_or_create(csv_by_individual_output_path, individuals_csv_drive_dir,
                                                   target_file_name=individuals_csv_drive_file_name,
                                                   target_folder_is_shared_with_me=True)
-          
+
           traced_data_drive_dir = os.path.dirname(pipeline_configuration.drive_upload.traced_data_upload_path)
           traced_data_drive_file_name = os.path.basename(pipeline_configuration.drive_upload.traced_data_upload_path)
           drive_client_wrapper.update_or_create(json_output_path, traced_data_drive_dir,
                                                   target_file_name=traced_data_drive_file_name,
                                                   target_folder_is_shared_with_me=True)
-     else:
-          print("Skipping uploading to Google Drive (because the pipeline configuration json does not contain the key "
-               "'DriveUploadPaths')")
+          return data
+
+     # Files which each stage reads, in addition to the data output by the previous stage.
+     # A cached stage is only re-run when these files or the values of the data it is given change.
+     prev_coded_paths = sorted({os.path.join(prev_coded_dir_path, plan.coda_filename)
+                                for plan in CodingPlanRegistry.ALL_PLANS})
+     code_scheme_paths = sorted(glob.glob("code_schemes/*.json"))
+     show_coda_output_paths = [os.path.join(coded_dir_path, plan.coda_filename) for plan in
+                               PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS]
+     icr_output_paths = [os.path.join(icr_output_dir, plan.icr_filename) for plan in
+                         PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS]
+     survey_coda_output_paths = [os.path.join(coded_dir_path, plan.coda_filename)
+                                 for plan in PipelineConfiguration.DEMOGS_CODING_PLANS]
+
+     # The stages of the pipeline, in the order they run. Each stage takes the data output by the previous stage and
+     # returns the data for the next one.
+     stages = [
+          PipelineStage("CombineRawDatasets", "Combining Datasets...", combine_raw_datasets,
+                        input_paths=raw_data_paths),
+          PipelineStage("TranslateRapidProKeys", "Translating Rapid Pro Keys...",
+                        lambda data: TranslateRapidProKeys.translate_rapid_pro_keys(
+                             user, data, pipeline_configuration, prev_coded_dir_path),
+                        input_paths=[pipeline_configuration_file_path]),
+          PipelineStage("WSCorrection", "Redirecting WS messages...",
+                        lambda data: WSCorrection.move_wrong_scheme_messages(
+                             user, data, prev_coded_dir_path, coda_dataset_cache, ws_correction_processes, tracer),
+                        input_paths=prev_coded_paths + code_scheme_paths),
+          PipelineStage("AutoCodeShowMessages", "Auto Coding Messages...",
+                        lambda data: AutoCodeShowMessages.auto_code_show_messages(
+                             user, data, icr_output_dir, coded_dir_path, stage_cache),
+                        output_paths=show_coda_output_paths + icr_output_paths),
+          PipelineStage("ProductionFile", "Exporting production CSV...",
+                        lambda data: ProductionFile.generate(data, production_csv_output_path),
+                        output_paths=[production_csv_output_path], modifies_data=False),
+          PipelineStage("AutoCodeSurveys", "Auto Coding Surveys...",
+                        lambda data: AutoCodeSurveys.auto_code_surveys(
+                             user, data, phone_number_uuid_table, coded_dir_path, cleaner_cache),
+                        input_paths=[phone_number_uuid_table_path] + code_scheme_paths,
+                       output_paths=survey_coda_output_paths,
+                        stats=cleaner_cache.stats),
+          PipelineStage("ApplyManualCodes", "Applying manual codes...",
+                        lambda data: ApplyManualCodes.apply_manual_codes(
+                             user, data, prev_coded_dir_path, coda_dataset_cache),
+                        input_paths=prev_coded_paths + code_scheme_paths),
+          PipelineStage("AdvertPhoneNumbers", "Exporting advert CSV...", generate_advert_phone_numbers,
+                        input_paths=[phone_number_uuid_table_path],
+                        output_paths=[advert_phone_numbers_csv_output_path], modifies_data=False),
+          PipelineStage("FilterNOP", "Filtering out RQA Messages labelled as Noise_Other_Project...",
+                        lambda data: FilterNOP.filter_rqa_noise_other_project(data)),
+          PipelineStage("AnalysisFile", "Generating Analysis CSVs...",
+                        lambda data: AnalysisFile.generate(
+                             user, data, csv_by_message_output_path, csv_by_individual_output_path),
+                        input_paths=code_scheme_paths,
+                        output_paths=[csv_by_message_output_path, csv_by_individual_output_path]),
+          PipelineStage("WriteTracedData", "Writing TracedData to file...", write_traced_data,
+                        output_paths=[json_output_path], modifies_data=False),
+          PipelineStage("UploadToDrive", "Uploading CSVs to Google Drive...", upload_to_drive,
+                        modifies_data=False, cacheable=False)
+     ]
+     assert [stage.name for stage in stages] == PIPELINE_STAGE_NAMES
+
+     checkpoints = None
+     if checkpoint_dir is not None:
+          checkpoints = StageCheckpoints(checkpoint_dir)
+     assert resume_from_stage is None or checkpoints is not None, "--resume-from-stage requires a --checkpoint-dir"
+
+     report = StageReport(stage_report_output_path, trace_memory)
+     PipelineStageRunner.run_stages(stages, checkpoints, stage_cache, resume_from_stage, report)
+     print(f"Wrote stage report to '{stage_report_output_path}'")
+     tracer.close()
 
      print("Python script complete")
@@ -10,11 +10,19 @@ fi
 
 DATA_DIR=$1
 
+if [ -f "$DATA_DIR/UUIDs/phone_uuids.db" ]; then
+    echo "Error: '$DATA_DIR/UUIDs/phone_uuids.db' already exists; refusing to overwrite."
+    echo "    To generate a new, empty phone number <-> UUID table, delete phone_uuids.db file first."
+    exit 1
+fi
+
 if [ -f "$DATA_DIR/UUIDs/phone_uuids.json" ]; then
-    echo "Error: '$DATA_DIR/UUIDs/phone_uuids.json' already exists; refusing to overwrite."
-    echo "    To generate a new, empty phone number <-> UUID table, delete phone_uuids.json file first."
+    echo "Error: '$DATA_DIR/UUIDs/phone_uuids.json' already exists."
+    echo "    Migrate it to a SQLite table by running the following command in the project root:"
+    echo "    pipenv run python migrate_phone_number_uuid_table.py \"$DATA_DIR/UUIDs/phone_uuids.json\" \"$DATA_DIR/UUIDs/phone_uuids.db\""
     exit 1
 fi
 
+# An empty file is a valid, empty SQLite database. The phone number <-> UUID table is created in it on first use.
 mkdir -p "$DATA_DIR/UUIDs"
-echo "{}" > "$DATA_DIR/UUIDs/phone_uuids.json"
+touch "$DATA_DIR/UUIDs/phone_uuids.db"
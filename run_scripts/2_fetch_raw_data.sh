@@ -10,6 +10,9 @@ while [[ $# -gt 0 ]]; do
 
             CPU_PROFILE_ARG="--profile-cpu $CPU_PROFILE_OUTPUT_PATH"
             shift 2;;
+        --full-refetch)
+            FULL_REFETCH_ARG="--full-refetch"
+            shift;;
         --)
             shift
             break;;
@@ -19,8 +22,9 @@ while [[ $# -gt 0 ]]; do
 done
 
 if [[ $# -ne 4 ]]; then
-    echo "Usage: ./2_fetch_raw_data.sh [--profile-cpu <cpu-profile-output-path>] <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path> <data-root>"
-    echo "Fetches all the raw data from Rapid Pro and converts to TracedData"
+    echo "Usage: ./2_fetch_raw_data.sh [--profile-cpu <cpu-profile-output-path>] [--full-refetch] <user> <google-cloud-credentials-file-path> <pipeline-configuration-file-path> <data-root>"
+    echo "Fetches all the raw data from Rapid Pro and converts to TracedData."
+    echo "Only runs modified since the last fetch are downloaded, unless --full-refetch is set"
     exit
 fi
 
@@ -32,6 +36,7 @@ DATA_ROOT=$4
 mkdir -p "$DATA_ROOT/Raw Data"
 
 cd ..
-./docker-run-fetch-raw-data.sh ${CPU_PROFILE_ARG} \
+./docker-run-fetch-raw-data.sh ${CPU_PROFILE_ARG} ${FULL_REFETCH_ARG} \
+    --contacts-cache "$DATA_ROOT/Contacts/contacts.jsonl" \
     "$USER" "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$PIPELINE_CONFIGURATION_FILE_PATH" \
-     "$DATA_ROOT/UUIDs/phone_uuids.json" "$DATA_ROOT/Raw Data"
+     "$DATA_ROOT/UUIDs/phone_uuids.db" "$DATA_ROOT/Raw Data"
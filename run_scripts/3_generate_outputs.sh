@@ -9,6 +9,12 @@ while [[ $# -gt 0 ]]; do
             CPU_PROFILE_OUTPUT_PATH="$2"
             CPU_PROFILE_ARG="--profile-cpu $CPU_PROFILE_OUTPUT_PATH"
             shift 2;;
+        --checkpoint)
+            CHECKPOINT=true
+            shift;;
+        --resume-from-stage)
+            RESUME_FROM_STAGE="$2"
+            shift 2;;
         --)
             shift
             break;;
@@ -18,8 +24,9 @@ while [[ $# -gt 0 ]]; do
 done
 
 if [[ $# -ne 3 ]]; then
-    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] <user> <google-cloud-credentials-file-path> <data-root>"
+    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] [--checkpoint] [--resume-from-stage <stage-name>] <user> <google-cloud-credentials-file-path> <data-root>"
     echo "Generates the outputs needed downstream from raw data files generated by step 2 and uploads to Google Drive"
+    echo "If --checkpoint is set, the output of each stage is saved to <data-root>/Checkpoints, so that a failed run can be resumed with --resume-from-stage"
     exit
 fi
 
@@ -27,12 +34,18 @@ USER=$1
 GOOGLE_CLOUD_CREDENTIALS_FILE_PATH=$2
 DATA_ROOT=$3
 
+if [[ "$CHECKPOINT" = true || -n "$RESUME_FROM_STAGE" ]]; then
+    CHECKPOINT_DIR="$DATA_ROOT/Checkpoints"
+fi
+
 mkdir -p "$DATA_ROOT/Coded Coda Files"
 mkdir -p "$DATA_ROOT/Outputs"
 
 cd ..
-./docker-run.sh ${CPU_PROFILE_ARG} \
-    "$USER" "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$DATA_ROOT/UUIDs/phone_uuids.json" \
+./docker-run.sh ${CPU_PROFILE_ARG} ${CHECKPOINT_DIR:+--checkpoint-dir "$CHECKPOINT_DIR"} \
+    ${RESUME_FROM_STAGE:+--resume-from-stage "$RESUME_FROM_STAGE"} --raw-data-snapshot "$DATA_ROOT/raw_data_snapshot.pickle" \
+    --stage-cache-dir "$DATA_ROOT/StageCache" \
+    "$USER" "$GOOGLE_CLOUD_CREDENTIALS_FILE_PATH" "$DATA_ROOT/UUIDs/phone_uuids.db" \
     "$DATA_ROOT/Raw Data" "$DATA_ROOT/Coded Coda Files/" "$DATA_ROOT/Outputs/traced_data.json" \
     "$DATA_ROOT/Outputs/ICR/" "$DATA_ROOT/Outputs/Coda Files/" "$DATA_ROOT/Outputs/icraf_s01_messages.csv" \
     "$DATA_ROOT/Outputs/icraf_s01_individuals.csv" "$DATA_ROOT/Outputs/icraf_s01_production.csv" \
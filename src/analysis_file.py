@@ -7,7 +7,7 @@ from core_data_modules.traced_data.io import TracedDataCSVIO
 from core_data_modules.traced_data.util import FoldTracedData
 from core_data_modules.util import TimeUtils
 
-from src.lib import PipelineConfiguration, AnalysisKeys
+from src.lib import PipelineConfiguration, CodingPlanRegistry, AnalysisKeys
 from src.lib.pipeline_configuration import CodeSchemes
 
 class ConsentUtils(object):
@@ -99,11 +99,12 @@ class AnalysisFile(object):
             if plan.raw_field not in demog_and_follow_up_keys:
                 demog_and_follow_up_keys.append(plan.raw_field)
             
-        # Convert demog and follow-up codes to their string values
+        # Convert demog and follow-up codes to their string values.
+        # Every plan has a coded label by now, including those with no raw field (which are labelled TRUE_MISSING).
         for td in data:
             td.append_data(
                 {plan.analysis_file_key: plan.code_scheme.get_code_with_id(td[plan.coded_field]["CodeID"]).string_value
-                    for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS
+                    for plan in CodingPlanRegistry.SURVEY_PLANS
                     if plan.analysis_file_key is not None}, 
                     Metadata(user, Metadata.get_call_location(), time.time())
             )
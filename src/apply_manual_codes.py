@@ -6,10 +6,9 @@ from core_data_modules.cleaners import Codes
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.cleaners.location_tools import KenyaLocations
 from core_data_modules.traced_data import Metadata
-from core_data_modules.traced_data.io import TracedDataCodaV2IO
 from core_data_modules.util import TimeUtils
 
-from src.lib import PipelineConfiguration, CodeSchemes
+from src.lib import PipelineConfiguration, CodingPlanRegistry, CodeSchemes, CodaDatasetCache, CodaImport
 
 
 class ApplyManualCodes(object):
@@ -69,11 +68,13 @@ class ApplyManualCodes(object):
                 }, Metadata(user, Metadata.get_call_location(), time.time()))
 
     def _impute_coding_error_codes(user, data):
+        # Every plan is checked, not just those whose raw field is in each td, because WS correction moves messages
+        # out of their raw fields but leaves their "_WS_correct_dataset" labels behind.
         for td in data:
             coding_error_dict = dict()
-            for plan in PipelineConfiguration.RQA_CODING_PLANS:
-                if f"{plan.coded_field}_WS_correct_dataset" in td:
-                    if td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"] == \
+            for plan in CodingPlanRegistry.RQA_PLANS:
+                if plan.ws_correct_dataset_field in td:
+                    if td[plan.ws_correct_dataset_field]["CodeID"] == \
                             CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.CODING_ERROR).code_id:
                         coding_error_dict[plan.coded_field] = [
                             CleaningUtils.make_label_from_cleaner_code(
@@ -90,9 +91,9 @@ class ApplyManualCodes(object):
                                     Metadata.get_call_location()
                                 ).to_dict()
 
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-                if f"{plan.coded_field}_WS_correct_dataset" in td:
-                    if td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"] == \
+            for plan in CodingPlanRegistry.SURVEY_PLANS:
+                if plan.ws_correct_dataset_field in td:
+                    if td[plan.ws_correct_dataset_field]["CodeID"] == \
                             CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.CODING_ERROR).code_id:
                         coding_error_dict[plan.coded_field] = \
                             CleaningUtils.make_label_from_cleaner_code(
@@ -105,27 +106,25 @@ class ApplyManualCodes(object):
                            Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
     @classmethod
-    def apply_manual_codes(cls, user, data, coda_input_dir):
+    def apply_manual_codes(cls, user, data, coda_input_dir, coda_dataset_cache=None):
+        if coda_dataset_cache is None:
+            coda_dataset_cache = CodaDatasetCache()
+
         # Merge manually coded radio show files into the cleaned dataset
+        coda_imports = []
         for plan in PipelineConfiguration.RQA_CODING_PLANS:
-            rqa_messages = [td for td in data if plan.raw_field in td]
             coda_input_path = path.join(coda_input_dir, plan.coda_filename)
-    
-            f = None
-            try:
-                if path.exists(coda_input_path):
-                    f = open(coda_input_path, "r")
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
-                    user, rqa_messages, plan.id_field, {plan.coded_field: plan.code_scheme}, f)
-                
-                if plan.binary_code_scheme is not None:
-                    if f is not None:
-                        f.seek(0)
-                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                        user, rqa_messages, plan.id_field, {plan.binary_coded_field: plan.binary_code_scheme}, f)
-            finally:
-                if f is not None:
-                    f.close()
+            if not path.exists(coda_input_path):
+                coda_input_path = None
+
+            coda_imports.append(CodaImport(plan.id_field, {plan.coded_field: plan.code_scheme}, coda_input_path,
+                                           multi_coded=True, required_key=plan.raw_field))
+
+            if plan.binary_code_scheme is not None:
+                coda_imports.append(CodaImport(plan.id_field, {plan.binary_coded_field: plan.binary_code_scheme},
+                                               coda_input_path, required_key=plan.raw_field))
+
+        coda_dataset_cache.import_all(user, data, coda_imports)
 
         # Label the RQA for which there is no response yet as TRUE MISSING
         for td in data:
@@ -209,24 +208,22 @@ class ApplyManualCodes(object):
         # Recursion depth currently exceeding
         # TODO: Investigate/address the cause of this.
         sys.setrecursionlimit(10000)
+        coda_imports = []
         for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-            f = None
-            try:
-                coda_input_path = path.join(coda_input_dir, plan.coda_filename)
-                if path.exists(coda_input_path):
-                    f = open(coda_input_path, "r")
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                    user, data, plan.id_field, {plan.coded_field: plan.code_scheme}, f)
-            finally:
-                if f is not None:
-                    f.close()
+            coda_input_path = path.join(coda_input_dir, plan.coda_filename)
+            if not path.exists(coda_input_path):
+                coda_input_path = None
+
+            coda_imports.append(CodaImport(plan.id_field, {plan.coded_field: plan.code_scheme}, coda_input_path))
+
+        coda_dataset_cache.import_all(user, data, coda_imports)
         
         # Not everyone will have answered all of the demographic and follow-up survey flows flows.
         # Label demographic and follow-up survey questions which had no responses as TRUE_MISSING.
         # Label data which is just the empty string as NOT_CODED.
         for td in data:
             missing_dict = dict()
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
+            for plan in CodingPlanRegistry.SURVEY_PLANS:
                 if plan.raw_field not in td:
                     na_label = CleaningUtils.make_label_from_cleaner_code(
                         plan.code_scheme, plan.code_scheme.get_code_with_control_code(Codes.TRUE_MISSING),
@@ -7,7 +7,7 @@ from core_data_modules.traced_data import Metadata
 from core_data_modules.traced_data.io import TracedDataCSVIO, TracedDataCodaV2IO
 from core_data_modules.util import IOUtils
 
-from src.lib import PipelineConfiguration, MessageFilters, ICRTools
+from src.lib import PipelineConfiguration, MessageFilters, ICRTools, StageCache
 from src.lib.channels import Channels
 
 class AutoCodeShowMessages(object):
@@ -20,20 +20,19 @@ class AutoCodeShowMessages(object):
     ICR_SEED = 0
 
     @classmethod
-    def auto_code_show_messages(cls, user, data, icr_output_dir, coda_output_dir):
-        # Filter out test messages sent by AVF
+    def auto_code_show_messages(cls, user, data, icr_output_dir, coda_output_dir, stage_cache=None):
+        # Filter out test messages sent by AVF, runs which don't contain a response to any week's question, and runs
+        # sent outwith the project start and end dates, in a single pass
+        filters = []
         if not PipelineConfiguration.DEV_MODE:
-            data = MessageFilters.filter_test_messages(data)
-        
-        # Filter for runs which don't contain a response to any week's question
-        data = MessageFilters.filter_empty_messages(data, cls.RQA_KEYS)
+            filters.append(MessageFilters.not_test_message())
+        filters.append(MessageFilters.not_empty_message(cls.RQA_KEYS))
+        filters.append(MessageFilters.in_time_range(
+            cls.SENT_ON_KEY, PipelineConfiguration.PROJECT_START_DATE, PipelineConfiguration.PROJECT_END_DATE))
+        data = MessageFilters.apply_filters(data, filters)
 
-        # Filter out runs sent outwith the project start and end dates
-        data = MessageFilters.filter_time_range(
-            data, cls.SENT_ON_KEY, PipelineConfiguration.PROJECT_START_DATE, PipelineConfiguration.PROJECT_END_DATE)
-    
         # Label each message with channel keys
-        Channels.set_channel_keys(user, data, cls.SENT_ON_KEY)
+        Channels.set_channel_keys(user, data, cls.SENT_ON_KEY, vectorised=True)
         
         # Output RQA and follow up surveys messages to Coda
         IOUtils.ensure_dirs_exist(coda_output_dir)
@@ -41,10 +40,21 @@ class AutoCodeShowMessages(object):
             TracedDataCodaV2IO.compute_message_ids(user, data, plan.raw_field, plan.id_field)
 
             output_path = path.join(coda_output_dir, plan.coda_filename)
-            with open(output_path, "w") as f:
-                TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2(
-                    data, plan.raw_field, cls.SENT_ON_KEY, plan.id_field, {}, f
-                )
+            def export_coda_file():
+                with open(output_path, "w") as f:
+                    TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2(
+                        data, plan.raw_field, cls.SENT_ON_KEY, plan.id_field, {}, f
+                    )
+
+            if stage_cache is None:
+                export_coda_file()
+            else:
+                # The export only depends on the messages for this plan, so only re-export when those change.
+                # This means that e.g. a change to one survey's Coda file doesn't re-export every show.
+                fingerprint = StageCache.fingerprint_traced_data(
+                    [td for td in data if plan.raw_field in td], [plan.raw_field, cls.SENT_ON_KEY, plan.id_field])
+                stage_cache.run_cached(f"AutoCodeShowMessages.{plan.coda_filename}", fingerprint, [output_path],
+                                       export_coda_file)
        
         # Output RQA and follow up messages for ICR
         IOUtils.ensure_dirs_exist(icr_output_dir)
@@ -56,13 +66,24 @@ class AutoCodeShowMessages(object):
                 if plan.raw_field in td:
                     rqa_and_follow_up_messages.append(td)
                 
-            icr_messages = ICRTools.generate_sample_for_icr(
-                rqa_and_follow_up_messages, cls.ICR_MESSAGES_COUNT, random.Random(cls.ICR_SEED))
-                
             icr_output_path = path.join(icr_output_dir, plan.icr_filename)
-            with open(icr_output_path, "w") as f:
-                TracedDataCSVIO.export_traced_data_iterable_to_csv(
-                    icr_messages, f, headers=[plan.run_id_field, plan.raw_field]
+            def export_icr_file():
+                icr_messages = ICRTools.generate_sample_for_icr(
+                    rqa_and_follow_up_messages, cls.ICR_MESSAGES_COUNT, random.Random(cls.ICR_SEED))
+
+                with open(icr_output_path, "w") as f:
+                    TracedDataCSVIO.export_traced_data_iterable_to_csv(
+                        icr_messages, f, headers=[plan.run_id_field, plan.raw_field]
+                    )
+
+            if stage_cache is None:
+                export_icr_file()
+            else:
+                fingerprint = StageCache.fingerprint(
+                    cls.ICR_MESSAGES_COUNT, cls.ICR_SEED,
+                    StageCache.fingerprint_traced_data(rqa_and_follow_up_messages, [plan.run_id_field, plan.raw_field])
                 )
+                stage_cache.run_cached(f"AutoCodeShowMessages.{plan.icr_filename}", fingerprint, [icr_output_path],
+                                       export_icr_file)
 
         return data
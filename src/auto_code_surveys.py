@@ -3,18 +3,24 @@ from os import path
 
 from core_data_modules.cleaners import Codes
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.logging import Logger
 from core_data_modules.traced_data import Metadata
 from core_data_modules.traced_data.io import TracedDataCodaV2IO
 from core_data_modules.util import IOUtils
 
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, CleanerCache
+
+log = Logger(__name__)
 
 
 class AutoCodeSurveys(object):
     SENT_ON_KEY = "sent_on"
 
     @classmethod
-    def auto_code_surveys(cls, user, data, phone_uuid_table, coda_output_dir):
+    def auto_code_surveys(cls, user, data, phone_uuid_table, coda_output_dir, cleaner_cache=None):
+        if cleaner_cache is None:
+            cleaner_cache = CleanerCache()
+
         # Label missing data
         for td in data:
             missing_dict = dict()
@@ -27,11 +33,20 @@ class AutoCodeSurveys(object):
                     missing_dict[plan.coded_field] = na_label.to_dict()
             td.append_data(missing_dict, Metadata(user, Metadata.get_call_location(), time.time()))
 
-        # Auto-code remaining data
+        # Auto-code remaining data.
+        # Survey answers are repeated on every message a participant sent, so each distinct answer is only cleaned once.
         for plan in PipelineConfiguration.DEMOGS_CODING_PLANS:
             if plan.cleaner is not None:
+                cleaner = cleaner_cache.cleaner_for(plan)
+                cache_info_before = cleaner_cache.cache_info(plan)
                 CleaningUtils.apply_cleaner_to_traced_data_iterable(user, data, plan.raw_field, plan.coded_field,
-                                                                    plan.cleaner, plan.code_scheme)
+                                                                    cleaner, plan.code_scheme)
+                cache_info = cleaner_cache.cache_info(plan)
+
+                distinct_answers_count = cache_info.misses - cache_info_before.misses
+                answers_count = distinct_answers_count + cache_info.hits - cache_info_before.hits
+                log.info(f"Cleaned {distinct_answers_count} distinct answers out of {answers_count} answers to "
+                         f"{plan.raw_field}")
 
         # Output survey answers to coda for manual verification + coding
         IOUtils.ensure_dirs_exist(coda_output_dir)
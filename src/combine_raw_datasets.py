@@ -1,8 +1,71 @@
-from core_data_modules.traced_data import TracedData
+import time
+
+from core_data_modules.traced_data import TracedData, Metadata
+
 
 class CombineRawDatasets(object):
     @staticmethod
     def combine_raw_datasets(user, messages_datasets, surveys_datasets):
+        """
+        Combines the messages datasets into a single list, and adds each respondent's survey responses to each of their
+        messages.
+
+        The survey responses from all the surveys datasets are indexed by avf_phone_id, so each message is looked up
+        once rather than once per surveys dataset.
+
+        Each message has the same survey response TracedData appended to it, in the same order, as by
+        `combine_raw_datasets_one_survey_at_a_time`, so the histories produced have the same shape.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param messages_datasets: Datasets of messages to combine.
+        :type messages_datasets: list of list of TracedData
+        :param surveys_datasets: Datasets of survey responses to add to the messages, keyed by "avf_phone_id".
+        :type surveys_datasets: list of list of TracedData
+        :return: The messages from all the messages datasets, with survey responses added.
+        :rtype: list of TracedData
+        """
+        data = []
+
+        for messages_dataset in messages_datasets:
+            data.extend(messages_dataset)
+
+        # Index the survey responses by respondent, in surveys dataset order. As in TracedData.update_iterable, if a
+        # surveys dataset contains more than one response from the same respondent, the last response is used.
+        survey_responses_by_phone_id = dict()  # of avf_phone_id -> list of TracedData
+        for surveys_dataset in surveys_datasets:
+            surveys_dataset_lut = {survey_td["avf_phone_id"]: survey_td for survey_td in surveys_dataset}
+            for phone_id, survey_td in surveys_dataset_lut.items():
+                if phone_id not in survey_responses_by_phone_id:
+                    survey_responses_by_phone_id[phone_id] = []
+                survey_responses_by_phone_id[phone_id].append(survey_td)
+
+        # Append each respondent's survey responses to each of their messages, in surveys dataset order.
+        for td in data:
+            for survey_td in survey_responses_by_phone_id.get(td["avf_phone_id"], []):
+                td.append_traced_data("survey_responses", survey_td,
+                                      Metadata(user, Metadata.get_call_location(), time.time()))
+
+        return data
+
+    @staticmethod
+    def combine_raw_datasets_one_survey_at_a_time(user, messages_datasets, surveys_datasets):
+        """
+        Combines the messages datasets into a single list, and adds each respondent's survey responses to each of their
+        messages, by passing over all the messages once per surveys dataset.
+
+        This was the original implementation of `combine_raw_datasets`, and is kept for comparison by
+        benchmark_combine_raw_datasets.py.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param messages_datasets: Datasets of messages to combine.
+        :type messages_datasets: list of list of TracedData
+        :param surveys_datasets: Datasets of survey responses to add to the messages, keyed by "avf_phone_id".
+        :type surveys_datasets: list of list of TracedData
+        :return: The messages from all the messages datasets, with survey responses added.
+        :rtype: list of TracedData
+        """
         data = []
 
         for messages_dataset in messages_datasets:
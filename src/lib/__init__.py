@@ -1,5 +1,23 @@
+from .timestamps import Timestamps
 from .icr_tools import ICRTools
 from .message_filters import MessageFilters
+from .indexed_scheme import IndexedScheme
 from .pipeline_configuration import PipelineConfiguration, CodeSchemes
+from .coding_plan_registry import CodingPlanRegistry
 from .channels import Channels
 from .analysis_keys import AnalysisKeys
+from .paging_rapid_pro_client import PagingRapidProClient
+from .flow_runs_cache import FlowRunsCache
+from .contacts_cache import ContactsCache
+from .phone_number_uuid_store import SQLitePhoneNumberUuidTable
+from .raw_data_loader import RawDataLoader
+from .raw_data_snapshot import RawDataSnapshot
+from .pickle_utils import PickleUtils
+from .stage_checkpoints import StageCheckpoints
+from .stage_cache import StageCache
+from .pipeline_stages import PipelineStage, PipelineStageRunner
+from .stage_report import StageReport
+from .time_range_index import TimeRangeIndex
+from .coda_dataset_cache import CodaDatasetCache, CodaImport
+from .pipeline_tracer import PipelineTracer
+from .cleaner_cache import CleanerCache
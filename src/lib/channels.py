@@ -1,10 +1,14 @@
 import time
 
 from core_data_modules.cleaners import Codes
+from core_data_modules.logging import Logger
 from core_data_modules.traced_data import Metadata
-from dateutil.parser import isoparse
 
 from src.lib import PipelineConfiguration
+from src.lib.time_range_index import TimeRangeIndex
+from src.lib.timestamps import Timestamps
+
+log = Logger(__name__)
 
 class Channels(object):
     RADIO_PROMO_KEY = "radio_promo"
@@ -92,47 +96,143 @@ class Channels(object):
         S01E08_KEY: S01E08_RANGES,
     }
 
+    # Index of all the channel and show ranges, built when this class loads. Building the index checks that no two
+    # channel ranges overlap, so every message is in at most one channel.
+    TIME_RANGE_INDEX = TimeRangeIndex(dict(CHANNEL_RANGES, **SHOW_RANGES), exclusive_keys=CHANNEL_RANGES.keys())
+
     @staticmethod
     def timestamp_is_in_ranges(timestamp, ranges, matching_ranges):
+        """
+        :param timestamp: Timestamp to check, in microseconds since the Unix epoch (see Timestamps.to_epoch_micros).
+        :type timestamp: int
+        :param ranges: Time ranges to check, in the format (start_of_range_inclusive, end_of_range_exclusive).
+        :type ranges: list of (str, str)
+        :param matching_ranges: List to append the first matching range to.
+        :type matching_ranges: list of (str, str)
+        :return: Whether the timestamp is in any of the ranges.
+        :rtype: bool
+        """
         for range in ranges:
-            if isoparse(range[0]) <= timestamp < isoparse(range[1]):
+            if Timestamps.to_epoch_micros(range[0]) <= timestamp < Timestamps.to_epoch_micros(range[1]):
                 matching_ranges.append(range)
                 return True
         return False
 
     @classmethod
-    def set_channel_keys(cls, user, data, time_key):
+    def _channel_dict_for_keys(cls, keys):
+        channel_dict = dict()
+
+        # Set channel ranges
+        in_channel = False
+        for key in cls.CHANNEL_RANGES:
+            if key in keys:
+                in_channel = True
+                channel_dict[key] = Codes.TRUE
+            else:
+                channel_dict[key] = Codes.FALSE
+
+        # Set time as NON_LOGICAL if it doesn't fall in range of the **sms ad/radio promo/radio_show**
+        channel_dict[cls.NON_LOGICAL_KEY] = Codes.FALSE if in_channel else Codes.TRUE
+
+        # Set show ranges
+        for key in cls.SHOW_RANGES:
+            channel_dict[key] = Codes.TRUE if key in keys else Codes.FALSE
+
+        return channel_dict
+
+    @classmethod
+    def get_channel_keys(cls, timestamp):
+        """
+        Gets the channel and show keys for a timestamp, using TIME_RANGE_INDEX.
+
+        :param timestamp: Timestamp to get the keys for, in microseconds since the Unix epoch.
+        :type timestamp: int
+        :return: Dictionary of channel and show key -> Codes.TRUE if the timestamp is in that channel/show's time
+                 ranges, otherwise Codes.FALSE. NON_LOGICAL_KEY is Codes.TRUE if the timestamp isn't in any channel.
+        :rtype: dict of str -> str
+        """
+        return cls._channel_dict_for_keys(cls.TIME_RANGE_INDEX.keys_at(timestamp))
+
+    @classmethod
+    def set_channel_keys(cls, user, data, time_key, vectorised=False):
+        """
+        Sets the channel and show keys of each message, from the time each message was sent.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: Messages to set the channel keys of.
+        :type data: list of TracedData
+        :param time_key: Key of the ISO 8601 time each message was sent at.
+        :type time_key: str
+        :param vectorised: Whether to classify all the messages at once using numpy (see `set_channel_keys_vectorised`)
+                           rather than one at a time. Both produce the same keys.
+        :type vectorised: bool
+        """
+        if vectorised:
+            cls.set_channel_keys_vectorised(user, data, time_key)
+            return
+
+        project_start_date = Timestamps.datetime_to_epoch_micros(PipelineConfiguration.PROJECT_START_DATE)
+        project_end_date = Timestamps.datetime_to_epoch_micros(PipelineConfiguration.PROJECT_END_DATE)
+
         for td in data:
-            timestamp = isoparse(td[time_key])
-
-            channel_dict = dict()
-
-            # Set channel ranges
-            time_range_matches = 0
-            matching_ranges = []
-            for key, ranges in cls.CHANNEL_RANGES.items():
-                if cls.timestamp_is_in_ranges(timestamp, ranges, matching_ranges):
-                    time_range_matches += 1
-                    channel_dict[key] = Codes.TRUE
-                else:
-                    channel_dict[key] = Codes.FALSE
-
-            # Set time as NON_LOGICAL if it doesn't fall in range of the **sms ad/radio promo/radio_show**
-            if time_range_matches == 0:
+            timestamp = Timestamps.to_epoch_micros(td[time_key])
+            channel_dict = cls.get_channel_keys(timestamp)
+
+            if channel_dict[cls.NON_LOGICAL_KEY] == Codes.TRUE:
                 # Assert in range of project
-                assert PipelineConfiguration.PROJECT_START_DATE <= timestamp < PipelineConfiguration.PROJECT_END_DATE, \
+                assert project_start_date <= timestamp < project_end_date, \
                     f"Timestamp {td[time_key]} out of range of project"
-                channel_dict[cls.NON_LOGICAL_KEY] = Codes.TRUE
-            else:
-                assert time_range_matches == 1, f"Time '{td[time_key]}' matches multiple time ranges {matching_ranges}"
-                channel_dict[cls.NON_LOGICAL_KEY] = Codes.FALSE
-
-            # Set show ranges
-            for key, ranges in cls.SHOW_RANGES.items():
-                if cls.timestamp_is_in_ranges(timestamp, ranges, matching_ranges):
-                    channel_dict[key] = Codes.TRUE
-                else:
-                    channel_dict[key] = Codes.FALSE
 
             td.append_data(channel_dict, Metadata(user, Metadata.get_call_location(), time.time()))
 
+    @classmethod
+    def set_channel_keys_vectorised(cls, user, data, time_key):
+        """
+        Sets the channel and show keys of each message, classifying all the messages at once.
+
+        The times of all the messages are converted to an int64 array of epoch microseconds and located in
+        TIME_RANGE_INDEX with a single numpy.searchsorted. The channel dict for each segment of the index is computed
+        once, and copied to each message in that segment.
+
+        If numpy isn't installed, this falls back to classifying one message at a time.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: Messages to set the channel keys of.
+        :type data: list of TracedData
+        :param time_key: Key of the ISO 8601 time each message was sent at.
+        :type time_key: str
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            log.warning("numpy is not installed; setting channel keys one message at a time instead")
+            cls.set_channel_keys(user, data, time_key)
+            return
+
+        segment_keys = cls.TIME_RANGE_INDEX.segment_keys
+        # Index len(segment_keys) is used for timestamps which are before or after every range.
+        segment_channel_dicts = [cls._channel_dict_for_keys(keys) for keys in segment_keys]
+        segment_channel_dicts.append(cls._channel_dict_for_keys(frozenset()))
+
+        timestamps = np.fromiter((Timestamps.to_epoch_micros(td[time_key]) for td in data),
+                                 dtype=np.int64, count=len(data))
+        boundaries = np.array(cls.TIME_RANGE_INDEX.boundaries, dtype=np.int64)
+        segment_indices = np.searchsorted(boundaries, timestamps, side="right") - 1
+        segment_indices[(segment_indices < 0) | (segment_indices >= len(segment_keys))] = len(segment_keys)
+
+        # Assert that every message which isn't in a channel is in range of the project
+        project_start_date = Timestamps.datetime_to_epoch_micros(PipelineConfiguration.PROJECT_START_DATE)
+        project_end_date = Timestamps.datetime_to_epoch_micros(PipelineConfiguration.PROJECT_END_DATE)
+        segment_is_non_logical = np.array(
+            [channel_dict[cls.NON_LOGICAL_KEY] == Codes.TRUE for channel_dict in segment_channel_dicts], dtype=bool)
+        out_of_range = segment_is_non_logical[segment_indices] & \
+            ((timestamps < project_start_date) | (timestamps >= project_end_date))
+        if out_of_range.any():
+            td = data[int(np.argmax(out_of_range))]
+            assert False, f"Timestamp {td[time_key]} out of range of project"
+
+        for td, segment_index in zip(data, segment_indices.tolist()):
+            td.append_data(dict(segment_channel_dicts[segment_index]),
+                           Metadata(user, Metadata.get_call_location(), time.time()))
@@ -0,0 +1,78 @@
+import functools
+
+
+class CleanerCache(object):
+    # Survey answers are copied onto every message a participant sent, so the number of distinct answers to each
+    # question is much smaller than the number of messages. This bounds the cache's memory while still holding every
+    # distinct answer in a typical dataset.
+    DEFAULT_MAX_SIZE = 100000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        """
+        Memoises the cleaners of coding plans, so that each distinct raw text is only cleaned once per plan.
+
+        Each plan's cleaner is wrapped in a least-recently-used cache of its results. The cleaners must be pure
+        functions of the raw text, which all the cleaners in PipelineConfiguration are.
+
+        :param max_size: Maximum number of cleaned values to cache for each plan. When a plan's cache is full, its least
+                         recently used value is evicted.
+        :type max_size: int
+        """
+        assert max_size > 0, "max_size must be positive"
+        self.max_size = max_size
+        self._memoised_cleaners = dict()  # of CodingPlan -> lru_cache wrapper of that plan's cleaner
+
+    def cleaner_for(self, plan):
+        """
+        :param plan: Coding plan to get the memoised cleaner of.
+        :type plan: CodingPlan
+        :return: Function which returns the same values as the plan's cleaner, but only calls the plan's cleaner for
+                 raw texts it hasn't already cleaned.
+        :rtype: function of str -> str
+        """
+        if plan not in self._memoised_cleaners:
+            self._memoised_cleaners[plan] = functools.lru_cache(maxsize=self.max_size)(plan.cleaner)
+        memoised_cleaner = self._memoised_cleaners[plan]
+
+        # The lru_cache wrapper isn't a Python function, so isn't accepted everywhere a cleaner is, e.g. when
+        # CleaningUtils looks up the cleaner's location for the labels' origin. Wrap it in one.
+        @functools.wraps(plan.cleaner)
+        def cleaner(text):
+            return memoised_cleaner(text)
+
+        return cleaner
+
+    def cache_info(self, plan):
+        """
+        :param plan: Coding plan to get the cache statistics of. Its memoised cleaner must have been got with
+                     `cleaner_for`.
+        :type plan: CodingPlan
+        :return: Statistics about the use of the plan's memoised cleaner so far, as returned by
+                 `functools.lru_cache`'s `cache_info()`, with fields hits, misses, maxsize and currsize.
+        :rtype: namedtuple
+        """
+        assert plan in self._memoised_cleaners, f"No memoised cleaner for {plan.raw_field}"
+        return self._memoised_cleaners[plan].cache_info()
+
+    def stats(self):
+        """
+        :return: Statistics about the use of all the memoised cleaners so far, for the stage report.
+        :rtype: dict
+        """
+        hits = 0
+        misses = 0
+        size = 0
+        for memoised_cleaner in self._memoised_cleaners.values():
+            cache_info = memoised_cleaner.cache_info()
+            hits += cache_info.hits
+            misses += cache_info.misses
+            size += cache_info.currsize
+
+        lookups = hits + misses
+        return {
+            "CleanerCacheMaxSizePerPlan": self.max_size,
+            "CleanerCacheSize": size,
+            "CleanerCacheHits": hits,
+            "CleanerCacheMisses": misses,
+            "CleanerCacheHitRate": hits / lookups if lookups > 0 else None
+        }
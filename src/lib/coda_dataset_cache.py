@@ -0,0 +1,269 @@
+import json
+import os
+import time
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.data_models import Label
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data import Metadata
+
+log = Logger(__name__)
+
+
+class CodaImport(object):
+    def __init__(self, message_id_key, scheme_key_map, coda_path, multi_coded=False, required_key=None):
+        """
+        Describes one import of labels from a Coda messages file, for `CodaDatasetCache.import_all`.
+
+        :param message_id_key: Key in TracedData objects of the message ids.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of (key in TracedData objects to assign labels to) ->
+                               (Scheme in the Coda messages file to retrieve the labels from)
+        :type scheme_key_map: dict of str -> Scheme
+        :param coda_path: Path to the Coda messages file to import labels from, or None if there are no labels.
+        :type coda_path: str | None
+        :param multi_coded: Whether each key holds a list of labels rather than a single label.
+        :type multi_coded: bool
+        :param required_key: Key which TracedData objects must contain to be coded by this import, or None.
+        :type required_key: str | None
+        """
+        self.message_id_key = message_id_key
+        self.scheme_key_map = scheme_key_map
+        self.coda_path = coda_path
+        self.multi_coded = multi_coded
+        self.required_key = required_key
+
+
+class CodaDatasetCache(object):
+    MANUALLY_UNCODED_CODE_ID = "SPECIAL-MANUALLY_UNCODED"
+
+    def __init__(self):
+        """
+        Cache of parsed Coda messages files, so that each file is only parsed once no matter how many times its labels
+        are imported.
+
+        Files are cached by path and modification time, so a file which changes is parsed again the next time it is
+        used.
+
+        The import methods apply labels in the same way as the equivalent methods of TracedDataCodaV2IO, but read them
+        from the cached datasets instead of from a file.
+        """
+        self._datasets = dict()  # of path -> (modification time, dataset)
+
+    @staticmethod
+    def _parse_messages_file(f):
+        dataset = dict()  # of message id -> (dict of scheme id -> list of Label)
+        for message in json.load(f):
+            labels_by_scheme = dict()
+            dataset[message["MessageID"]] = labels_by_scheme
+            for label_map in message["Labels"]:
+                label = Label.from_firebase_map(label_map)
+                labels_by_scheme.setdefault(label.scheme_id, []).append(label)
+        return dataset
+
+    def get_dataset(self, coda_path):
+        """
+        Gets the labels in a Coda messages file, parsing the file only if it hasn't been parsed since it last changed.
+
+        :param coda_path: Path to the Coda messages file, or None to get an empty dataset.
+        :type coda_path: str | None
+        :return: Dictionary of message id -> scheme id -> labels under that scheme, newest first as in Coda.
+                 The returned labels are shared by every caller, so the import methods attach a new dict made with
+                 `Label.to_dict()` to each TracedData, as TracedDataCodaV2IO does, rather than sharing one between them.
+        :rtype: dict of str -> (dict of str -> list of core_data_modules.data_models.Label)
+        """
+        if coda_path is None:
+            return dict()
+
+        modification_time = os.stat(coda_path).st_mtime_ns
+        cached = self._datasets.get(coda_path)
+        if cached is not None and cached[0] == modification_time:
+            return cached[1]
+
+        log.debug(f"Parsing Coda file '{coda_path}'...")
+        with open(coda_path, "r") as f:
+            dataset = self._parse_messages_file(f)
+        self._datasets[coda_path] = (modification_time, dataset)
+
+        return dataset
+
+    @staticmethod
+    def _labels_for(dataset, message_id, scheme):
+        return dataset.get(message_id, dict()).get(scheme.scheme_id, [])
+
+    def import_coda_2_to_traced_data_iterable(self, user, data, message_id_key, scheme_key_map, coda_path):
+        """
+        Codes keys in an iterable of TracedData objects using the labels in a Coda messages file.
+
+        Data which has not been checked in the Coda file is labelled NOT_REVIEWED.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to be coded using the Coda file.
+        :type data: iterable of TracedData
+        :param message_id_key: Key in TracedData objects of the message ids.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of (key in TracedData objects to assign labels to) ->
+                               (Scheme in the Coda messages file to retrieve the labels from)
+        :type scheme_key_map: dict of str -> Scheme
+        :param coda_path: Path to the Coda messages file to import labels from, or None if there are no labels.
+        :type coda_path: str | None
+        """
+        dataset = self.get_dataset(coda_path)
+
+        for td in data:
+            if message_id_key not in td:
+                continue
+
+            for coded_key, scheme in scheme_key_map.items():
+                # Append each label assigned to this message under this scheme, oldest first.
+                for label in reversed(self._labels_for(dataset, td[message_id_key], scheme)):
+                    td.append_data({coded_key: label.to_dict()},
+                                   Metadata(user, Metadata.get_call_location(), time.time()))
+
+                # If this td still has no label, or its latest label hasn't been checked in Coda, label it NOT_REVIEWED
+                if coded_key not in td or not td[coded_key]["Checked"]:
+                    nr_label = CleaningUtils.make_label_from_cleaner_code(
+                        scheme, scheme.get_code_with_control_code(Codes.NOT_REVIEWED),
+                        Metadata.get_call_location()
+                    )
+                    td.append_data({coded_key: nr_label.to_dict()},
+                                   Metadata(user, Metadata.get_call_location(), time.time()))
+
+    def import_coda_2_to_traced_data_iterable_multi_coded(self, user, data, message_id_key, scheme_key_map,
+                                                          coda_path):
+        """
+        Codes keys in an iterable of TracedData objects using the labels in a Coda messages file, where each key holds
+        a list of labels.
+
+        Data which has no checked labels after importing is labelled NOT_REVIEWED.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to be coded using the Coda file.
+        :type data: iterable of TracedData
+        :param message_id_key: Key in TracedData objects of the message ids.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of (key in TracedData objects to assign labels to) ->
+                               (Scheme in the Coda messages file to retrieve the labels from)
+        :type scheme_key_map: dict of str -> Scheme
+        :param coda_path: Path to the Coda messages file to import labels from, or None if there are no labels.
+        :type coda_path: str | None
+        """
+        dataset = self.get_dataset(coda_path)
+
+        for td in data:
+            if message_id_key not in td:
+                continue
+
+            for coded_key, scheme in scheme_key_map.items():
+                # Look-up table of scheme id -> label for the labels this td already has under this key
+                td_labels_lut = {label["SchemeID"]: label for label in td.get(coded_key, [])}
+
+                # Apply each label assigned to this message under this scheme, oldest first.
+                for label in reversed(self._labels_for(dataset, td[message_id_key], scheme)):
+                    td_labels_lut[label.scheme_id] = label.to_dict()
+                    td.append_data({coded_key: list(td_labels_lut.values())},
+                                   Metadata(user, Metadata.get_call_location(), time.time()))
+
+                # Delete any labels which were manually uncoded
+                for scheme_id, label in list(td_labels_lut.items()):
+                    if label["CodeID"] == self.MANUALLY_UNCODED_CODE_ID:
+                        del td_labels_lut[scheme_id]
+                        td.append_data({coded_key: list(td_labels_lut.values())},
+                                       Metadata(user, Metadata.get_call_location(), time.time()))
+
+                # If no labels have been set and checked, label this td NOT_REVIEWED
+                if not any(label["Checked"] for label in td.get(coded_key, [])):
+                    nr_label = CleaningUtils.make_label_from_cleaner_code(
+                        scheme, scheme.get_code_with_control_code(Codes.NOT_REVIEWED),
+                        Metadata.get_call_location()
+                    )
+                    td.append_data({coded_key: [nr_label.to_dict()]},
+                                   Metadata(user, Metadata.get_call_location(), time.time()))
+
+    @staticmethod
+    def _not_reviewed_label(scheme):
+        return CleaningUtils.make_label_from_cleaner_code(
+            scheme, scheme.get_code_with_control_code(Codes.NOT_REVIEWED),
+            Metadata.get_call_location()
+        ).to_dict()
+
+    @classmethod
+    def _imported_label(cls, current_label, labels, scheme):
+        # Equivalent to import_coda_2_to_traced_data_iterable for one key of one TracedData.
+        # Returns the label to set, or None if the current label is unchanged.
+        if len(labels) > 0:
+            label = labels[0].to_dict()
+        else:
+            label = current_label
+
+        if label is None or not label["Checked"]:
+            return cls._not_reviewed_label(scheme)
+        if label is current_label:
+            return None
+        return label
+
+    @classmethod
+    def _imported_multi_coded_labels(cls, current_labels, labels, scheme):
+        # Equivalent to import_coda_2_to_traced_data_iterable_multi_coded for one key of one TracedData.
+        # Returns the list of labels to set, or None if the current labels are unchanged.
+        td_labels_lut = {label["SchemeID"]: label for label in current_labels}
+        changed = False
+        for label in reversed(labels):
+            td_labels_lut[label.scheme_id] = label.to_dict()
+            changed = True
+
+        for scheme_id, label in list(td_labels_lut.items()):
+            if label["CodeID"] == cls.MANUALLY_UNCODED_CODE_ID:
+                del td_labels_lut[scheme_id]
+                changed = True
+
+        new_labels = list(td_labels_lut.values()) if changed else current_labels
+        if not any(label["Checked"] for label in new_labels):
+            return [cls._not_reviewed_label(scheme)]
+        if not changed:
+            return None
+        return new_labels
+
+    def import_all(self, user, data, coda_imports):
+        """
+        Applies several imports of labels from Coda messages files in a single pass over the data.
+
+        The labels set are the same as those set by running each import in turn with
+        `import_coda_2_to_traced_data_iterable` or `import_coda_2_to_traced_data_iterable_multi_coded`, but each
+        TracedData object is visited once, and all the labels imported for it are appended in a single append_data.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to be coded using the Coda files.
+        :type data: iterable of TracedData
+        :param coda_imports: Imports to apply. Imports later in this list see the labels set by imports earlier in it.
+        :type coda_imports: list of CodaImport
+        """
+        datasets = [self.get_dataset(coda_import.coda_path) for coda_import in coda_imports]
+
+        for td in data:
+            imported = dict()
+            for coda_import, dataset in zip(coda_imports, datasets):
+                if coda_import.message_id_key not in td:
+                    continue
+                if coda_import.required_key is not None and coda_import.required_key not in td:
+                    continue
+
+                message_labels = dataset.get(td[coda_import.message_id_key], dict())
+                for coded_key, scheme in coda_import.scheme_key_map.items():
+                    labels = message_labels.get(scheme.scheme_id, [])
+                    current = imported[coded_key] if coded_key in imported else td.get(coded_key)
+
+                    if coda_import.multi_coded:
+                        new = self._imported_multi_coded_labels([] if current is None else current, labels, scheme)
+                    else:
+                        new = self._imported_label(current, labels, scheme)
+
+                    if new is not None:
+                        imported[coded_key] = new
+
+            if len(imported) > 0:
+                td.append_data(imported, Metadata(user, Metadata.get_call_location(), time.time()))
@@ -0,0 +1,41 @@
+from src.lib.pipeline_configuration import PipelineConfiguration
+
+
+class CodingPlanRegistry(object):
+    """
+    The coding plans in PipelineConfiguration, grouped and indexed once at import so that stages don't rebuild the
+    same plan lists and lookups for every message.
+    """
+    RQA_PLANS = tuple(PipelineConfiguration.RQA_CODING_PLANS)
+    SURVEY_PLANS = tuple(PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS)
+    ALL_PLANS = RQA_PLANS + SURVEY_PLANS
+    LOCATION_PLANS = tuple(PipelineConfiguration.LOCATION_CODING_PLANS)
+
+    RQA_RAW_FIELDS = frozenset(plan.raw_field for plan in RQA_PLANS)
+    SURVEY_RAW_FIELDS = frozenset(plan.raw_field for plan in SURVEY_PLANS)
+
+    # Dictionary of raw field -> the plans for that raw field, in the order of ALL_PLANS.
+    # Some raw fields, such as the location's, are coded under several plans.
+    PLANS_BY_RAW_FIELD = dict()  # of str -> tuple of CodingPlan
+    for plan in ALL_PLANS:
+        PLANS_BY_RAW_FIELD[plan.raw_field] = PLANS_BY_RAW_FIELD.get(plan.raw_field, ()) + (plan,)
+
+    # Dictionary of WS normal code id -> the raw field that code indicates a requested move to.
+    WS_CODE_ID_TO_RAW_FIELD = dict()  # of str -> str
+    for plan in ALL_PLANS:
+        if plan.ws_code is not None:
+            WS_CODE_ID_TO_RAW_FIELD[plan.ws_code.code_id] = plan.raw_field
+
+    del plan
+
+    @staticmethod
+    def present_plans(td, plans):
+        """
+        :param td: TracedData to check.
+        :type td: TracedData
+        :param plans: Plans to check for.
+        :type plans: iterable of CodingPlan
+        :return: The plans in `plans` whose raw field is in `td`, in the same order as `plans`.
+        :rtype: list of CodingPlan
+        """
+        return [plan for plan in plans if plan.raw_field in td]
@@ -0,0 +1,120 @@
+import json
+import os
+
+from core_data_modules.util import IOUtils
+from temba_client.v2 import Contact
+
+
+class ContactsCache(object):
+    """
+    Rapid Pro contacts, keyed by contact UUID, optionally persisted to disk between fetches.
+
+    Refreshing the cache only downloads the contacts which have been modified since the newest contact already in
+    the cache.
+    """
+    def __init__(self, cache_path=None):
+        """
+        :param cache_path: Path to a JSONL file to load the cache from and save the cache to, or None.
+                           If None, the cache is held in memory only.
+        :type cache_path: str | None
+        """
+        self.cache_path = cache_path
+        self._contacts = dict()  # of contact uuid -> Contact
+
+    def load(self):
+        """
+        Loads the contacts saved at this cache's path, if that file exists.
+        """
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+
+        with open(self.cache_path, "r") as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                contact = Contact.deserialize(json.loads(line))
+                self._contacts[contact.uuid] = contact
+
+    def save(self):
+        """
+        Writes the contacts in this cache to this cache's path, if there is one.
+        """
+        if self.cache_path is None:
+            return
+
+        IOUtils.ensure_dirs_exist_for_file(self.cache_path)
+        with open(f"{self.cache_path}.tmp", "w") as f:
+            for contact in self._contacts.values():
+                f.write(json.dumps(contact.serialize()))
+                f.write("\n")
+        os.replace(f"{self.cache_path}.tmp", self.cache_path)
+
+    def newest_modified_on(self):
+        """
+        :return: modified_on of the most recently modified contact in the cache, or None if the cache is empty.
+        :rtype: datetime.datetime | None
+        """
+        if len(self._contacts) == 0:
+            return None
+        return max(contact.modified_on for contact in self._contacts.values())
+
+    @staticmethod
+    def download_contacts(rapid_pro, modified_after_inclusive=None):
+        """
+        Downloads the contacts modified at or after the given time, without changing any cache.
+
+        :param rapid_pro: Rapid Pro client to download contacts with.
+        :type rapid_pro: RapidProClient
+        :param modified_after_inclusive: If set, only downloads the contacts modified at or after this time, e.g. the
+                                         `newest_modified_on` of a cache. Otherwise, downloads every contact.
+        :type modified_after_inclusive: datetime.datetime | None
+        :return: The downloaded contacts.
+        :rtype: list of temba_client.v2.types.Contact
+        """
+        if modified_after_inclusive is None:
+            return rapid_pro.get_raw_contacts()
+        return rapid_pro.get_raw_contacts(last_modified_after_inclusive=modified_after_inclusive)
+
+    def merge(self, contacts):
+        """
+        Adds the given contacts to this cache, replacing any older versions of them which are already in the cache.
+
+        :param contacts: Contacts to add.
+        :type contacts: iterable of temba_client.v2.types.Contact
+        """
+        for contact in contacts:
+            cached_contact = self._contacts.get(contact.uuid)
+            if cached_contact is None or contact.modified_on >= cached_contact.modified_on:
+                self._contacts[contact.uuid] = contact
+
+    def refresh(self, rapid_pro):
+        """
+        Downloads the contacts modified since the newest contact in this cache, and merges them into the cache.
+
+        :param rapid_pro: Rapid Pro client to download contacts with.
+        :type rapid_pro: RapidProClient
+        :return: Number of contacts downloaded.
+        :rtype: int
+        """
+        new_contacts = self.download_contacts(rapid_pro, self.newest_modified_on())
+        self.merge(new_contacts)
+        return len(new_contacts)
+
+    def has_contacts_for_runs(self, runs):
+        """
+        :param runs: Runs to check.
+        :type runs: iterable of temba_client.v2.types.Run
+        :return: Whether this cache contains the contact of every one of the given runs.
+        :rtype: bool
+        """
+        return all(run.contact.uuid in self._contacts for run in runs)
+
+    def contacts_for_runs(self, runs):
+        """
+        :param runs: Runs to get the contacts of.
+        :type runs: iterable of temba_client.v2.types.Run
+        :return: The cached contacts of the given runs. Contacts which are not in the cache are omitted.
+        :rtype: list of temba_client.v2.types.Contact
+        """
+        contact_uuids = {run.contact.uuid for run in runs}
+        return [self._contacts[uuid] for uuid in contact_uuids if uuid in self._contacts]
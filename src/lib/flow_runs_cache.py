@@ -0,0 +1,132 @@
+import json
+import os
+
+from core_data_modules.util import IOUtils
+from dateutil.parser import isoparse
+from temba_client.v2 import Run
+
+
+class FlowRunsCache(object):
+    """
+    Local cache of the raw runs previously downloaded from a Rapid Pro flow.
+
+    The runs are stored in ascending order of modified_on, the order in which RapidProClient.get_raw_runs_for_flow_id
+    returns them. Alongside the cached runs, a cursor is stored which records the latest modified_on timestamp of any
+    run in the cache, so that a subsequent fetch only needs to download the runs which have been modified since that
+    cursor.
+    """
+    def __init__(self, raw_data_dir, flow_name):
+        """
+        :param raw_data_dir: Directory containing the raw data files exported by fetch_raw_data.py.
+        :type raw_data_dir: str
+        :param flow_name: Name of the Rapid Pro flow to cache the runs of.
+        :type flow_name: str
+        """
+        self.raw_runs_path = f"{raw_data_dir}/{flow_name}_raw_runs.jsonl"
+        self.cursor_path = f"{raw_data_dir}/{flow_name}_cursor.json"
+
+    def load_cursor(self):
+        """
+        Loads the cursor for this flow.
+
+        :return: modified_on timestamp of the most recently modified run in the cache, or None if there is no usable
+                 cache for this flow.
+        :rtype: datetime.datetime | None
+        """
+        if not os.path.exists(self.cursor_path) or not os.path.exists(self.raw_runs_path):
+            return None
+
+        with open(self.cursor_path, "r") as f:
+            return isoparse(json.load(f)["LastModified"])
+
+    def iter_raw_runs_pages(self, page_size, exclude_run_ids=frozenset()):
+        """
+        Reads the runs in this cache, one page at a time, in ascending order of modified_on.
+
+        :param page_size: Maximum number of runs to return in each page.
+        :type page_size: int
+        :param exclude_run_ids: Ids of runs to skip, e.g. because a newer version of those runs has been downloaded.
+        :type exclude_run_ids: set of int
+        :return: Pages of cached runs.
+        :rtype: iterator of list of temba_client.v2.types.Run
+        """
+        if not os.path.exists(self.raw_runs_path):
+            return
+
+        page = []
+        with open(self.raw_runs_path, "r") as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                run = Run.deserialize(json.loads(line))
+                if run.id in exclude_run_ids:
+                    continue
+
+                page.append(run)
+                if len(page) == page_size:
+                    yield page
+                    page = []
+
+        if len(page) > 0:
+            yield page
+
+    def open_writer(self):
+        """
+        :return: A writer which replaces the runs in this cache with the runs written to it, once it is closed without
+                 error. Use as a context manager.
+        :rtype: FlowRunsCacheWriter
+        """
+        return FlowRunsCacheWriter(self)
+
+
+class FlowRunsCacheWriter(object):
+    def __init__(self, runs_cache):
+        """
+        Streams runs to a temporary file, then replaces the contents of a FlowRunsCache with that file and advances
+        the cache's cursor to the latest modified_on of the runs written.
+
+        Runs must be written in ascending order of modified_on.
+
+        The cursor is removed when writing starts and only written back once the runs have been saved, so that an
+        interrupted write results in a full re-fetch rather than a cursor which points past data that was never saved.
+
+        :param runs_cache: Cache to write to.
+        :type runs_cache: FlowRunsCache
+        """
+        self.runs_cache = runs_cache
+        self._tmp_path = f"{runs_cache.raw_runs_path}.tmp"
+        self._f = None
+        self._last_modified = None
+
+    def __enter__(self):
+        IOUtils.ensure_dirs_exist_for_file(self._tmp_path)
+        if os.path.exists(self.runs_cache.cursor_path):
+            os.remove(self.runs_cache.cursor_path)
+        self._f = open(self._tmp_path, "w")
+        return self
+
+    def write(self, raw_runs):
+        """
+        :param raw_runs: Runs to append to the cache, in ascending order of modified_on. These must not have been
+                         modified before any of the runs already written.
+        :type raw_runs: iterable of temba_client.v2.types.Run
+        """
+        for run in raw_runs:
+            # If this fails, the cursor has already been removed, so the next fetch will re-download every run.
+            assert self._last_modified is None or run.modified_on >= self._last_modified, \
+                f"Run {run.id} was written to the cache out of order of modified_on"
+            self._f.write(json.dumps(run.serialize()))
+            self._f.write("\n")
+            self._last_modified = run.modified_on
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._f.close()
+
+        if exc_type is not None:
+            os.remove(self._tmp_path)
+            return
+
+        os.replace(self._tmp_path, self.runs_cache.raw_runs_path)
+        if self._last_modified is not None:
+            with open(self.runs_cache.cursor_path, "w") as f:
+                json.dump({"LastModified": self._last_modified.isoformat()}, f)
@@ -0,0 +1,55 @@
+from core_data_modules.data_models import Scheme
+
+
+class IndexedScheme(Scheme):
+    """
+    Scheme which looks up codes by id, control code, and match value in O(1), using dictionaries built once when the
+    scheme is created, rather than by searching through all of its codes.
+
+    This is a Scheme, so it can be used anywhere a Scheme is expected, including by Core Data Modules, which then
+    makes its lookups in the same way.
+    """
+    @classmethod
+    def from_scheme(cls, scheme):
+        """
+        :param scheme: Scheme to index.
+        :type scheme: core_data_modules.data_models.Scheme
+        :return: Indexed copy of `scheme`.
+        :rtype: IndexedScheme
+        """
+        indexed_scheme = cls.__new__(cls)
+        indexed_scheme.__dict__.update(scheme.__dict__)
+        indexed_scheme._index_codes()
+        return indexed_scheme
+
+    def _index_codes(self):
+        self._codes_by_id = dict()  # of code id -> Code
+        self._codes_by_control_code = dict()  # of control code -> Code
+        self._codes_by_match_value = dict()  # of match value -> Code
+
+        # Where several codes share a control code or match value, the first is kept, as when searching in order.
+        for code in self.codes:
+            self._codes_by_id.setdefault(code.code_id, code)
+            if code.control_code is not None:
+                self._codes_by_control_code.setdefault(code.control_code, code)
+            if code.match_values is not None:
+                for match_value in code.match_values:
+                    self._codes_by_match_value.setdefault(match_value, code)
+
+    def get_code_with_id(self, code_id):
+        code = self._codes_by_id.get(code_id)
+        if code is None:
+            raise KeyError(f"Scheme '{self.name}' does not contain a code with id '{code_id}'")
+        return code
+
+    def get_code_with_control_code(self, control_code):
+        code = self._codes_by_control_code.get(control_code)
+        if code is None:
+            raise KeyError(f"Scheme '{self.name}' does not contain a code with control code '{control_code}'")
+        return code
+
+    def get_code_with_match_value(self, match_value):
+        code = self._codes_by_match_value.get(match_value)
+        if code is None:
+            raise KeyError(f"Scheme '{self.name}' does not contain a code with match value '{match_value}'")
+        return code
@@ -1,57 +1,170 @@
-from dateutil.parser import isoparse
+from collections import OrderedDict
 
 from core_data_modules.logging import Logger
 
+from src.lib.pipeline_configuration import PipelineConfiguration
+from src.lib.timestamps import Timestamps
+
 log = Logger(__name__)
 
 
 # TODO: Move to Core once adapted for and tested on a pipeline that supports multiple radio shows
 class MessageFilters(object):
-    # TODO: Log which data is being dropped?
+    NOP_CONTROL_CODE = "NOP"
+
     @staticmethod
-    def filter_test_messages(messages, test_run_key="test_run"):
-        return [td for td in messages if not td.get(test_run_key, False)]
+    def not_test_message(test_run_key="test_run"):
+        """
+        :param test_run_key: Key which is set to True on test messages.
+        :type test_run_key: str
+        :return: Filter which keeps messages which weren't sent by AVF for testing.
+        :rtype: (str, function of TracedData -> bool)
+        """
+        return "test messages", lambda td: not td.get(test_run_key, False)
 
     @staticmethod
-    def filter_empty_messages(messages, message_keys):
+    def not_empty_message(message_keys):
+        """
+        :param message_keys: Keys of the messages to check for.
+        :type message_keys: list of str
+        :return: Filter which keeps messages which contain a response under at least one of `message_keys`.
+        :rtype: (str, function of TracedData -> bool)
+        """
         # TODO: Before using on future projects, consider whether messages which are "" should be considered as empty
-        non_empty = []
-        for td in messages:
-            for message_key in message_keys:
-                if message_key in td:
-                    non_empty.append(td)
-                    continue
-        return non_empty
+        return "empty messages", lambda td: any(message_key in td for message_key in message_keys)
+
+    @staticmethod
+    def in_time_range(time_key, start_time, end_time):
+        """
+        :param time_key: Key of the ISO 8601 time each message was sent at.
+        :type time_key: str
+        :param start_time: Start of the time range, inclusive.
+        :type start_time: datetime.datetime
+        :param end_time: End of the time range, inclusive.
+        :type end_time: datetime.datetime
+        :return: Filter which keeps messages sent between `start_time` and `end_time`.
+        :rtype: (str, function of TracedData -> bool)
+        """
+        start_time_micros = Timestamps.datetime_to_epoch_micros(start_time)
+        end_time_micros = Timestamps.datetime_to_epoch_micros(end_time)
+        return "messages outside the time range", \
+            lambda td: start_time_micros <= Timestamps.to_epoch_micros(td.get(time_key)) <= end_time_micros
 
     @staticmethod
-    def filter_time_range(messages, time_key, start_time, end_time):
-        return [td for td in messages if start_time <= isoparse(td.get(time_key)) <= end_time]
+    def iterate_filtered(messages, filters, drop_counts):
+        """
+        Lazily filters messages, checking all the filters in a single pass.
+
+        Each message is checked against the filters in order, and is yielded at most once, if every filter keeps it.
+
+        :param messages: Messages to filter.
+        :type messages: iterable of TracedData
+        :param filters: Filters to apply, as (name, predicate) pairs. A message is kept by a filter if its predicate
+                        returns True.
+        :type filters: list of (str, function of TracedData -> bool)
+        :param drop_counts: Dictionary of filter name -> number of messages dropped by that filter, which is updated
+                            as the messages are filtered. A message dropped by several filters is only counted against
+                            the first.
+        :type drop_counts: dict of str -> int
+        :return: Messages kept by every filter, in their original order.
+        :rtype: iterator of TracedData
+        """
+        for td in messages:
+            for name, keep in filters:
+                if not keep(td):
+                    drop_counts[name] = drop_counts.get(name, 0) + 1
+                    break
+            else:
+                yield td
+
+    @classmethod
+    def apply_filters(cls, messages, filters):
+        """
+        Filters messages in a single pass, and logs how many messages each filter dropped.
+
+        :param messages: Messages to filter.
+        :type messages: iterable of TracedData
+        :param filters: Filters to apply, as (name, predicate) pairs. See `iterate_filtered`.
+        :type filters: list of (str, function of TracedData -> bool)
+        :return: Messages kept by every filter, in their original order.
+        :rtype: list of TracedData
+        """
+        drop_counts = OrderedDict((name, 0) for name, _ in filters)
+        filtered = list(cls.iterate_filtered(messages, filters, drop_counts))
+
+        for name, drop_count in drop_counts.items():
+            log.info(f"Filtered out {drop_count} {name}")
+        log.info(f"Returning {len(filtered)}/{len(filtered) + sum(drop_counts.values())} messages")
+
+        return filtered
+
+    @classmethod
+    def filter_test_messages(cls, messages, test_run_key="test_run"):
+        return cls.apply_filters(messages, [cls.not_test_message(test_run_key)])
+
+    @classmethod
+    def filter_empty_messages(cls, messages, message_keys):
+        return cls.apply_filters(messages, [cls.not_empty_message(message_keys)])
+
+    @classmethod
+    def filter_time_range(cls, messages, time_key, start_time, end_time):
+        return cls.apply_filters(messages, [cls.in_time_range(time_key, start_time, end_time)])
+
+    @classmethod
+    def compile_noise_other_project_checks(cls, coding_plans):
+        """
+        Compiles the checks for whether a message was labelled as Noise_Other_Project (NOP) under each coding plan.
+
+        Plans with a binary code scheme are checked on their binary coded field, which holds a single label. Other
+        plans are checked on the first label of their coded field, which holds a list of labels.
+
+        :param coding_plans: Coding plans to compile checks for.
+        :type coding_plans: iterable of CodingPlan
+        :return: Tuple of (coded field, whether that field holds a list of labels, NOP code id) for each plan.
+        :rtype: tuple of (str, bool, str)
+        """
+        checks = []
+        for plan in coding_plans:
+            if plan.binary_code_scheme is not None:
+                nop_code = plan.binary_code_scheme.get_code_with_control_code(cls.NOP_CONTROL_CODE)
+                checks.append((plan.binary_coded_field, False, nop_code.code_id))
+            else:
+                nop_code = plan.code_scheme.get_code_with_control_code(cls.NOP_CONTROL_CODE)
+                checks.append((plan.coded_field, True, nop_code.code_id))
+        return tuple(checks)
 
     @staticmethod
-    def filter_rqa_noise_other_project(messages):
+    def not_noise_other_project(check):
+        """
+        :param check: Check compiled by `compile_noise_other_project_checks`.
+        :type check: (str, bool, str)
+        :return: Filter which keeps messages which weren't labelled as NOP under the checked field.
+        :rtype: (str, function of TracedData -> bool)
+        """
+        coded_field, is_multi, nop_code_id = check
+        if is_multi:
+            return f"messages labelled as Noise_Other_Project in {coded_field}", \
+                lambda td: td[coded_field][0]["CodeID"] != nop_code_id
+        return f"messages labelled as Noise_Other_Project in {coded_field}", \
+            lambda td: td[coded_field]["CodeID"] != nop_code_id
+
+    @classmethod
+    def filter_rqa_noise_other_project(cls, messages, coding_plans=None):
         """
         Filters out RQA messages which have been labelled as Noise_Other_Project(NOP).
 
         :param messages: List of message objects to filter.
         :type messages: list of TracedData
+        :param coding_plans: Coding plans to check for NOP labels.
+                             If None, uses PipelineConfiguration.RQA_CODING_PLANS.
+        :type coding_plans: list of CodingPlan | None
         :return: Filtered list.
         :rtype: list of TracedData
         """
-        not_noise = []
-        for td in messages:
-            if (td["rqa_s01e01_yes_no_amb_coded"]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e01_yes_no_amb_coded"]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e02_yes_no_amb_coded"]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e03_yes_no_amb_coded"]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e04_yes_no_amb_coded"]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e05_coded"][0]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e06_coded"][0]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e07_coded"][0]["CodeID"] != "code-NOP-4eb70633") and \
-                    (td["rqa_s01e08_coded"][0]["CodeID"] != "code-NOP-4eb70633"):
-                not_noise.append(td)
-
-        log.info(f"Filtered out rqa noise other project messages. "
-                 f"Returning {len(not_noise)}/{len(messages)} messages.")
-
-        return not_noise
+        if coding_plans is None:
+            coding_plans = PipelineConfiguration.RQA_CODING_PLANS
+
+        filters = [cls.not_noise_other_project(check)
+                   for check in cls.compile_noise_other_project_checks(coding_plans)]
 
+        return cls.apply_filters(messages, filters)
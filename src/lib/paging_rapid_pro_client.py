@@ -0,0 +1,27 @@
+from rapid_pro_tools.rapid_pro_client import RapidProClient
+
+
+class PagingRapidProClient(RapidProClient):
+    """
+    RapidProClient which can also download runs one page at a time.
+
+    RapidProClient.get_raw_runs_for_flow_id only returns once every run in a flow has been downloaded, so the whole
+    flow has to fit in memory. This client's `iter_raw_runs_pages_for_flow_id` returns each page as soon as it arrives.
+    """
+
+    def iter_raw_runs_pages_for_flow_id(self, flow_id, last_modified_after_inclusive=None):
+        """
+        Downloads the raw runs for a flow, one page at a time.
+
+        Pages are returned in the order Rapid Pro sends them, which is descending order of modified_on (i.e. the
+        reverse of the order returned by `get_raw_runs_for_flow_id`).
+
+        :param flow_id: Id of the flow to download the runs of.
+        :type flow_id: str
+        :param last_modified_after_inclusive: If set, only downloads the runs modified at or after this time.
+        :type last_modified_after_inclusive: datetime.datetime | None
+        :return: Pages of the runs in the flow.
+        :rtype: iterator of list of temba_client.v2.types.Run
+        """
+        return self.rapid_pro.get_runs(flow=flow_id, after=last_modified_after_inclusive).iterfetches(
+            retry_on_rate_exceed=True)
@@ -0,0 +1,124 @@
+import sqlite3
+
+from core_data_modules.cleaners import PhoneCleaner
+from core_data_modules.util import PhoneNumberUuidTable
+
+
+class SQLitePhoneNumberUuidTable(object):
+    """
+    Phone number <-> UUID lookup table, stored in a local SQLite database.
+
+    This supports the same add_phone/get_uuid/get_phone interface as core_data_modules' PhoneNumberUuidTable, but
+    lookups in either direction use an index rather than requiring the whole table to be loaded, and new mappings
+    are inserted without rewriting the rest of the table.
+    """
+    def __init__(self, db_path):
+        """
+        :param db_path: Path to the SQLite database file. If the file does not exist or is empty, an empty table is
+                        created.
+        :type db_path: str
+        """
+        self.db_path = db_path
+        # Allow use from the fetch stage's worker threads. Callers are responsible for serialising access.
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS phone_number_uuids (phone TEXT PRIMARY KEY, uuid TEXT NOT NULL UNIQUE)"
+        )
+        self._connection.commit()
+
+    def add_phone(self, phone):
+        """
+        Adds a phone number to the table, if it is not already present.
+
+        :param phone: Phone number to add.
+        :type phone: str
+        :return: UUID for this phone number.
+        :rtype: str
+        """
+        normalised_phone = PhoneCleaner.normalise_phone(phone)
+        existing_uuid = self._get_uuid(normalised_phone)
+        if existing_uuid is not None:
+            return existing_uuid
+
+        # Generate the new UUID in exactly the same format as a core PhoneNumberUuidTable would.
+        new_uuid = PhoneNumberUuidTable().add_phone(normalised_phone)
+        while self._get_phone(new_uuid) is not None:
+            new_uuid = PhoneNumberUuidTable().add_phone(normalised_phone)
+
+        self._connection.execute("INSERT INTO phone_number_uuids (phone, uuid) VALUES (?, ?)",
+                                 (normalised_phone, new_uuid))
+        return new_uuid
+
+    def get_uuid(self, phone):
+        """
+        :param phone: Phone number to look up.
+        :type phone: str
+        :return: UUID for this phone number.
+        :rtype: str
+        :raises KeyError: If the phone number is not in the table.
+        """
+        uuid = self._get_uuid(PhoneCleaner.normalise_phone(phone))
+        if uuid is None:
+            raise KeyError(phone)
+        return uuid
+
+    def get_phone(self, uuid):
+        """
+        :param uuid: UUID to look up.
+        :type uuid: str
+        :return: Phone number for this UUID.
+        :rtype: str
+        :raises KeyError: If the UUID is not in the table.
+        """
+        phone = self._get_phone(uuid)
+        if phone is None:
+            raise KeyError(uuid)
+        return phone
+
+    def numbers(self):
+        return [row[0] for row in self._connection.execute("SELECT phone FROM phone_number_uuids")]
+
+    def uuids(self):
+        return [row[0] for row in self._connection.execute("SELECT uuid FROM phone_number_uuids")]
+
+    def commit(self):
+        """
+        Persists all the phone numbers added since the last commit.
+        """
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def _get_uuid(self, normalised_phone):
+        row = self._connection.execute(
+            "SELECT uuid FROM phone_number_uuids WHERE phone = ?", (normalised_phone,)).fetchone()
+        return None if row is None else row[0]
+
+    def _get_phone(self, uuid):
+        row = self._connection.execute(
+            "SELECT phone FROM phone_number_uuids WHERE uuid = ?", (uuid,)).fetchone()
+        return None if row is None else row[0]
+
+    @classmethod
+    def migrate_from_json(cls, json_path, db_path):
+        """
+        Copies every mapping in a JSON phone number <-> UUID table (as written by PhoneNumberUuidTable.dump) into the
+        SQLite table at `db_path`. Mappings already in the SQLite table are left unchanged.
+
+        :param json_path: Path to the JSON table to migrate from.
+        :type json_path: str
+        :param db_path: Path to the SQLite table to migrate to.
+        :type db_path: str
+        :return: The migrated table.
+        :rtype: SQLitePhoneNumberUuidTable
+        """
+        with open(json_path, "r") as f:
+            json_table = PhoneNumberUuidTable.load(f)
+
+        table = cls(db_path)
+        table._connection.executemany("INSERT OR IGNORE INTO phone_number_uuids (phone, uuid) VALUES (?, ?)",
+                                      ((phone, json_table.get_uuid(phone)) for phone in json_table.numbers()))
+        table.commit()
+        return table
@@ -0,0 +1,15 @@
+import sys
+
+
+class PickleUtils(object):
+    # Each TracedData links to its previous state, so pickling recurses once per entry in its history. By the later
+    # stages this is deeper than Python's default limit of 1000.
+    TRACED_DATA_RECURSION_LIMIT = 20000
+
+    @classmethod
+    def ensure_recursion_limit(cls):
+        """
+        Raises the recursion limit of this process, if needed, so that TracedData can be pickled, e.g. to write them
+        to a file or to send them to or from a worker process.
+        """
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), cls.TRACED_DATA_RECURSION_LIMIT))
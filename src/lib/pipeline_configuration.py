@@ -1,15 +1,18 @@
 import json
+import sys
 from urllib.parse import urlparse
 
 from core_data_modules.cleaners import swahili, Codes
 from core_data_modules.data_models import Scheme, validators
 from dateutil.parser import isoparse
 
+from src.lib.indexed_scheme import IndexedScheme
+
 
 def _open_scheme(filename):
     with open(f"code_schemes/{filename}", "r") as f:
         firebase_map = json.load(f)
-        return Scheme.from_firebase_map(firebase_map)
+        return IndexedScheme.from_scheme(Scheme.from_firebase_map(firebase_map))
 
 
 class CodeSchemes(object):
@@ -66,6 +69,16 @@ class CodingPlan(object):
             id_field = "{}_id".format(self.raw_field)
         self.id_field = id_field
 
+        # Keys derived from this plan's fields, which are looked up for every message by several stages.
+        # These are interned so that building them once here is also cheaper to hash and compare.
+        self.source_field = sys.intern(f"{self.raw_field}_source")
+        self.ws_id_field = sys.intern(f"{self.id_field}_WS")
+        self.ws_coded_field = sys.intern(f"{self.coded_field}_WS")
+        self.ws_correct_dataset_field = sys.intern(f"{self.coded_field}_WS_correct_dataset")
+        self.binary_ws_coded_field = None
+        if self.binary_coded_field is not None:
+            self.binary_ws_coded_field = sys.intern(f"{self.binary_coded_field}_WS")
+
 
 class PipelineConfiguration(object):
     DEV_MODE = False
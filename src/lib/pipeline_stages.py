@@ -0,0 +1,156 @@
+from core_data_modules.logging import Logger
+
+from src.lib.stage_cache import StageCache
+
+log = Logger(__name__)
+
+
+class PipelineStage(object):
+    def __init__(self, name, description, run, input_paths=None, output_paths=None, modifies_data=True,
+                 cacheable=True, stats=None):
+        """
+        A stage of the pipeline, with the inputs and outputs it depends on declared.
+
+        Every stage depends on the data output by the stage before it. Stages may additionally depend on files,
+        such as Coda files or code schemes, which are declared in `input_paths`.
+
+        :param name: Name of this stage.
+        :type name: str
+        :param description: Message to print when this stage starts.
+        :type description: str
+        :param run: Function which runs this stage. It is given the data output by the previous stage (None for the
+                    first stage) and returns the data to give to the next stage.
+        :type run: function of (list of TracedData | None) -> list of TracedData
+        :param input_paths: Paths to the files this stage reads, other than the data output by the previous stage.
+        :type input_paths: list of str | None
+        :param output_paths: Paths to the files this stage writes.
+        :type output_paths: list of str | None
+        :param modifies_data: Whether this stage changes the data it is given. If False, `run` must return the data
+                              it was given, and that data isn't cached again for this stage.
+        :type modifies_data: bool
+        :param cacheable: Whether this stage may be skipped when its inputs haven't changed since it last ran.
+                          Stages with external side effects, such as uploads, should not be cacheable.
+        :type cacheable: bool
+        :param stats: Function which returns statistics about the last run of this stage, to include in the stage
+                      report, or None.
+        :type stats: (function of () -> dict) | None
+        """
+        if input_paths is None:
+            input_paths = []
+        if output_paths is None:
+            output_paths = []
+
+        self.name = name
+        self.description = description
+        self.run = run
+        self.input_paths = input_paths
+        self.output_paths = output_paths
+        self.modifies_data = modifies_data
+        self.cacheable = cacheable
+        self.stats = stats
+
+
+class PipelineStageRunner(object):
+    @staticmethod
+    def fingerprint_stage(stage, data_fingerprint):
+        """
+        Fingerprints the inputs to a stage.
+
+        The fingerprint of a stage covers its name, its declared input files, and the values of the data it is given,
+        so a stage's fingerprint only changes when its own inputs change. A stage is not invalidated by a change to
+        the inputs of an earlier stage unless that change also changes the data the earlier stage outputs.
+
+        :param stage: Stage to fingerprint.
+        :type stage: PipelineStage
+        :param data_fingerprint: Fingerprint of the data the stage is given, as returned by
+                                 StageCache.fingerprint_traced_data, or None if the stage is given no data.
+        :type data_fingerprint: str | None
+        :return: Fingerprint of the inputs to `stage`.
+        :rtype: str
+        """
+        return StageCache.fingerprint(stage.name, data_fingerprint, StageCache.fingerprint_files(stage.input_paths))
+
+    @classmethod
+    def run_stages(cls, stages, checkpoints=None, stage_cache=None, resume_from_stage=None, report=None):
+        """
+        Runs pipeline stages in order.
+
+        :param stages: Stages to run, in order.
+        :type stages: list of PipelineStage
+        :param checkpoints: Checkpoints to save the data output by each stage to, or None.
+        :type checkpoints: StageCheckpoints | None
+        :param stage_cache: Cache of the outputs of the last successful run of each stage, or None.
+                            If provided, stages whose inputs haven't changed since they last succeeded are skipped, and
+                            their outputs restored from the cache.
+        :type stage_cache: StageCache | None
+        :param resume_from_stage: Name of the stage to start from, or None to start from the first stage.
+                                  If provided, the data output by the stage before is reloaded from `checkpoints`.
+        :type resume_from_stage: str | None
+        :param report: Report to measure each stage in, or None.
+        :type report: StageReport | None
+        """
+        stage_names = [stage.name for stage in stages]
+
+        first_stage_index = 0
+        data = None
+        if resume_from_stage is not None:
+            first_stage_index = stage_names.index(resume_from_stage)
+            if first_stage_index > 0:
+                assert checkpoints is not None, "Resuming from a stage requires checkpoints"
+                previous_stage_name = stage_names[first_stage_index - 1]
+                print(f"Resuming from stage '{resume_from_stage}' using the checkpoint of stage '{previous_stage_name}'...")
+                data = checkpoints.load(previous_stage_name)
+
+        # Fingerprint of the values of the current data, if stages are being cached.
+        # This is None while the current data is None, i.e. before the first stage.
+        data_fingerprint = None
+        if stage_cache is not None and data is not None:
+            data_fingerprint = StageCache.fingerprint_traced_data(data)
+
+        # Name of the skipped stage whose cached output data is the current data, if that data hasn't been loaded yet.
+        # The data is only loaded when a later stage needs to run, so a run of skipped stages costs a single load.
+        unloaded_data_stage_name = None
+
+        for i in range(first_stage_index, len(stages)):
+            stage = stages[i]
+            is_last_stage = i == len(stages) - 1
+
+            fingerprint = None
+            if stage_cache is not None and stage.cacheable:
+                fingerprint = cls.fingerprint_stage(stage, data_fingerprint)
+
+            if fingerprint is not None and stage_cache.is_up_to_date(stage.name, fingerprint):
+                print(f"{stage.description} (skipped: inputs unchanged since the last run)")
+                stage_cache.restore_outputs(stage.name, stage.output_paths)
+                if report is not None:
+                    report.record_skipped_stage(stage)
+                if stage.modifies_data:
+                    unloaded_data_stage_name = stage.name
+                    data = None
+                    data_fingerprint = stage_cache.data_fingerprint(stage.name)
+            else:
+                if unloaded_data_stage_name is not None:
+                    data = stage_cache.load_data(unloaded_data_stage_name)
+                    unloaded_data_stage_name = None
+
+                print(stage.description)
+                if report is not None:
+                    data = report.run_stage(stage, data)
+                else:
+                    data = stage.run(data)
+
+                if stage_cache is not None and stage.modifies_data:
+                    data_fingerprint = StageCache.fingerprint_traced_data(data)
+
+                if fingerprint is not None:
+                    if stage.modifies_data:
+                        stage_cache.record(stage.name, fingerprint, stage.output_paths, data, data_fingerprint)
+                    else:
+                        stage_cache.record(stage.name, fingerprint, stage.output_paths)
+
+            # There is nothing to resume after the last stage, so only checkpoint the stages before it.
+            if checkpoints is not None and not is_last_stage:
+                if unloaded_data_stage_name is not None:
+                    data = stage_cache.load_data(unloaded_data_stage_name)
+                    unloaded_data_stage_name = None
+                checkpoints.save(stage.name, data)
@@ -0,0 +1,107 @@
+import json
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+log = Logger(__name__)
+
+
+class PipelineTracer(object):
+    def __init__(self, trace_path=None):
+        """
+        Writes structured trace events from pipeline stages to a JSON Lines file, one event per line.
+
+        Every event has an "Event" name and the "uid" it is about, so the trace for one participant can be found with
+        `PipelineTracer.read_events` (or e.g. `grep` or `jq`) without parsing the rest of the pipeline's logs.
+
+        If `trace_path` is None, tracing is disabled. Trace points should check `enabled` before building their events,
+        so that they cost nothing when tracing is off:
+
+            if tracer.enabled:
+                tracer.trace("SomeEvent", uid, SomeField=expensive_value())
+
+        :param trace_path: Path to write the trace to, or None to disable tracing. Any existing file at this path is
+                           overwritten.
+        :type trace_path: str | None
+        """
+        self.trace_path = trace_path
+        self.enabled = trace_path is not None
+        self._f = None
+
+        if self.enabled:
+            IOUtils.ensure_dirs_exist_for_file(trace_path)
+            self._f = open(trace_path, "w")
+            log.info(f"Writing trace events to '{trace_path}'")
+
+    @staticmethod
+    def make_event(event, uid, **fields):
+        """
+        Makes a trace event, for stages which collect their events before writing them, e.g. in worker processes.
+
+        :param event: Name of the event.
+        :type event: str
+        :param uid: Uid of the participant the event is about.
+        :type uid: str
+        :param fields: Other fields of the event. These must be JSON serializable.
+        :return: Trace event.
+        :rtype: dict
+        """
+        trace_event = {"Event": event, "uid": uid}
+        trace_event.update(fields)
+        return trace_event
+
+    def trace(self, event, uid, **fields):
+        """
+        Writes a trace event, if tracing is enabled.
+
+        :param event: Name of the event.
+        :type event: str
+        :param uid: Uid of the participant the event is about.
+        :type uid: str
+        :param fields: Other fields of the event. These must be JSON serializable.
+        """
+        if not self.enabled:
+            return
+        self.write_events([self.make_event(event, uid, **fields)])
+
+    def write_events(self, trace_events):
+        """
+        Writes trace events made by `make_event`, if tracing is enabled.
+
+        :param trace_events: Trace events to write, in order.
+        :type trace_events: iterable of dict
+        """
+        if not self.enabled:
+            return
+        for trace_event in trace_events:
+            self._f.write(json.dumps(trace_event))
+            self._f.write("\n")
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    @staticmethod
+    def read_events(trace_path, uid=None, event=None):
+        """
+        Reads the events in a trace file.
+
+        :param trace_path: Path to the trace file to read.
+        :type trace_path: str
+        :param uid: Uid to read the events for, or None to read the events for all uids.
+        :type uid: str | None
+        :param event: Name of the events to read, or None to read events with any name.
+        :type event: str | None
+        :return: Trace events, in the order they were written.
+        :rtype: generator of dict
+        """
+        with open(trace_path, "r") as f:
+            for line in f:
+                trace_event = json.loads(line)
+                if uid is not None and trace_event["uid"] != uid:
+                    continue
+                if event is not None and trace_event["Event"] != event:
+                    continue
+                yield trace_event
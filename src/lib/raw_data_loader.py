@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data.io import TracedDataJsonIO
+
+log = Logger(__name__)
+
+
+class RawDataLoader(object):
+    @staticmethod
+    def load_traced_data_file(path):
+        """
+        Loads a JSONL file of TracedData, as exported by fetch_raw_data.py.
+
+        :param path: Path to the file to load.
+        :type path: str
+        :return: TracedData in the file.
+        :rtype: list of TracedData
+        """
+        with open(path, "r") as f:
+            return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
+
+    @classmethod
+    def load_traced_data_files(cls, paths, processes=1):
+        """
+        Loads each of the given JSONL files of TracedData.
+
+        Decoding the JSON and constructing the TracedData is CPU-bound, so if processes > 1 the files are loaded in
+        parallel by a pool of that many worker processes, with one file loaded per task.
+
+        :param paths: Paths to the files to load.
+        :type paths: list of str
+        :param processes: Maximum number of worker processes to load files with. If 1, files are loaded serially in
+                          this process.
+        :type processes: int
+        :return: The TracedData in each file, in the same order as `paths`.
+        :rtype: list of (list of TracedData)
+        """
+        start = time.perf_counter()
+
+        if processes <= 1 or len(paths) <= 1:
+            datasets = []
+            for path in paths:
+                log.info(f"Loading {path}...")
+                datasets.append(cls.load_traced_data_file(path))
+        else:
+            log.info(f"Loading {len(paths)} files using {min(processes, len(paths))} processes...")
+            with ProcessPoolExecutor(max_workers=min(processes, len(paths))) as executor:
+                # executor.map returns results in the order of `paths`, regardless of which worker finishes first.
+                datasets = list(executor.map(cls.load_traced_data_file, paths))
+
+        for path, dataset in zip(paths, datasets):
+            log.debug(f"Loaded {len(dataset)} TracedData from {path}")
+        log.info(f"Loaded {len(paths)} files in {time.perf_counter() - start:.2f}s")
+
+        return datasets
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import pickle
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+from src.lib.pickle_utils import PickleUtils
+
+log = Logger(__name__)
+
+
+class RawDataSnapshot(object):
+    """
+    Binary snapshot of the TracedData loaded from the raw data files, so that the JSON in those files only needs to be
+    decoded again when the files change.
+
+    A snapshot file contains two pickles: a header holding the snapshot format version and a fingerprint of each
+    source file (its size, mtime and SHA-256), followed by the loaded datasets. The header is checked against the
+    current source files before the datasets are unpickled.
+    """
+    FORMAT_VERSION = 1
+
+    @staticmethod
+    def _sha256(path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @classmethod
+    def _fingerprint_file(cls, path):
+        stat = os.stat(path)
+        return {
+            "Path": path,
+            "Size": stat.st_size,
+            "MTime": stat.st_mtime_ns,
+            "SHA256": cls._sha256(path)
+        }
+
+    @classmethod
+    def _file_matches_fingerprint(cls, path, fingerprint):
+        if fingerprint["Path"] != path:
+            return False
+
+        stat = os.stat(path)
+        if stat.st_size != fingerprint["Size"]:
+            return False
+        # Files which have the same size and mtime are assumed to be unchanged. Otherwise, fall back to comparing
+        # the content, because copying the raw data (e.g. into a Docker container) does not always preserve mtimes.
+        if stat.st_mtime_ns == fingerprint["MTime"]:
+            return True
+        return cls._sha256(path) == fingerprint["SHA256"]
+
+    @classmethod
+    def load(cls, snapshot_path, paths):
+        """
+        Loads the datasets in a snapshot, provided the snapshot was made from exactly the given source files and
+        none of those files have changed since.
+
+        :param snapshot_path: Path to the snapshot file.
+        :type snapshot_path: str
+        :param paths: Paths to the raw data files the snapshot should have been made from.
+        :type paths: list of str
+        :return: The TracedData loaded from each of the files in `paths`, or None if there is no snapshot at
+                 `snapshot_path` or if that snapshot is stale or corrupt.
+        :rtype: list of (list of TracedData) | None
+        """
+        if not os.path.exists(snapshot_path):
+            log.info(f"No raw data snapshot found at {snapshot_path}")
+            return None
+
+        PickleUtils.ensure_recursion_limit()
+        try:
+            with open(snapshot_path, "rb") as f:
+                header = pickle.load(f)
+                if header["Version"] != cls.FORMAT_VERSION:
+                    log.info(f"Raw data snapshot {snapshot_path} has format version {header['Version']}, but "
+                             f"version {cls.FORMAT_VERSION} is required; rebuilding")
+                    return None
+
+                fingerprints = header["Fingerprints"]
+                if len(fingerprints) != len(paths) or \
+                        not all(cls._file_matches_fingerprint(path, fingerprint)
+                                for path, fingerprint in zip(paths, fingerprints)):
+                    log.info(f"Raw data snapshot {snapshot_path} is stale; rebuilding")
+                    return None
+
+                datasets = pickle.load(f)
+        except Exception as e:
+            log.warning(f"Failed to load raw data snapshot {snapshot_path} ({type(e).__name__}: {e}); rebuilding")
+            return None
+
+        if len(datasets) != len(paths):
+            log.warning(f"Raw data snapshot {snapshot_path} is corrupt; rebuilding")
+            return None
+
+        log.info(f"Loaded raw data snapshot {snapshot_path}")
+        return datasets
+
+    @classmethod
+    def save(cls, snapshot_path, paths, datasets):
+        """
+        Writes a snapshot of the given datasets.
+
+        :param snapshot_path: Path to write the snapshot to.
+        :type snapshot_path: str
+        :param paths: Paths to the raw data files the datasets were loaded from.
+        :type paths: list of str
+        :param datasets: The TracedData loaded from each of the files in `paths`.
+        :type datasets: list of (list of TracedData)
+        """
+        header = {
+            "Version": cls.FORMAT_VERSION,
+            "Fingerprints": [cls._fingerprint_file(path) for path in paths]
+        }
+
+        PickleUtils.ensure_recursion_limit()
+        IOUtils.ensure_dirs_exist_for_file(snapshot_path)
+        with open(f"{snapshot_path}.tmp", "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(datasets, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{snapshot_path}.tmp", snapshot_path)
+        log.info(f"Saved raw data snapshot to {snapshot_path}")
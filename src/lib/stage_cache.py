@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import shutil
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+from src.lib.stage_checkpoints import StageCheckpoints
+
+log = Logger(__name__)
+
+
+class StageCache(object):
+    """
+    Records the fingerprint of the inputs to each cached step of the pipeline on its last successful run, together
+    with copies of the files and data that step output, so that the step can be skipped and its outputs restored
+    when it is next run with the same inputs.
+    """
+    MANIFEST_FILE_NAME = "manifest.json"
+
+    def __init__(self, cache_dir, code_fingerprint=""):
+        """
+        :param cache_dir: Directory to read and write the cache in.
+        :type cache_dir: str
+        :param code_fingerprint: Fingerprint of the code which is running. This is combined with the fingerprint of
+                                 every cached step, so that all steps are recomputed when the code changes.
+        :type code_fingerprint: str
+        """
+        self.cache_dir = cache_dir
+        self.code_fingerprint = code_fingerprint
+        self._manifest_path = f"{cache_dir}/{self.MANIFEST_FILE_NAME}"
+        self._data_checkpoints = StageCheckpoints(f"{cache_dir}/data")
+
+        # Dictionary of step name -> {"Fingerprint": str, "OutputCount": int, "HasData": bool,
+        #                              "DataFingerprint": str, if HasData}
+        self._manifest = dict()
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r") as f:
+                self._manifest = json.load(f)
+
+    @staticmethod
+    def fingerprint(*parts):
+        """
+        :param parts: JSON-serializable values to fingerprint.
+        :type parts: list
+        :return: Fingerprint of the given values.
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    @staticmethod
+    def fingerprint_files(paths):
+        """
+        :param paths: Paths of the files to fingerprint. Paths which do not exist are fingerprinted as missing.
+        :type paths: iterable of str
+        :return: Fingerprint of the paths and contents of the given files.
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        for path in paths:
+            h.update(path.encode("utf-8"))
+            if not os.path.exists(path):
+                h.update(b"\0missing\0")
+                continue
+
+            h.update(b"\0exists\0")
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def fingerprint_traced_data(data, keys=None):
+        """
+        :param data: TracedData to fingerprint.
+        :type data: iterable of TracedData
+        :param keys: Keys of each TracedData to include in the fingerprint, or None to include every key.
+                     All other keys are ignored.
+        :type keys: list of str | None
+        :return: Fingerprint of the values of the given keys in each TracedData, in order.
+                 The history of each TracedData is not included.
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        for td in data:
+            if keys is None:
+                values = sorted(td.items())
+            else:
+                values = [td.get(key) for key in keys]
+            h.update(json.dumps(values, default=str).encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    def _cached_output_path(self, name, output_index):
+        return f"{self.cache_dir}/files/{name}/{output_index}"
+
+    def _versioned_fingerprint(self, fingerprint):
+        return self.fingerprint(self.code_fingerprint, fingerprint)
+
+    def is_up_to_date(self, name, fingerprint):
+        """
+        :param name: Name of the cached step.
+        :type name: str
+        :param fingerprint: Fingerprint of the inputs to the step.
+        :type fingerprint: str
+        :return: Whether the step last succeeded with inputs which had this fingerprint, and its outputs are cached.
+        :rtype: bool
+        """
+        entry = self._manifest.get(name)
+        if entry is None or entry["Fingerprint"] != self._versioned_fingerprint(fingerprint):
+            return False
+
+        for i in range(entry["OutputCount"]):
+            if not os.path.exists(self._cached_output_path(name, i)):
+                return False
+        if entry["HasData"] and ("DataFingerprint" not in entry or not self._data_checkpoints.has_checkpoint(name)):
+            return False
+
+        return True
+
+    def restore_outputs(self, name, output_paths):
+        """
+        Copies the files output by the last successful run of a step back to the given paths.
+
+        :param name: Name of the cached step.
+        :type name: str
+        :param output_paths: Paths to restore the outputs to, in the order the outputs were recorded in.
+        :type output_paths: list of str
+        """
+        assert len(output_paths) == self._manifest[name]["OutputCount"], \
+            f"Step '{name}' was recorded with a different number of outputs"
+        for i, output_path in enumerate(output_paths):
+            IOUtils.ensure_dirs_exist_for_file(output_path)
+            shutil.copyfile(self._cached_output_path(name, i), output_path)
+
+    def load_data(self, name):
+        """
+        :param name: Name of the cached step.
+        :type name: str
+        :return: Data output by the last successful run of the step.
+        :rtype: list of TracedData
+        """
+        return self._data_checkpoints.load(name)
+
+    def data_fingerprint(self, name):
+        """
+        :param name: Name of the cached step.
+        :type name: str
+        :return: Fingerprint of the data output by the last successful run of the step, as given to `record`.
+        :rtype: str
+        """
+        return self._manifest[name]["DataFingerprint"]
+
+    def record(self, name, fingerprint, output_paths, data=None, data_fingerprint=None):
+        """
+        Records a successful run of a step.
+
+        :param name: Name of the step.
+        :type name: str
+        :param fingerprint: Fingerprint of the inputs the step was run with.
+        :type fingerprint: str
+        :param output_paths: Paths to the files output by the step.
+        :type output_paths: list of str
+        :param data: Data output by the step, or None if the step does not output any data to cache.
+        :type data: list of TracedData | None
+        :param data_fingerprint: Fingerprint of `data`. Required if `data` is not None.
+        :type data_fingerprint: str | None
+        """
+        assert data is None or data_fingerprint is not None, "Recording data requires its fingerprint"
+
+        # Remove the existing entry before overwriting its outputs, so that an interrupted write can't leave the
+        # manifest describing outputs from a different run.
+        if name in self._manifest:
+            del self._manifest[name]
+            self._write_manifest()
+
+        if data is not None:
+            self._data_checkpoints.save(name, data)
+        for i, output_path in enumerate(output_paths):
+            cached_output_path = self._cached_output_path(name, i)
+            IOUtils.ensure_dirs_exist_for_file(cached_output_path)
+            shutil.copyfile(output_path, cached_output_path)
+
+        self._manifest[name] = {
+            "Fingerprint": self._versioned_fingerprint(fingerprint),
+            "OutputCount": len(output_paths),
+            "HasData": data is not None
+        }
+        if data is not None:
+            self._manifest[name]["DataFingerprint"] = data_fingerprint
+        self._write_manifest()
+
+    def run_cached(self, name, fingerprint, output_paths, produce_outputs):
+        """
+        Writes the output files of a step, either by restoring them from the cache if the step's inputs have not
+        changed since it last ran, or otherwise by running the step.
+
+        :param name: Name of the step.
+        :type name: str
+        :param fingerprint: Fingerprint of the inputs to the step.
+        :type fingerprint: str
+        :param output_paths: Paths to the files output by the step.
+        :type output_paths: list of str
+        :param produce_outputs: Function which runs the step, writing its outputs to `output_paths`.
+        :type produce_outputs: function of () -> None
+        :return: Whether the outputs were restored from the cache.
+        :rtype: bool
+        """
+        if self.is_up_to_date(name, fingerprint):
+            log.info(f"Inputs to '{name}' unchanged since it last ran; restoring its outputs from the cache")
+            self.restore_outputs(name, output_paths)
+            return True
+
+        produce_outputs()
+        self.record(name, fingerprint, output_paths)
+        return False
+
+    def _write_manifest(self):
+        IOUtils.ensure_dirs_exist_for_file(self._manifest_path)
+        with open(f"{self._manifest_path}.tmp", "w") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(f"{self._manifest_path}.tmp", self._manifest_path)
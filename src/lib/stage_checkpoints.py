@@ -0,0 +1,62 @@
+import os
+import pickle
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+from src.lib.pickle_utils import PickleUtils
+
+log = Logger(__name__)
+
+
+class StageCheckpoints(object):
+    def __init__(self, checkpoint_dir):
+        """
+        Stores the data output by each pipeline stage, so that a later run can resume from the stage after it.
+
+        Checkpoints are pickled, because this is much faster to reload than the TracedData JSON format.
+
+        :param checkpoint_dir: Directory to read and write checkpoints in.
+        :type checkpoint_dir: str
+        """
+        self.checkpoint_dir = checkpoint_dir
+
+    def _checkpoint_path(self, stage_name):
+        return f"{self.checkpoint_dir}/{stage_name}.pickle"
+
+    def has_checkpoint(self, stage_name):
+        return os.path.exists(self._checkpoint_path(stage_name))
+
+    def save(self, stage_name, data):
+        """
+        Writes a checkpoint of the data output by a stage.
+
+        :param stage_name: Name of the stage which output `data`.
+        :type stage_name: str
+        :param data: Data output by the stage.
+        :type data: list of TracedData
+        """
+        PickleUtils.ensure_recursion_limit()
+        path = self._checkpoint_path(stage_name)
+        IOUtils.ensure_dirs_exist_for_file(path)
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+        log.info(f"Saved checkpoint for stage '{stage_name}' to {path}")
+
+    def load(self, stage_name):
+        """
+        Loads the checkpoint of the data output by a stage.
+
+        :param stage_name: Name of the stage to load the output of.
+        :type stage_name: str
+        :return: Data output by the stage.
+        :rtype: list of TracedData
+        """
+        PickleUtils.ensure_recursion_limit()
+        path = self._checkpoint_path(stage_name)
+        assert os.path.exists(path), f"No checkpoint for stage '{stage_name}' found at {path}"
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        log.info(f"Loaded checkpoint for stage '{stage_name}' from {path}")
+        return data
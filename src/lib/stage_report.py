@@ -0,0 +1,157 @@
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils, TimeUtils
+
+log = Logger(__name__)
+
+
+class StageReport(object):
+    def __init__(self, report_path, trace_memory=False):
+        """
+        Measures the time, memory and throughput of each pipeline stage, and writes the measurements to a JSON report.
+
+        The report is rewritten after every stage, so a run which fails part way through still reports the stages
+        which ran before the failure, and the time and memory of the stage which failed.
+
+        CPU time includes the CPU time of any child processes a stage runs, such as process pool workers, once they
+        have exited. Memory is reported separately for this process and for its children. The children's peak RSS
+        is that of the largest child process run so far, because the operating system doesn't report it per stage.
+
+        :param report_path: Path to write the JSON report to.
+        :type report_path: str
+        :param trace_memory: Whether to also measure the peak memory allocated by Python during each stage, using
+                             tracemalloc. This is more precise than the process' peak RSS, but slows the stages down.
+        :type trace_memory: bool
+        """
+        self.report_path = report_path
+        self.trace_memory = trace_memory
+        self.started_at = TimeUtils.utc_now_as_iso_string()
+        self.stages = []  # of dict
+
+    @staticmethod
+    def _max_rss_mb(who=resource.RUSAGE_SELF):
+        max_rss = resource.getrusage(who).ru_maxrss
+        # ru_maxrss is in bytes on macOS, but in kilobytes on Linux.
+        if sys.platform == "darwin":
+            return max_rss / (1024 * 1024)
+        return max_rss / 1024
+
+    @staticmethod
+    def _children_cpu_time():
+        # Only includes child processes which have exited and been waited for. The process pools used by the stages
+        # are shut down before the stages return, so their workers are included by the end of the stage which used
+        # them.
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @staticmethod
+    def _count(data):
+        return len(data) if isinstance(data, list) else None
+
+    def run_stage(self, stage, data):
+        """
+        Runs a pipeline stage, and measures it.
+
+        If the stage raises an exception, it is still recorded in the report, with "Failed" set, before the
+        exception is re-raised.
+
+        :param stage: Stage to run.
+        :type stage: PipelineStage
+        :param data: Data to give to the stage.
+        :type data: list of TracedData | None
+        :return: Data output by the stage.
+        :rtype: list of TracedData
+        """
+        input_count = self._count(data)
+        max_rss_mb_before = self._max_rss_mb()
+        if self.trace_memory:
+            tracemalloc.start()
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        start_children_cpu_time = self._children_cpu_time()
+
+        failed = True
+        try:
+            data = stage.run(data)
+            failed = False
+        finally:
+            wall_time = time.perf_counter() - start_wall_time
+            children_cpu_time = self._children_cpu_time() - start_children_cpu_time
+            cpu_time = time.process_time() - start_cpu_time + children_cpu_time
+            traced_peak_mb = None
+            if self.trace_memory:
+                traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+            max_rss_mb = self._max_rss_mb()
+            children_max_rss_mb = self._max_rss_mb(resource.RUSAGE_CHILDREN)
+            output_count = None if failed else self._count(data)
+
+            # Throughput is measured against the messages given to the stage. The first stage isn't given any
+            # messages because it loads them itself, so its throughput is measured against the messages it outputs.
+            messages_count = input_count if input_count is not None else output_count
+            messages_per_second = None
+            if not failed and messages_count is not None and wall_time > 0:
+                messages_per_second = messages_count / wall_time
+
+            self.stages.append({
+                "Stage": stage.name,
+                "Skipped": False,
+                "Failed": failed,
+                "WallTimeSeconds": wall_time,
+                "CPUTimeSeconds": cpu_time,
+                "ChildrenCPUTimeSeconds": children_cpu_time,
+                "MaxRSSMB": max_rss_mb,
+                "MaxRSSIncreaseMB": max_rss_mb - max_rss_mb_before,
+                "ChildrenMaxRSSMB": children_max_rss_mb,
+                "TracedPeakMB": traced_peak_mb,
+                "InputCount": input_count,
+                "OutputCount": output_count,
+                "MessagesPerSecond": messages_per_second,
+                "Stats": stage.stats() if stage.stats is not None and not failed else None
+            })
+            if failed:
+                log.warning(f"Stage '{stage.name}' failed after {wall_time:.2f}s wall time, {cpu_time:.2f}s CPU time")
+            else:
+                log.info(f"Stage '{stage.name}' took {wall_time:.2f}s wall time, {cpu_time:.2f}s CPU time "
+                         f"({children_cpu_time:.2f}s in child processes); {input_count} -> {output_count} TracedData; "
+                         f"max RSS {max_rss_mb:.0f}MB, {children_max_rss_mb:.0f}MB in child processes")
+            self.write()
+
+        return data
+
+    def record_skipped_stage(self, stage):
+        """
+        Records that a pipeline stage was skipped.
+
+        :param stage: Stage which was skipped.
+        :type stage: PipelineStage
+        """
+        self.stages.append({
+            "Stage": stage.name,
+            "Skipped": True
+        })
+        self.write()
+
+    def write(self):
+        """
+        Writes the report of the stages measured so far to this report's path.
+        """
+        report = {
+            "StartedAt": self.started_at,
+            "TotalWallTimeSeconds": sum(stage.get("WallTimeSeconds", 0) for stage in self.stages),
+            "TotalCPUTimeSeconds": sum(stage.get("CPUTimeSeconds", 0) for stage in self.stages),
+            "MaxRSSMB": self._max_rss_mb(),
+            "ChildrenMaxRSSMB": self._max_rss_mb(resource.RUSAGE_CHILDREN),
+            "Stages": self.stages
+        }
+
+        IOUtils.ensure_dirs_exist_for_file(self.report_path)
+        with open(f"{self.report_path}.tmp", "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(f"{self.report_path}.tmp", self.report_path)
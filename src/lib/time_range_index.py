@@ -0,0 +1,79 @@
+from bisect import bisect_right
+from datetime import datetime
+
+import pytz
+
+from src.lib.timestamps import Timestamps
+
+
+class TimeRangeIndex(object):
+    def __init__(self, ranges_by_key, exclusive_keys=None):
+        """
+        Sorted index of time ranges, which finds the keys whose ranges contain a timestamp in O(log n).
+
+        The boundaries of all the ranges split time into consecutive segments, and the keys whose ranges cover each
+        segment are computed once when the index is built. Looking up a timestamp is then a binary search for the
+        segment it falls in.
+
+        :param ranges_by_key: Dictionary of key -> the time ranges for that key, each in the format
+                              (start_of_range_inclusive, end_of_range_exclusive), as ISO 8601 strings.
+        :type ranges_by_key: dict of str -> list of (str, str)
+        :param exclusive_keys: Keys whose ranges must not overlap with the ranges of any other of these keys.
+                               If any do, this constructor fails an assertion. If None, no keys are exclusive.
+        :type exclusive_keys: iterable of str | None
+        """
+        if exclusive_keys is None:
+            exclusive_keys = []
+        exclusive_keys = set(exclusive_keys)
+
+        epoch_ranges_by_key = dict()  # of key -> list of (int, int)
+        boundaries = set()
+        for key, ranges in ranges_by_key.items():
+            epoch_ranges = []
+            for range_start, range_end in ranges:
+                epoch_range = (Timestamps.to_epoch_micros(range_start), Timestamps.to_epoch_micros(range_end))
+                assert epoch_range[0] < epoch_range[1], f"Time range {(range_start, range_end)} for {key} is empty"
+                epoch_ranges.append(epoch_range)
+                boundaries.update(epoch_range)
+            epoch_ranges_by_key[key] = epoch_ranges
+
+        # Segment i runs from boundaries[i] (inclusive) to boundaries[i + 1] (exclusive).
+        self.boundaries = sorted(boundaries)
+        self.segment_keys = []  # of frozenset of str
+        for segment_start in self.boundaries[:-1]:
+            keys = frozenset(
+                key for key, epoch_ranges in epoch_ranges_by_key.items()
+                if any(range_start <= segment_start < range_end for range_start, range_end in epoch_ranges)
+            )
+
+            overlapping_keys = keys.intersection(exclusive_keys)
+            assert len(overlapping_keys) <= 1, \
+                f"Time ranges for {sorted(overlapping_keys)} overlap at " \
+                f"{datetime.fromtimestamp(segment_start / 1000000, pytz.utc).isoformat()}"
+
+            self.segment_keys.append(keys)
+
+    def segment_index(self, timestamp):
+        """
+        :param timestamp: Timestamp to look up, in microseconds since the Unix epoch.
+        :type timestamp: int
+        :return: Index into `segment_keys` of the segment containing `timestamp`, or None if `timestamp` is before the
+                 first range or after the last range.
+        :rtype: int | None
+        """
+        i = bisect_right(self.boundaries, timestamp) - 1
+        if i < 0 or i >= len(self.segment_keys):
+            return None
+        return i
+
+    def keys_at(self, timestamp):
+        """
+        :param timestamp: Timestamp to look up, in microseconds since the Unix epoch.
+        :type timestamp: int
+        :return: Keys which have a time range containing `timestamp`.
+        :rtype: frozenset of str
+        """
+        i = self.segment_index(timestamp)
+        if i is None:
+            return frozenset()
+        return self.segment_keys[i]
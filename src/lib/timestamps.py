@@ -0,0 +1,86 @@
+import re
+from datetime import datetime, date, timedelta
+
+import pytz
+from dateutil.parser import isoparse
+
+
+class Timestamps(object):
+    """
+    Converts ISO 8601 timestamps to integer microseconds since the Unix epoch, which are much cheaper to compare than
+    datetimes.
+
+    Timestamps in the format Rapid Pro exports (e.g. "2019-04-05T07:00:00.123456+00:00") are parsed with a fixed-format
+    parser. Any other timestamps, such as those using "T24:00:00" for the end of a day, fall back to dateutil's
+    isoparse. Conversions are memoised by timestamp string, so each distinct timestamp is only parsed once no matter how
+    many stages read it.
+    """
+    _RAPID_PRO_TIMESTAMP_REGEX = re.compile(
+        r"(\d{4})-(\d{2})-(\d{2})T([01]\d|2[0-3]):([0-5]\d):([0-5]\d)(?:\.(\d{1,6}))?(?:(Z)|([+-])(\d{2}):?([0-5]\d))"
+    )
+    _EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+    _EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+    _MICROSECONDS_PER_SECOND = 1000000
+
+    # Maximum number of conversions to memoise. The memo is cleared when it is full, which bounds its memory use
+    # while still covering every timestamp in a typical dataset.
+    MAX_MEMOISED_TIMESTAMPS = 2000000
+    _epoch_micros_memo = dict()  # of timestamp string -> int
+
+    @classmethod
+    def _parse_rapid_pro_timestamp(cls, timestamp):
+        match = cls._RAPID_PRO_TIMESTAMP_REGEX.fullmatch(timestamp)
+        if match is None:
+            return None
+
+        year, month, day, hour, minute, second, fraction, utc, offset_sign, offset_hours, offset_minutes = \
+            match.groups()
+
+        # Validates the date (e.g. rejects February 30th) in the same way isoparse would.
+        days = date(int(year), int(month), int(day)).toordinal() - cls._EPOCH_ORDINAL
+        seconds = days * 86400 + int(hour) * 3600 + int(minute) * 60 + int(second)
+        if utc is None:
+            offset_seconds = int(offset_hours) * 3600 + int(offset_minutes) * 60
+            if offset_sign == "+":
+                seconds -= offset_seconds
+            else:
+                seconds += offset_seconds
+
+        microseconds = 0
+        if fraction is not None:
+            microseconds = int(fraction.ljust(6, "0"))
+
+        return seconds * cls._MICROSECONDS_PER_SECOND + microseconds
+
+    @classmethod
+    def datetime_to_epoch_micros(cls, dt):
+        """
+        :param dt: Timezone-aware datetime to convert.
+        :type dt: datetime.datetime
+        :return: Number of microseconds between the Unix epoch and `dt`.
+        :rtype: int
+        """
+        assert dt.tzinfo is not None, f"Datetime {dt} has no timezone"
+        return (dt - cls._EPOCH) // timedelta(microseconds=1)
+
+    @classmethod
+    def to_epoch_micros(cls, timestamp):
+        """
+        :param timestamp: ISO 8601 timestamp, with a timezone, to convert.
+        :type timestamp: str
+        :return: Number of microseconds between the Unix epoch and `timestamp`.
+        :rtype: int
+        """
+        epoch_micros = cls._epoch_micros_memo.get(timestamp)
+        if epoch_micros is not None:
+            return epoch_micros
+
+        epoch_micros = cls._parse_rapid_pro_timestamp(timestamp)
+        if epoch_micros is None:
+            epoch_micros = cls.datetime_to_epoch_micros(isoparse(timestamp))
+
+        if len(cls._epoch_micros_memo) >= cls.MAX_MEMOISED_TIMESTAMPS:
+            cls._epoch_micros_memo.clear()
+        cls._epoch_micros_memo[timestamp] = epoch_micros
+
+        return epoch_micros
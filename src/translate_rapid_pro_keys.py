@@ -1,10 +1,11 @@
 from datetime import datetime
-from dateutil.parser import isoparse
 
 import pytz
 from core_data_modules.traced_data import Metadata
 from core_data_modules.util import TimeUtils
 
+from src.lib import Timestamps
+
 class TranslateRapidProKeys(object):
     SHOW_ID_MAP = {
         "Rqa_S01_E01 (Value) - icraf_s01_e01_activation": 1,
@@ -77,9 +78,11 @@ class TranslateRapidProKeys(object):
             range_start = pytz.utc.localize(datetime.min)
         if range_end is None:
             range_end = pytz.utc.localize(datetime.max)
+        range_start_micros = Timestamps.datetime_to_epoch_micros(range_start)
+        range_end_micros = Timestamps.datetime_to_epoch_micros(range_end)
         
         for td in data:
-            if time_key in td and range_start <= isoparse(td[time_key]) < range_end:
+            if time_key in td and range_start_micros <= Timestamps.to_epoch_micros(td[time_key]) < range_end_micros:
                 remapped = {
                     "show_id": show_id_to_remap_to
                 }
@@ -147,14 +150,79 @@ class TranslateRapidProKeys(object):
                                    Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
     @classmethod
-    def translate_rapid_pro_keys(cls, user, data, pipeline_configuration, coda_input_dir):
+    def translate_rapid_pro_keys_fused(cls, user, data, pipeline_configuration):
+        """
+        Performs the same translation as set_show_ids, remap_key_names and set_rqa_raw_keys_from_show_ids applied
+        in turn, but in a single pass over the data.
+
+        The show id map, key remappings and raw id map are compiled into lists of lookups once, and then applied to
+        each message in turn. Each message has at most one append, containing all of its translated keys, rather than
+        one append per phase (and one per show id for the raw keys phase), which keeps the history of each TracedData
+        shallower for the rest of the pipeline.
+
+        Arguments:
+            user {str} -- Identifier of the user running this program, for TracedData Metadata.
+            data {iterable of TracedData} -- TracedData objects to translate the keys of.
+            pipeline_configuration {PipelineConfiguration} -- Pipeline configuration.
+        """
+        show_id_lookups = list(cls.SHOW_ID_MAP.items())
+        key_remapping_lookups = [(remapping.rapid_pro_key, remapping.pipeline_key)
+                                 for remapping in pipeline_configuration.rapid_pro_key_remappings]
+        raw_id_map = cls.RAW_ID_MAP
+
+        for td in data:
+            translated = dict()
+
+            # Set the show id, as in set_show_ids.
+            for message_key, show_id in show_id_lookups:
+                if message_key in td:
+                    assert "rqa_message" not in translated
+                    translated["rqa_message"] = td[message_key]
+                    translated["show_id"] = show_id
+
+            # Remap the key names, as in remap_key_names. As in that method, each remapping checks the keys as they
+            # were before any of the remappings were applied.
+            remapped = dict()
+            for old_key, new_key in key_remapping_lookups:
+                if (old_key in translated or old_key in td) and new_key not in translated and new_key not in td:
+                    remapped[new_key] = translated[old_key] if old_key in translated else td[old_key]
+            translated.update(remapped)
+
+            # Set the raw field for the show, as in set_rqa_raw_keys_from_show_ids.
+            if "rqa_message" in translated or "rqa_message" in td:
+                show_id = translated["show_id"] if "show_id" in translated else td.get("show_id")
+                if show_id in raw_id_map:
+                    translated[raw_id_map[show_id]] = \
+                        translated["rqa_message"] if "rqa_message" in translated else td["rqa_message"]
+
+            if len(translated) > 0:
+                td.append_data(translated, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+
+    @classmethod
+    def translate_rapid_pro_keys(cls, user, data, pipeline_configuration, coda_input_dir, fused=True):
         """
         Remaps the keys of rqa messages in the wrong flow into the correct one, and remaps all Rapid Pro keys to
         more usable keys that can be used by the rest of the pipeline.
         
         TODO: Break this function such that the show remapping phase happens in one class, and the Rapid Pro remapping
               in another?
+
+        Arguments:
+            user {str} -- Identifier of the user running this program, for TracedData Metadata.
+            data {iterable of TracedData} -- TracedData objects to translate the keys of.
+            pipeline_configuration {PipelineConfiguration} -- Pipeline configuration.
+            coda_input_dir {str} -- Directory to read coded coda files from.
+
+        Keyword Arguments:
+            fused {bool} -- Whether to translate the keys in a single pass using translate_rapid_pro_keys_fused,
+                            rather than in one pass per phase. (default: {True})
         """
+        if fused:
+            # remap_radio_shows has no implementation, so there is nothing to do between the show id and key
+            # remapping phases. If it is ever implemented, it will need to be added to the fused translation too.
+            cls.translate_rapid_pro_keys_fused(user, data, pipeline_configuration)
+            return data
+
         # Set a show id field for each message, using the presence of Rapid Pro value keys in the TracedData.
         # Show ids are necessary in order to be able to remap radio shows and key names separately (because data
         # can't be 'deleted' from TracedData).
@@ -1,12 +1,14 @@
 import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from core_data_modules.cleaners import Codes
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import Metadata
+from core_data_modules.traced_data import Metadata, TracedData
 from core_data_modules.traced_data.io import TracedDataCodaV2IO
 
-from src.lib import PipelineConfiguration
+from src.lib import CodingPlanRegistry, CodaDatasetCache, CodaImport, PickleUtils, PipelineTracer
 from src.lib.pipeline_configuration import CodeSchemes
 
 log = Logger(__name__)
@@ -20,46 +22,54 @@ class _WSUpdate(object):
 
 class WSCorrection(object):
     @staticmethod
-    def move_wrong_scheme_messages(user, data, coda_input_dir):
+    def move_wrong_scheme_messages(user, data, coda_input_dir, coda_dataset_cache=None, processes=1, tracer=None):
+        if coda_dataset_cache is None:
+            coda_dataset_cache = CodaDatasetCache()
+        if tracer is None:
+            tracer = PipelineTracer()
+
         log.info("Importing manually coded Coda files to '_WS' coded fields...")
-        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-            TracedDataCodaV2IO.compute_message_ids(user, data, plan.raw_field, plan.id_field + "_WS")
-            with open(f"{coda_input_dir}/{plan.coda_filename}") as f:
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                    user, data, plan.id_field + "_WS",
-                    {f"{plan.coded_field}_WS_correct_dataset": CodeSchemes.WS_CORRECT_DATASET}, f
-                )
-
-        for plan in PipelineConfiguration.RQA_CODING_PLANS:
-            with open(f"{coda_input_dir}/{plan.coda_filename}") as f:
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
-                    user, data, plan.id_field + "_WS",
-                    {f"{plan.coded_field}_WS": plan.code_scheme}, f
-                )
-
-                if plan.binary_code_scheme is not None:
-                    f.seek(0)
-                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                        user, data, plan.id_field + "_WS",
-                        {f"{plan.binary_coded_field}_WS": plan.binary_code_scheme}, f
-                    )
-
-        for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-            with open(f"{coda_input_dir}/{plan.coda_filename}") as f:
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                    user, data, plan.id_field + "_WS",
-                    {f"{plan.coded_field}_WS": plan.code_scheme}, f
-                )
+        coda_imports = []
+        for plan in CodingPlanRegistry.ALL_PLANS:
+            TracedDataCodaV2IO.compute_message_ids(user, data, plan.raw_field, plan.ws_id_field)
+            coda_imports.append(CodaImport(
+                plan.ws_id_field,
+                {plan.ws_correct_dataset_field: CodeSchemes.WS_CORRECT_DATASET},
+                f"{coda_input_dir}/{plan.coda_filename}"
+            ))
+
+        for plan in CodingPlanRegistry.RQA_PLANS:
+            coda_imports.append(CodaImport(
+                plan.ws_id_field,
+                {plan.ws_coded_field: plan.code_scheme}, f"{coda_input_dir}/{plan.coda_filename}",
+                multi_coded=True
+            ))
+
+            if plan.binary_code_scheme is not None:
+                coda_imports.append(CodaImport(
+                    plan.ws_id_field,
+                    {plan.binary_ws_coded_field: plan.binary_code_scheme}, f"{coda_input_dir}/{plan.coda_filename}"
+                ))
+
+        for plan in CodingPlanRegistry.SURVEY_PLANS:
+            coda_imports.append(CodaImport(
+                plan.ws_id_field,
+                {plan.ws_coded_field: plan.code_scheme}, f"{coda_input_dir}/{plan.coda_filename}"
+            ))
+
+        # Apply all the imports in a single pass over the data
+        coda_dataset_cache.import_all(user, data, coda_imports)
 
         log.info("Checking for WS Coding Errors...")
         # Check for coding errors in the RQA datasets.
+        # Only plans whose raw field is in a td have any WS labels in it, so the other plans are skipped.
         for td in data:
-            for plan in PipelineConfiguration.RQA_CODING_PLANS:
+            for plan in CodingPlanRegistry.present_plans(td, CodingPlanRegistry.RQA_PLANS):
                 rqa_codes = []
-                for label in td.get(f"{plan.coded_field}_WS", []):
+                for label in td.get(plan.ws_coded_field, []):
                     rqa_codes.append(plan.code_scheme.get_code_with_id(label["CodeID"]))
-                if plan.binary_code_scheme is not None and f"{plan.binary_coded_field}_WS" in td:
-                    label = td[f"{plan.binary_coded_field}_WS"]
+                if plan.binary_code_scheme is not None and plan.binary_ws_coded_field in td:
+                    label = td[plan.binary_ws_coded_field]
                     rqa_codes.append(plan.binary_code_scheme.get_code_with_id(label["CodeID"]))
 
                 has_ws_code_in_code_scheme = False
@@ -68,14 +78,14 @@ class WSCorrection(object):
                         has_ws_code_in_code_scheme = True
 
                 has_ws_code_in_ws_scheme = False
-                if f"{plan.coded_field}_WS_correct_dataset" in td:
+                if plan.ws_correct_dataset_field in td:
                     has_ws_code_in_ws_scheme = CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(
-                        td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"]).code_type == "Normal"
+                        td[plan.ws_correct_dataset_field]["CodeID"]).code_type == "Normal"
 
                 if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
                     log.debug(f"Coding Error: {plan.raw_field}: {td[plan.raw_field]}")
                     coding_error_dict = {
-                        f"{plan.coded_field}_WS_correct_dataset":
+                        plan.ws_correct_dataset_field:
                             CleaningUtils.make_label_from_cleaner_code(
                                 CodeSchemes.WS_CORRECT_DATASET,
                                 CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.CODING_ERROR),
@@ -86,24 +96,24 @@ class WSCorrection(object):
 
         # Check for coding errors in the demogs and follow up surveys datasets, except location, as this is handled differently below.
         for td in data:
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
+            for plan in CodingPlanRegistry.present_plans(td, CodingPlanRegistry.SURVEY_PLANS):
                 if plan.raw_field == "location_raw":
                     continue
 
                 has_ws_code_in_code_scheme = False
-                if f"{plan.coded_field}_WS" in td:
+                if plan.ws_coded_field in td:
                     has_ws_code_in_code_scheme = plan.code_scheme.get_code_with_id(
-                        td[f"{plan.coded_field}_WS"]["CodeID"]).control_code == Codes.WRONG_SCHEME
+                        td[plan.ws_coded_field]["CodeID"]).control_code == Codes.WRONG_SCHEME
 
                 has_ws_code_in_ws_scheme = False
-                if f"{plan.coded_field}_WS_correct_dataset" in td:
+                if plan.ws_correct_dataset_field in td:
                     has_ws_code_in_ws_scheme = CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(
-                        td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"]).code_type == "Normal"
+                        td[plan.ws_correct_dataset_field]["CodeID"]).code_type == "Normal"
 
                 if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
                     log.debug(f"Coding Error: {plan.raw_field}: {td[plan.raw_field]}")
                     coding_error_dict = {
-                        f"{plan.coded_field}_WS_correct_dataset":
+                        plan.ws_correct_dataset_field:
                             CleaningUtils.make_label_from_cleaner_code(
                                 CodeSchemes.WS_CORRECT_DATASET,
                                 CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.CODING_ERROR),
@@ -115,9 +125,9 @@ class WSCorrection(object):
         # Check for coding errors in the locations dataset.
         for td in data:
             location_codes = []
-            for plan in PipelineConfiguration.LOCATION_CODING_PLANS:
-                if f"{plan.coded_field}_WS" in td:
-                    label = td[f"{plan.coded_field}_WS"]
+            for plan in CodingPlanRegistry.LOCATION_PLANS:
+                if plan.ws_coded_field in td:
+                    label = td[plan.ws_coded_field]
                     location_codes.append(plan.code_scheme.get_code_with_id(label["CodeID"]))
 
             has_ws_code_in_code_scheme = False
@@ -126,17 +136,17 @@ class WSCorrection(object):
                     has_ws_code_in_code_scheme = True
 
             has_ws_code_in_ws_scheme = False
-            for plan in PipelineConfiguration.LOCATION_CODING_PLANS:
-                if f"{plan.coded_field}_WS_correct_dataset" in td:
+            for plan in CodingPlanRegistry.LOCATION_PLANS:
+                if plan.ws_correct_dataset_field in td:
                     if CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(
-                            td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"]).code_type == "Normal":
+                            td[plan.ws_correct_dataset_field]["CodeID"]).code_type == "Normal":
                         has_ws_code_in_ws_scheme = True
 
             if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
                 log.debug(f"Coding Error: location_raw: {td['location_raw']}")
                 coding_error_dict = dict()
-                for plan in PipelineConfiguration.LOCATION_CODING_PLANS:
-                    coding_error_dict[f"{plan.coded_field}_WS_correct_dataset"] = \
+                for plan in CodingPlanRegistry.LOCATION_PLANS:
+                    coding_error_dict[plan.ws_correct_dataset_field] = \
                         CleaningUtils.make_label_from_cleaner_code(
                             CodeSchemes.WS_CORRECT_DATASET,
                             CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.CODING_ERROR),
@@ -144,11 +154,8 @@ class WSCorrection(object):
                         ).to_dict()
                 td.append_data(coding_error_dict, Metadata(user, Metadata.get_call_location(), time.time()))
 
-        # Construct a map from WS normal code id to the raw field that code indicates a requested move to.
-        ws_code_to_raw_field_map = dict()
-        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-            if plan.ws_code is not None:
-                ws_code_to_raw_field_map[plan.ws_code.code_id] = plan.raw_field
+        # Map from WS normal code id to the raw field that code indicates a requested move to.
+        ws_code_to_raw_field_map = CodingPlanRegistry.WS_CODE_ID_TO_RAW_FIELD
 
         # Group the TracedData by uid.
         data_grouped_by_uid = dict()
@@ -159,44 +166,108 @@ class WSCorrection(object):
             data_grouped_by_uid[uid].append(td)
 
         # Perform the WS correction for each uid.
-        log.info("Performing WS correction...")
+        # The groups are independent of each other, so if processes > 1 they are corrected in parallel.
+        groups = list(data_grouped_by_uid.values())
+        if processes <= 1 or len(groups) <= 1:
+            log.info("Performing WS correction...")
+            corrected_data, trace_events = WSCorrection._correct_uid_groups(
+                user, groups, ws_code_to_raw_field_map, tracer.enabled)
+            tracer.write_events(trace_events)
+            return corrected_data
+
+        # Split the groups into contiguous shards, several per process so that the work stays balanced when some
+        # shards are slower than others.
+        shards_count = min(processes * 4, len(groups))
+        shard_size = -(-len(groups) // shards_count)
+        shards = [groups[i:i + shard_size] for i in range(0, len(groups), shard_size)]
+
+        log.info(f"Performing WS correction on {len(groups)} uids using {min(processes, len(shards))} processes...")
+        PickleUtils.ensure_recursion_limit()
+        corrected_data = []
+        with ProcessPoolExecutor(max_workers=min(processes, len(shards))) as executor:
+            # executor.map returns results in the order of `shards`, so the corrected data is in the same order as
+            # when the groups are corrected serially.
+            # Trace events can't be written from the workers, so each worker returns its events to be written here.
+            for corrected_shard, trace_events in executor.map(WSCorrection._correct_uid_groups, repeat(user), shards,
+                                                              repeat(ws_code_to_raw_field_map),
+                                                              repeat(tracer.enabled)):
+                corrected_data.extend(corrected_shard)
+                tracer.write_events(trace_events)
+
+        return corrected_data
+
+    @staticmethod
+    def _derive_traced_data(user, parent, new_data):
+        """
+        Derives a new TracedData from `parent`, with `new_data` appended, without copying the parent's history.
+
+        The derived TracedData is built on `parent` with TracedData.append_traced_data, which refers to `parent`
+        rather than copying it. TracedData derived from the same parent therefore share its history, and each only
+        stores its own `new_data`. The values of the derived TracedData are the same as those of
+        `parent.copy()` with `new_data` appended.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param parent: TracedData to derive from. This must not be modified afterwards.
+        :type parent: TracedData
+        :param new_data: Data to append to the derived TracedData.
+        :type new_data: dict
+        :return: Derived TracedData.
+        :rtype: TracedData
+        """
+        derived = TracedData({}, Metadata(user, Metadata.get_call_location(), time.time()))
+        derived.append_traced_data("ws_correction_parent", parent,
+                                   Metadata(user, Metadata.get_call_location(), time.time()))
+        derived.append_data(new_data, Metadata(user, Metadata.get_call_location(), time.time()))
+        return derived
+
+    @staticmethod
+    def _correct_uid_groups(user, groups, ws_code_to_raw_field_map, trace=False):
+        """
+        Moves the wrong scheme messages in each of the given groups of TracedData.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param groups: Groups of TracedData to correct, where each group contains all the TracedData for one uid.
+        :type groups: list of (list of TracedData)
+        :param ws_code_to_raw_field_map: Dictionary of WS normal code id -> the raw field that code indicates a move to.
+        :type ws_code_to_raw_field_map: dict of str -> str
+        :param trace: Whether to make a "WSCorrection.Moves" trace event for each group, recording the moves made.
+        :type trace: bool
+        :return: Tuple of (TracedData with the WS data moved, in the order of `groups`,
+                           trace events made, in the order of `groups`).
+        :rtype: (list of TracedData, list of dict)
+        """
+        # Pickling TracedData recurses through its history, so make sure the results can be returned to the parent
+        # process when this is run in a worker.
+        PickleUtils.ensure_recursion_limit()
+
         corrected_data = []  # List of TracedData with the WS data moved.
-        for group in data_grouped_by_uid.values():
-            log.debug(f"\n\nStarting re-map for {group[0]['uid']}...")
-            for i, td in enumerate(group):
-                log.debug(f"--------------td[{i}]--------------")
-                for _plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.DEMOGS_CODING_PLANS + \
-                             PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-                    log.debug(f"{_plan.raw_field}: {td.get(_plan.raw_field)}")
-                    log.debug(f"{_plan.time_field}: {td.get(_plan.time_field)}")
+        trace_events = []
+        for group in groups:
+            corrected_data_count_before_group = len(corrected_data)
 
             # Find all the demogs and follow-up survey data being moved.
             # (Note: we only need to check one td in this group because all the demographics and follow up surveys are the same)
             td = group[0]
             demogs_and_follow_up_survey_moves = dict()  # of source_field -> target_field
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-                if plan.raw_field not in td:
-                    continue
+            for plan in CodingPlanRegistry.present_plans(td, CodingPlanRegistry.SURVEY_PLANS):
                 ws_code = CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(
-                    td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"])
+                    td[plan.ws_correct_dataset_field]["CodeID"])
                 if ws_code.code_type == "Normal":
-                            log.debug(f"Detected redirect from {plan.raw_field} -> {ws_code_to_raw_field_map.get(ws_code.code_id, ws_code.code_id)} for message {td[plan.raw_field]}")
                             demogs_and_follow_up_survey_moves[plan.raw_field] = ws_code_to_raw_field_map[ws_code.code_id]
 
             # Find all the RQA data being moved.
             rqa_moves = dict()  # of (index in group, source_field) -> target_field
             for i, td in enumerate(group):
-                for plan in PipelineConfiguration.RQA_CODING_PLANS:
-                    if plan.raw_field not in td:
-                        continue
-                    ws_code = CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(td[f"{plan.coded_field}_WS_correct_dataset"]["CodeID"])
+                for plan in CodingPlanRegistry.present_plans(td, CodingPlanRegistry.RQA_PLANS):
+                    ws_code = CodeSchemes.WS_CORRECT_DATASET.get_code_with_id(td[plan.ws_correct_dataset_field]["CodeID"])
                     if ws_code.code_type == "Normal":
-                        log.debug(f"Detected redirect from ({i}, {plan.raw_field}) -> {ws_code_to_raw_field_map.get(ws_code.code_id, ws_code.code_id)} for message {td[plan.raw_field]}")
                         rqa_moves[(i, plan.raw_field)] = ws_code_to_raw_field_map[ws_code.code_id]
 
             # Build a dictionary of the demogs and follow-up survey fields that haven't been moved, and clear fields for those which have.
             demogs_and_follow_up_survey_updates = dict()  # of raw_field -> updated value
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
+            for plan in CodingPlanRegistry.SURVEY_PLANS:
                 if plan.raw_field in demogs_and_follow_up_survey_moves.keys():
                     # Data is moving
                     demogs_and_follow_up_survey_updates[plan.raw_field] = []
@@ -207,23 +278,19 @@ class WSCorrection(object):
             # Build a list of the rqa fields that haven't been moved.
             rqa_updates = []  # of (field, value)
             for i, td in enumerate(group):
-                for plan in PipelineConfiguration.RQA_CODING_PLANS:
-                    if plan.raw_field in td:
-                        if (i, plan.raw_field) in rqa_moves.keys():
-                            # Data is moving
-                            pass
-                        else:
-                            # Data is not moving
-                            rqa_updates.append((plan.raw_field, _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field)))
-
-            raw_demog_and_follow_up_survey_fields = {plan.raw_field for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + \
-                                                     PipelineConfiguration.FOLLOW_UP_CODING_PLANS}
-            raw_rqa_fields = {plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS}
+                for plan in CodingPlanRegistry.present_plans(td, CodingPlanRegistry.RQA_PLANS):
+                    if (i, plan.raw_field) in rqa_moves.keys():
+                        # Data is moving
+                        pass
+                    else:
+                        # Data is not moving
+                        rqa_updates.append((plan.raw_field, _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field)))
 
+            raw_demog_and_follow_up_survey_fields = CodingPlanRegistry.SURVEY_RAW_FIELDS
+            raw_rqa_fields = CodingPlanRegistry.RQA_RAW_FIELDS
 
             # Add data moving from demogs and follow-up survey fields to the relevant demog/follow_up/rqa_updates
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.RQA_CODING_PLANS + \
-                        PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
+            for plan in CodingPlanRegistry.SURVEY_PLANS:
                 if plan.raw_field not in demogs_and_follow_up_survey_moves:
                     continue
                 target_field = demogs_and_follow_up_survey_moves[plan.raw_field]
@@ -236,32 +303,30 @@ class WSCorrection(object):
 
 
             for (i, source_field), target_field in rqa_moves.items():
-                for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.RQA_CODING_PLANS + \
-                            PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-                    if plan.raw_field == source_field:
-                        _td = group[i]
-                        update = _WSUpdate(_td[plan.raw_field], _td[plan.time_field], plan.raw_field)
-                        if target_field in raw_demog_and_follow_up_survey_fields:
-                            demogs_and_follow_up_survey_updates[target_field] = demogs_and_follow_up_survey_updates.get(target_field, []) + [update]
-                        else:
-                            assert target_field in raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
-                            rqa_updates.append((target_field, update))
+                for plan in CodingPlanRegistry.PLANS_BY_RAW_FIELD[source_field]:
+                    _td = group[i]
+                    update = _WSUpdate(_td[plan.raw_field], _td[plan.time_field], plan.raw_field)
+                    if target_field in raw_demog_and_follow_up_survey_fields:
+                        demogs_and_follow_up_survey_updates[target_field] = demogs_and_follow_up_survey_updates.get(target_field, []) + [update]
+                    else:
+                        assert target_field in raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
+                        rqa_updates.append((target_field, update))
 
             # Re-format the demogs and follow-up survey updates to a form suitable for use by the rest of the pipeline
             flattened_demog_and_follow_up_survey_updates = {}
-            for plan in PipelineConfiguration.DEMOGS_CODING_PLANS + PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
+            for plan in CodingPlanRegistry.SURVEY_PLANS:
                 if plan.raw_field in demogs_and_follow_up_survey_updates:
                     plan_updates = demogs_and_follow_up_survey_updates[plan.raw_field]
 
                     if len(plan_updates) > 0:
                         flattened_demog_and_follow_up_survey_updates[plan.raw_field] = "; ".join([u.message for u in plan_updates])
                         flattened_demog_and_follow_up_survey_updates[plan.time_field] = sorted([u.sent_on for u in plan_updates])[0]
-                        flattened_demog_and_follow_up_survey_updates[f"{plan.raw_field}_source"] = "; ".join(
+                        flattened_demog_and_follow_up_survey_updates[plan.source_field] = "; ".join(
                             [u.source for u in plan_updates])
                     else:
                         flattened_demog_and_follow_up_survey_updates[plan.raw_field] = None
                         flattened_demog_and_follow_up_survey_updates[plan.time_field] = None
-                        flattened_demog_and_follow_up_survey_updates[f"{plan.raw_field}_source"] = None
+                        flattened_demog_and_follow_up_survey_updates[plan.source_field] = None
 
             # Hide the demogs and follow up survey keys currently in the TracedData which have had data moved away.
             td.hide_keys({k for k, v in flattened_demog_and_follow_up_survey_updates.items() if v is None}.intersection(td.keys()),
@@ -272,11 +337,12 @@ class WSCorrection(object):
                            Metadata(user, Metadata.get_call_location(), time.time()))
 
             # Hide all the RQA fields (they will be added back, in turn, in the next step).
-            td.hide_keys({plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS}.intersection(td.keys()),
+            td.hide_keys(CodingPlanRegistry.RQA_RAW_FIELDS.intersection(td.keys()),
                          Metadata(user, Metadata.get_call_location(), time.time()))
 
-            # For each rqa message, create a copy of this td, append the rqa message, and add this to the
-            # list of TracedData.
+            # For each rqa message, derive a TracedData from this td, append the rqa message, and add this to the
+            # list of TracedData. If there is only one rqa message, this td isn't shared, so the message is appended
+            # to it directly.
             for target_field, update in rqa_updates:
                 rqa_dict = {
                     target_field: update.message,
@@ -284,14 +350,43 @@ class WSCorrection(object):
                     f"{target_field}_source": update.source
                 }
 
-                corrected_td = td.copy()
-                corrected_td.append_data(rqa_dict, Metadata(user, Metadata.get_call_location(), time.time()))
-                corrected_data.append(corrected_td)
+                if len(rqa_updates) == 1:
+                    td.append_data(rqa_dict, Metadata(user, Metadata.get_call_location(), time.time()))
+                    corrected_data.append(td)
+                else:
+                    corrected_data.append(WSCorrection._derive_traced_data(user, td, rqa_dict))
 
-                log.debug(f"----------Created TracedData--------------")
-                for _plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.DEMOGS_CODING_PLANS + \
-                             PipelineConfiguration.FOLLOW_UP_CODING_PLANS:
-                    log.debug(f"{_plan.raw_field}: {corrected_td.get(_plan.raw_field)}")
-                    log.debug(f"{_plan.time_field}: {corrected_td.get(_plan.time_field)}")
+            if trace:
+                trace_events.append(WSCorrection._make_moves_trace_event(
+                    group, demogs_and_follow_up_survey_moves, rqa_moves,
+                    len(corrected_data) - corrected_data_count_before_group
+                ))
 
-        return corrected_data
+        return corrected_data, trace_events
+
+    @staticmethod
+    def _make_moves_trace_event(group, demogs_and_follow_up_survey_moves, rqa_moves, output_count):
+        # Message ids are recorded rather than the messages, so that a move can be found in Coda without the trace
+        # containing the messages themselves.
+        survey_moves = []
+        for source_field, target_field in demogs_and_follow_up_survey_moves.items():
+            survey_moves.append({
+                "SourceField": source_field,
+                "TargetField": target_field,
+                "MessageID": group[0][CodingPlanRegistry.PLANS_BY_RAW_FIELD[source_field][0].ws_id_field]
+            })
+
+        rqa_message_moves = []
+        for (i, source_field), target_field in rqa_moves.items():
+            rqa_message_moves.append({
+                "Index": i,
+                "SourceField": source_field,
+                "TargetField": target_field,
+                "MessageID": group[i][CodingPlanRegistry.PLANS_BY_RAW_FIELD[source_field][0].ws_id_field]
+            })
+
+        return PipelineTracer.make_event(
+            "WSCorrection.Moves", group[0]["uid"],
+            InputCount=len(group), OutputCount=output_count,
+            SurveyMoves=survey_moves, RQAMoves=rqa_message_moves
+        )
@@ -0,0 +1,95 @@
+import json
+from os import path
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.data_models import Scheme
+
+TEST_USER = "test"
+CODE_SCHEMES_DIR = path.join(path.dirname(__file__), "..", "code_schemes")
+
+
+def load_scheme(filename):
+    """
+    :param filename: Name of the code scheme file in code_schemes to load.
+    :type filename: str
+    :return: The code scheme, as a plain Scheme, so that tests don't depend on the pipeline's IndexedScheme.
+    :rtype: core_data_modules.data_models.Scheme
+    """
+    with open(path.join(CODE_SCHEMES_DIR, filename), "r") as f:
+        return Scheme.from_firebase_map(json.load(f))
+
+
+def make_label(scheme, code_id, checked, date_time_utc, scheme_id=None):
+    """
+    :param scheme: Scheme the label is in.
+    :type scheme: core_data_modules.data_models.Scheme
+    :param code_id: Id of the code to label with, or CodaDatasetCache.MANUALLY_UNCODED_CODE_ID.
+    :type code_id: str
+    :param checked: Whether the label has been checked in Coda.
+    :type checked: bool
+    :param date_time_utc: When the label was made, as an ISO 8601 string.
+    :type date_time_utc: str
+    :param scheme_id: Scheme id to give the label, if not `scheme`'s.
+    :type scheme_id: str | None
+    :return: The label, in the format of a label in a Coda messages file.
+    :rtype: dict
+    """
+    label = CleaningUtils.make_label_from_cleaner_code(
+        scheme, scheme.get_code_with_control_code(Codes.NOT_REVIEWED), "test"
+    ).to_dict()
+    label["SchemeID"] = scheme.scheme_id if scheme_id is None else scheme_id
+    label["CodeID"] = code_id
+    label["Checked"] = checked
+    label["DateTimeUTC"] = date_time_utc
+    return label
+
+
+def write_coda_messages_file(coda_path, labels_by_message_id):
+    """
+    Writes a Coda messages file.
+
+    :param coda_path: Path to write the file to.
+    :type coda_path: str
+    :param labels_by_message_id: Dictionary of message id -> the labels of that message, newest first as in Coda.
+    :type labels_by_message_id: dict of str -> list of dict
+    """
+    messages = []
+    for message_id, labels in labels_by_message_id.items():
+        messages.append({
+            "MessageID": message_id,
+            "Text": f"text of {message_id}",
+            "CreationDateTimeUTC": "2019-01-01T00:00:00+00:00",
+            "Labels": labels
+        })
+
+    with open(coda_path, "w") as f:
+        json.dump(messages, f)
+
+
+def without_not_reviewed_label_provenance(value, schemes):
+    """
+    Removes the time and origin id from the NOT_REVIEWED labels in a value, because these depend on when and where
+    the labels were made rather than on what they are.
+
+    :param value: TracedData value, or dictionary of TracedData values, to remove the provenance from.
+    :type value: any
+    :param schemes: Schemes which NOT_REVIEWED labels may be in.
+    :type schemes: iterable of core_data_modules.data_models.Scheme
+    :return: Copy of `value` without the provenance of its NOT_REVIEWED labels.
+    :rtype: any
+    """
+    not_reviewed_code_ids = {scheme.get_code_with_control_code(Codes.NOT_REVIEWED).code_id for scheme in schemes}
+
+    def normalise(v):
+        if isinstance(v, list):
+            return [normalise(x) for x in v]
+        if not isinstance(v, dict):
+            return v
+        if v.get("CodeID") in not_reviewed_code_ids:
+            v = {k: x for k, x in v.items() if k != "DateTimeUTC"}
+            v["Origin"] = {k: x for k, x in v["Origin"].items() if k != "OriginID"}
+            return v
+        return {k: normalise(x) for k, x in v.items()}
+
+    return normalise(value)
@@ -0,0 +1,173 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, urlencode
+
+_ISO_8601_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def iso_string(dt):
+    """
+    :param dt: UTC time to format.
+    :type dt: datetime.datetime
+    :return: `dt` in the format the Rapid Pro API uses.
+    :rtype: str
+    """
+    return dt.strftime(_ISO_8601_FORMAT)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubRapidProServer(object):
+    """
+    Local stand-in for the parts of the Rapid Pro v2 API which the fetch stage uses: the flows, contacts and runs
+    endpoints.
+
+    Like Rapid Pro, contacts and runs are returned in descending order of modified_on, filtered by an inclusive `after`
+    time, and paged with a cursor in each response's `next` URL. Pages are kept small so that every fetch spans several
+    pages.
+
+    Use as a context manager, and point a Rapid Pro client at `url`.
+    """
+    PAGE_SIZE = 3
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flows = []  # of flow dicts in the format returned by the API
+        self.contacts = dict()  # of contact uuid -> contact dict in the format returned by the API
+        self.runs = dict()  # of run id -> run dict in the format returned by the API
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def add_flow(self, uuid, name):
+        with self.lock:
+            self.flows.append({
+                "uuid": uuid, "name": name, "archived": False, "labels": [], "expires": 10080,
+                "created_on": iso_string(datetime(2019, 1, 1)),
+                "runs": {"active": 0, "completed": 0, "interrupted": 0, "expired": 0},
+                "results": []
+            })
+
+    def set_contact(self, uuid, phone_number, modified_on):
+        """
+        Adds a contact, or updates an existing contact.
+
+        :param uuid: Contact's uuid.
+        :type uuid: str
+        :param phone_number: Contact's phone number, in international format.
+        :type phone_number: str
+        :param modified_on: UTC time the contact was last modified.
+        :type modified_on: datetime.datetime
+        """
+        with self.lock:
+            self.contacts[uuid] = {
+                "uuid": uuid, "name": None, "language": None, "urns": [f"tel:{phone_number}"], "groups": [],
+                "fields": {}, "blocked": False, "stopped": False,
+                "created_on": iso_string(datetime(2019, 1, 1)), "modified_on": iso_string(modified_on)
+            }
+
+    def set_run(self, run_id, flow_uuid, contact_uuid, values, modified_on):
+        """
+        Adds a run, or updates an existing run.
+
+        :param run_id: Run's id.
+        :type run_id: int
+        :param flow_uuid: Uuid of the flow the run is in.
+        :type flow_uuid: str
+        :param contact_uuid: Uuid of the contact who made the run.
+        :type contact_uuid: str
+        :param values: Dictionary of result key -> the text the contact replied with.
+        :type values: dict of str -> str
+        :param modified_on: UTC time the run was last modified. Every value was set a minute before this.
+        :type modified_on: datetime.datetime
+        """
+        value_time = iso_string(modified_on - timedelta(minutes=1))
+        with self.lock:
+            flow = [flow for flow in self.flows if flow["uuid"] == flow_uuid][0]
+            self.runs[run_id] = {
+                "id": run_id,
+                "flow": {"uuid": flow["uuid"], "name": flow["name"]},
+                "contact": {"uuid": contact_uuid, "name": None},
+                "start": None,
+                "responded": True,
+                "path": [{"node": f"node-{key}", "time": value_time} for key in values],
+                "values": {
+                    key: {"value": text, "category": "All Responses", "node": f"node-{key}", "time": value_time,
+                          "name": key, "input": text}
+                    for key, text in values.items()
+                },
+                "created_on": iso_string(datetime(2019, 1, 1)),
+                "modified_on": iso_string(modified_on),
+                "exited_on": iso_string(modified_on),
+                "exit_type": "completed"
+            }
+
+    def _query(self, endpoint, params):
+        with self.lock:
+            if endpoint == "flows":
+                return list(self.flows)
+            if endpoint == "contacts":
+                results = list(self.contacts.values())
+            elif endpoint == "runs":
+                results = list(self.runs.values())
+                if "flow" in params:
+                    results = [run for run in results if run["flow"]["uuid"] == params["flow"]]
+            else:
+                return None
+
+        if "after" in params:
+            after = datetime.strptime(params["after"], _ISO_8601_FORMAT)
+            results = [r for r in results if datetime.strptime(r["modified_on"], _ISO_8601_FORMAT) >= after]
+        results.sort(key=lambda r: r["modified_on"], reverse=True)
+        return results
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                results = None
+                if url.path.startswith("/api/v2/") and url.path.endswith(".json"):
+                    results = stub._query(url.path[len("/api/v2/"):-len(".json")], params)
+                if results is None:
+                    self.send_error(404)
+                    return
+
+                start = int(params.pop("cursor", 0))
+                next_url = None
+                if start + stub.PAGE_SIZE < len(results):
+                    params["cursor"] = start + stub.PAGE_SIZE
+                    next_url = f"{stub.url}{url.path}?{urlencode(params)}"
+
+                body = json.dumps({
+                    "next": next_url, "previous": None, "results": results[start:start + stub.PAGE_SIZE]
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
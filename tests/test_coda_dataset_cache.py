@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from os import path
+
+from core_data_modules.traced_data import TracedData, Metadata
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+
+from src.lib import CodaDatasetCache
+from tests.coda_test_data import TEST_USER, load_scheme, make_label, write_coda_messages_file, \
+    without_not_reviewed_label_provenance
+
+
+class TestCodaDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.single_coded_scheme = load_scheme("gender.json")
+        self.multi_coded_scheme = load_scheme("icraf_s01e01.json")
+
+        gender_code_ids = [code.code_id for code in self.single_coded_scheme.codes if code.code_type == "Normal"]
+        rqa_code_ids = [code.code_id for code in self.multi_coded_scheme.codes if code.code_type == "Normal"]
+
+        self.single_coded_path = path.join(self.test_dir, "single.json")
+        write_coda_messages_file(self.single_coded_path, {
+            "no labels": [],
+            "checked": [
+                make_label(self.single_coded_scheme, gender_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "unchecked": [
+                make_label(self.single_coded_scheme, gender_code_ids[0], False, "2019-01-02T00:00:00+00:00")
+            ],
+            "checked over unchecked": [
+                make_label(self.single_coded_scheme, gender_code_ids[1], True, "2019-01-03T00:00:00+00:00"),
+                make_label(self.single_coded_scheme, gender_code_ids[0], False, "2019-01-02T00:00:00+00:00")
+            ],
+            "unchecked over checked": [
+                make_label(self.single_coded_scheme, gender_code_ids[1], False, "2019-01-03T00:00:00+00:00"),
+                make_label(self.single_coded_scheme, gender_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ]
+        })
+
+        self.multi_coded_path = path.join(self.test_dir, "multi.json")
+        write_coda_messages_file(self.multi_coded_path, {
+            "no labels": [],
+            "checked": [
+                make_label(self.multi_coded_scheme, rqa_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "unchecked": [
+                make_label(self.multi_coded_scheme, rqa_code_ids[0], False, "2019-01-02T00:00:00+00:00")
+            ],
+            "relabelled": [
+                make_label(self.multi_coded_scheme, rqa_code_ids[1], True, "2019-01-03T00:00:00+00:00"),
+                make_label(self.multi_coded_scheme, rqa_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "uncoded": [
+                make_label(self.multi_coded_scheme, CodaDatasetCache.MANUALLY_UNCODED_CODE_ID, True,
+                           "2019-01-03T00:00:00+00:00"),
+                make_label(self.multi_coded_scheme, rqa_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ]
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def make_data(message_ids, coded_key, existing_label=None):
+        data = []
+        for message_id in message_ids:
+            d = {"text": f"text of {message_id}"}
+            if message_id is not None:
+                d["message_id"] = message_id
+            if existing_label is not None:
+                d[coded_key] = existing_label
+            data.append(TracedData(d, Metadata(TEST_USER, Metadata.get_call_location(), time.time())))
+        return data
+
+    def assert_same_values(self, expected_data, actual_data):
+        schemes = [self.single_coded_scheme, self.multi_coded_scheme]
+        self.assertEqual(len(expected_data), len(actual_data))
+        for expected_td, actual_td in zip(expected_data, actual_data):
+            self.assertEqual(
+                without_not_reviewed_label_provenance(dict(expected_td.items()), schemes),
+                without_not_reviewed_label_provenance(dict(actual_td.items()), schemes)
+            )
+
+    def test_import_coda_2_to_traced_data_iterable(self):
+        # Includes a message which isn't in the file, a td with no message id, and a message shared by two tds.
+        message_ids = ["no labels", "checked", "unchecked", "checked over unchecked", "unchecked over checked",
+                       "not in file", None, "checked"]
+        existing_label = make_label(self.single_coded_scheme, self.single_coded_scheme.codes[0].code_id, True,
+                                    "2019-01-01T00:00:00+00:00")
+
+        for existing in [None, existing_label]:
+            for coda_path in [self.single_coded_path, None]:
+                expected = self.make_data(message_ids, "coded", existing)
+                f = open(coda_path, "r") if coda_path is not None else None
+                try:
+                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
+                        TEST_USER, expected, "message_id", {"coded": self.single_coded_scheme}, f)
+                finally:
+                    if f is not None:
+                        f.close()
+
+                actual = self.make_data(message_ids, "coded", existing)
+                CodaDatasetCache().import_coda_2_to_traced_data_iterable(
+                    TEST_USER, actual, "message_id", {"coded": self.single_coded_scheme}, coda_path)
+
+                self.assert_same_values(expected, actual)
+
+    def test_import_coda_2_to_traced_data_iterable_multi_coded(self):
+        message_ids = ["no labels", "checked", "unchecked", "relabelled", "uncoded", "not in file", None, "checked"]
+        existing_labels = [make_label(self.multi_coded_scheme, self.multi_coded_scheme.codes[2].code_id, True,
+                                      "2019-01-01T00:00:00+00:00")]
+
+        for existing in [None, existing_labels]:
+            for coda_path in [self.multi_coded_path, None]:
+                expected = self.make_data(message_ids, "coded", existing)
+                f = open(coda_path, "r") if coda_path is not None else None
+                try:
+                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
+                        TEST_USER, expected, "message_id", {"coded": self.multi_coded_scheme}, f)
+                finally:
+                    if f is not None:
+                        f.close()
+
+                actual = self.make_data(message_ids, "coded", existing)
+                CodaDatasetCache().import_coda_2_to_traced_data_iterable_multi_coded(
+                    TEST_USER, actual, "message_id", {"coded": self.multi_coded_scheme}, coda_path)
+
+                self.assert_same_values(expected, actual)
+
+    def test_imported_labels_are_not_shared(self):
+        coda_dataset_cache = CodaDatasetCache()
+        data = self.make_data(["checked", "checked"], "coded")
+        coda_dataset_cache.import_coda_2_to_traced_data_iterable(
+            TEST_USER, data, "message_id", {"coded": self.single_coded_scheme}, self.single_coded_path)
+        self.assertEqual(data[0]["coded"], data[1]["coded"])
+        self.assertIsNot(data[0]["coded"], data[1]["coded"])
+
+        # Importing the same file again after modifying an imported label still imports the label in the file.
+        data[0]["coded"]["Checked"] = False
+        more_data = self.make_data(["checked"], "coded")
+        coda_dataset_cache.import_coda_2_to_traced_data_iterable(
+            TEST_USER, more_data, "message_id", {"coded": self.single_coded_scheme}, self.single_coded_path)
+        self.assertTrue(more_data[0]["coded"]["Checked"])
+
+    def test_get_dataset_reparses_modified_files(self):
+        coda_dataset_cache = CodaDatasetCache()
+        self.assertIn("checked", coda_dataset_cache.get_dataset(self.single_coded_path))
+
+        write_coda_messages_file(self.single_coded_path, {"new message": []})
+        # Make sure the modification time changes even on file systems with a coarse timestamp resolution.
+        modification_time = path.getmtime(self.single_coded_path) + 10
+        os.utime(self.single_coded_path, (modification_time, modification_time))
+
+        self.assertEqual(set(coda_dataset_cache.get_dataset(self.single_coded_path).keys()), {"new message"})
+        self.assertEqual(coda_dataset_cache.get_dataset(None), dict())
@@ -0,0 +1,146 @@
+import shutil
+import tempfile
+import time
+import unittest
+from os import path
+
+from core_data_modules.traced_data import TracedData, Metadata
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+
+from src.lib import CodaDatasetCache, CodaImport
+from tests.coda_test_data import TEST_USER, load_scheme, make_label, write_coda_messages_file, \
+    without_not_reviewed_label_provenance
+
+
+class TestCodaImportAll(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.rqa_scheme = load_scheme("icraf_s01e01.json")
+        self.binary_scheme = load_scheme("s01e01_yes_no_amb.json")
+        self.gender_scheme = load_scheme("gender.json")
+        self.age_scheme = load_scheme("age.json")
+
+        rqa_code_ids = [code.code_id for code in self.rqa_scheme.codes if code.code_type == "Normal"]
+        binary_code_ids = [code.code_id for code in self.binary_scheme.codes if code.code_type == "Normal"]
+        gender_code_ids = [code.code_id for code in self.gender_scheme.codes if code.code_type == "Normal"]
+
+        # The RQA file holds the labels of both the RQA scheme and its binary scheme, as in the pipeline's Coda files.
+        self.rqa_path = path.join(self.test_dir, "rqa.json")
+        write_coda_messages_file(self.rqa_path, {
+            "rqa no labels": [],
+            "rqa coded": [
+                make_label(self.rqa_scheme, rqa_code_ids[0], True, "2019-01-02T00:00:00+00:00"),
+                make_label(self.binary_scheme, binary_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "rqa unchecked": [
+                make_label(self.rqa_scheme, rqa_code_ids[1], False, "2019-01-02T00:00:00+00:00"),
+                make_label(self.binary_scheme, binary_code_ids[1], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "rqa uncoded": [
+                make_label(self.rqa_scheme, CodaDatasetCache.MANUALLY_UNCODED_CODE_ID, True,
+                           "2019-01-03T00:00:00+00:00"),
+                make_label(self.rqa_scheme, rqa_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ]
+        })
+
+        self.gender_path = path.join(self.test_dir, "gender.json")
+        write_coda_messages_file(self.gender_path, {
+            "gender checked": [
+                make_label(self.gender_scheme, gender_code_ids[0], True, "2019-01-02T00:00:00+00:00")
+            ],
+            "gender unchecked": [
+                make_label(self.gender_scheme, gender_code_ids[1], False, "2019-01-02T00:00:00+00:00")
+            ]
+        })
+
+        # Age has no Coda file yet.
+        self.coda_imports = [
+            CodaImport("rqa_id", {"rqa_coded": self.rqa_scheme}, self.rqa_path, multi_coded=True,
+                       required_key="rqa_raw"),
+            CodaImport("rqa_id", {"rqa_binary_coded": self.binary_scheme}, self.rqa_path, required_key="rqa_raw"),
+            CodaImport("gender_id", {"gender_coded": self.gender_scheme}, self.gender_path),
+            CodaImport("age_id", {"age_coded": self.age_scheme}, None)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def make_data():
+        data = [
+            {"rqa_raw": "a", "rqa_id": "rqa no labels", "gender_id": "gender checked", "age_id": "age"},
+            {"rqa_raw": "b", "rqa_id": "rqa coded", "gender_id": "gender unchecked"},
+            {"rqa_raw": "c", "rqa_id": "rqa unchecked", "gender_id": "not in file", "age_id": "age"},
+            {"rqa_raw": "d", "rqa_id": "rqa uncoded"},
+            {"rqa_raw": "e", "rqa_id": "not in file", "gender_id": "gender checked"},
+            # Has an RQA message id but no RQA answer, so mustn't be given RQA labels.
+            {"rqa_id": "rqa coded", "gender_id": "gender checked"},
+            {"age_id": "age"},
+            {}
+        ]
+        return [TracedData(d, Metadata(TEST_USER, Metadata.get_call_location(), time.time())) for d in data]
+
+    @staticmethod
+    def import_in_sequence(data, coda_imports):
+        """Applies each import with TracedDataCodaV2IO, in the way the pipeline did before it used import_all."""
+        for coda_import in coda_imports:
+            import_data = data
+            if coda_import.required_key is not None:
+                import_data = [td for td in data if coda_import.required_key in td]
+
+            f = open(coda_import.coda_path, "r") if coda_import.coda_path is not None else None
+            try:
+                if coda_import.multi_coded:
+                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
+                        TEST_USER, import_data, coda_import.message_id_key, coda_import.scheme_key_map, f)
+                else:
+                    TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
+                        TEST_USER, import_data, coda_import.message_id_key, coda_import.scheme_key_map, f)
+            finally:
+                if f is not None:
+                    f.close()
+
+    def assert_same_values(self, expected_data, actual_data):
+        schemes = [self.rqa_scheme, self.binary_scheme, self.gender_scheme, self.age_scheme]
+        self.assertEqual(len(expected_data), len(actual_data))
+        for expected_td, actual_td in zip(expected_data, actual_data):
+            self.assertEqual(
+                without_not_reviewed_label_provenance(dict(expected_td.items()), schemes),
+                without_not_reviewed_label_provenance(dict(actual_td.items()), schemes)
+            )
+
+    def test_import_all(self):
+        expected = self.make_data()
+        self.import_in_sequence(expected, self.coda_imports)
+
+        actual = self.make_data()
+        CodaDatasetCache().import_all(TEST_USER, actual, self.coda_imports)
+
+        self.assert_same_values(expected, actual)
+
+    def test_import_all_over_existing_labels(self):
+        # Importing again over the labels of a previous import, as when a stage is re-run on its own output.
+        expected = self.make_data()
+        self.import_in_sequence(expected, self.coda_imports)
+        self.import_in_sequence(expected, self.coda_imports)
+
+        actual = self.make_data()
+        self.import_in_sequence(actual, self.coda_imports)
+        CodaDatasetCache().import_all(TEST_USER, actual, self.coda_imports)
+
+        self.assert_same_values(expected, actual)
+
+    def test_later_imports_see_earlier_labels(self):
+        # Two imports to the same key: the second must be applied on top of the labels set by the first.
+        coda_imports = [
+            CodaImport("rqa_id", {"rqa_coded": self.rqa_scheme}, None, multi_coded=True),
+            CodaImport("rqa_id", {"rqa_coded": self.rqa_scheme}, self.rqa_path, multi_coded=True)
+        ]
+
+        expected = self.make_data()
+        self.import_in_sequence(expected, coda_imports)
+
+        actual = self.make_data()
+        CodaDatasetCache().import_all(TEST_USER, actual, coda_imports)
+
+        self.assert_same_values(expected, actual)
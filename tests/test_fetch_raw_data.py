@@ -0,0 +1,163 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from os import path
+
+from core_data_modules.cleaners import PhoneCleaner
+from core_data_modules.traced_data.io import TracedDataJsonIO
+
+import fetch_raw_data
+from src.lib import PipelineConfiguration, PagingRapidProClient, SQLitePhoneNumberUuidTable
+from tests.rapid_pro_stub import StubRapidProServer
+
+TEST_USER = "test"
+ACTIVATION_FLOW_NAMES = ["activation_1", "activation_2", "activation_3"]
+SURVEY_FLOW_NAMES = ["survey_1", "survey_2"]
+RUNS_PER_FLOW = 10
+
+
+class TestFetchRawData(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.server = StubRapidProServer()
+        self.server.__enter__()
+        self.rng = random.Random(0)
+        self.next_run_id = 1
+        self.next_modified_on = datetime(2019, 6, 1)
+
+        for flow_name in ACTIVATION_FLOW_NAMES + SURVEY_FLOW_NAMES:
+            self.server.add_flow(f"flow-{flow_name}", flow_name)
+
+        self.contact_uuids = [f"contact-{i}" for i in range(8)]
+        for i, contact_uuid in enumerate(self.contact_uuids):
+            self.server.set_contact(contact_uuid, f"+2547000000{i:02}", self.make_modified_on())
+        self.test_contact_uuid = self.contact_uuids[0]
+
+        for flow_name in ACTIVATION_FLOW_NAMES + SURVEY_FLOW_NAMES:
+            for _ in range(RUNS_PER_FLOW):
+                self.add_run(flow_name)
+
+        self.pipeline_configuration = PipelineConfiguration(
+            self.server.url, "gs://test-bucket/test-token", ACTIVATION_FLOW_NAMES, SURVEY_FLOW_NAMES,
+            [self.test_contact_uuid], []
+        )
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.test_dir)
+
+    def make_modified_on(self):
+        # Every run and contact has a different modification time, so that runs have a single order by modified_on.
+        self.next_modified_on += timedelta(minutes=self.rng.randint(1, 30))
+        return self.next_modified_on
+
+    def add_run(self, flow_name, run_id=None):
+        if run_id is None:
+            run_id = self.next_run_id
+            self.next_run_id += 1
+
+        if flow_name in SURVEY_FLOW_NAMES:
+            values = {"gender": self.rng.choice(["male", "female", "m", "f"]),
+                      "age": str(self.rng.randint(14, 80))}
+        else:
+            values = {"rqa": f"answer {self.rng.randint(0, 1000)}"}
+
+        # Contacts often send several runs to the same flow, which the survey flows are coalesced over.
+        self.server.set_run(run_id, f"flow-{flow_name}", self.rng.choice(self.contact_uuids), values,
+                            self.make_modified_on())
+
+    def export(self, export_dir, max_workers, full_refetch=False):
+        """
+        Exports all the flows with fetch_raw_data.export_flows.
+
+        :return: Dictionary of flow name -> values of each TracedData exported for that flow, in order, with each
+                 phone number UUID replaced by its phone number so that exports to different UUID tables can be
+                 compared; and the phone numbers in the export's phone number <-> UUID table, in the order they were
+                 added.
+        :rtype: (dict of str -> list of dict, list of str)
+        """
+        phone_number_uuid_table_path = path.join(export_dir, "phone_number_uuids.db")
+        phone_number_uuid_table = SQLitePhoneNumberUuidTable(phone_number_uuid_table_path)
+        try:
+            fetch_raw_data.export_flows(
+                TEST_USER, lambda: PagingRapidProClient(self.server.url, "test-token"), self.pipeline_configuration,
+                export_dir, phone_number_uuid_table, path.join(export_dir, "contacts.json"), full_refetch,
+                max_workers
+            )
+        finally:
+            phone_number_uuid_table.close()
+
+        connection = sqlite3.connect(phone_number_uuid_table_path)
+        try:
+            rows = connection.execute("SELECT phone, uuid FROM phone_number_uuids ORDER BY rowid").fetchall()
+        finally:
+            connection.close()
+        phone_numbers = [phone for phone, _ in rows]
+        uuid_to_phone = {uuid: phone for phone, uuid in rows}
+
+        exported = dict()
+        for flow_name in ACTIVATION_FLOW_NAMES + SURVEY_FLOW_NAMES:
+            with open(path.join(export_dir, f"{flow_name}.jsonl"), "r") as f:
+                exported[flow_name] = [
+                    {k: uuid_to_phone.get(v, v) if isinstance(v, str) else v for k, v in td.items()}
+                    for td in TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
+                ]
+
+        return exported, phone_numbers
+
+    def assert_exported_in_modified_on_order(self, exported):
+        """
+        Checks that each flow was exported in ascending order of the runs' modified_on, and that the survey flows were
+        coalesced with one TracedData per respondent, in the order each respondent was first seen.
+        """
+        for flow_name in ACTIVATION_FLOW_NAMES + SURVEY_FLOW_NAMES:
+            runs = sorted([run for run in self.server.runs.values() if run["flow"]["name"] == flow_name],
+                          key=lambda run: run["modified_on"])
+            expected_phone_numbers = []
+            for run in runs:
+                urn = self.server.contacts[run["contact"]["uuid"]]["urns"][0]
+                phone_number = PhoneCleaner.normalise_phone(urn[len("tel:"):])
+                if flow_name in SURVEY_FLOW_NAMES and phone_number in expected_phone_numbers:
+                    continue
+                expected_phone_numbers.append(phone_number)
+
+            self.assertEqual([td["avf_phone_id"] for td in exported[flow_name]], expected_phone_numbers)
+
+    def make_export_dir(self, name):
+        export_dir = path.join(self.test_dir, name)
+        os.makedirs(export_dir)
+        return export_dir
+
+    def test_concurrent_export_matches_sequential_export(self):
+        sequential_exported, sequential_phone_numbers = self.export(self.make_export_dir("sequential"), 1)
+        concurrent_exported, concurrent_phone_numbers = self.export(self.make_export_dir("concurrent"), 4)
+
+        self.assert_exported_in_modified_on_order(sequential_exported)
+        self.assertEqual(concurrent_exported, sequential_exported)
+        # Phone numbers are added to the table in the same order as by a sequential export.
+        self.assertEqual(concurrent_phone_numbers, sequential_phone_numbers)
+
+    def test_incremental_export_matches_full_export(self):
+        incremental_dir = self.make_export_dir("incremental")
+        self.export(incremental_dir, 4)
+
+        # Update some runs and contacts, and add new ones, including a run from a new contact.
+        for run_id in self.rng.sample(range(1, self.next_run_id), 10):
+            flow_name = self.server.runs[run_id]["flow"]["name"]
+            self.add_run(flow_name, run_id)
+        self.server.set_contact(self.contact_uuids[3], "+254700000099", self.make_modified_on())
+        self.contact_uuids.append("contact-new")
+        self.server.set_contact("contact-new", "+254700000100", self.make_modified_on())
+        for flow_name in ACTIVATION_FLOW_NAMES + SURVEY_FLOW_NAMES:
+            for _ in range(3):
+                self.add_run(flow_name)
+
+        incremental_exported, _ = self.export(incremental_dir, 4)
+        full_exported, _ = self.export(self.make_export_dir("full"), 4, full_refetch=True)
+
+        self.assert_exported_in_modified_on_order(full_exported)
+        self.assertEqual(incremental_exported, full_exported)
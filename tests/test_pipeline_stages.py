@@ -0,0 +1,91 @@
+import shutil
+import tempfile
+import time
+import unittest
+from os import path
+
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src.lib import PipelineStage, PipelineStageRunner, StageCache
+
+TEST_USER = "test"
+
+
+class TestPipelineStageRunner(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.words_path = path.join(self.test_dir, "words.txt")
+        self.suffix_path = path.join(self.test_dir, "suffix.txt")
+        self.output_path = path.join(self.test_dir, "output.txt")
+        self.write_file(self.words_path, "a\nb\n")
+        self.write_file(self.suffix_path, "!")
+        self.runs = []  # of the name of each stage run, in order
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def write_file(file_path, text):
+        with open(file_path, "w") as f:
+            f.write(text)
+
+    def make_stages(self):
+        def load_words(data):
+            self.runs.append("LoadWords")
+            with open(self.words_path, "r") as f:
+                # Comment lines don't change the data this stage outputs.
+                words = [line.strip() for line in f if not line.startswith("#")]
+            return [TracedData({"word": word}, Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+                    for word in words]
+
+        def add_suffix(data):
+            self.runs.append("AddSuffix")
+            with open(self.suffix_path, "r") as f:
+                suffix = f.read()
+            for td in data:
+                td.append_data({"word": td["word"] + suffix},
+                               Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+            return data
+
+        def write_words(data):
+            self.runs.append("WriteWords")
+            self.write_file(self.output_path, "\n".join(td["word"] for td in data))
+            return data
+
+        return [
+            PipelineStage("LoadWords", "Loading words...", load_words, input_paths=[self.words_path]),
+            PipelineStage("AddSuffix", "Adding suffix...", add_suffix, input_paths=[self.suffix_path]),
+            PipelineStage("WriteWords", "Writing words...", write_words, output_paths=[self.output_path],
+                          modifies_data=False)
+        ]
+
+    def run_stages(self):
+        self.runs = []
+        PipelineStageRunner.run_stages(self.make_stages(), stage_cache=StageCache(path.join(self.test_dir, "cache")))
+        with open(self.output_path, "r") as f:
+            return f.read()
+
+    def test_unchanged_stages_are_skipped(self):
+        self.assertEqual(self.run_stages(), "a!\nb!")
+        self.assertEqual(self.runs, ["LoadWords", "AddSuffix", "WriteWords"])
+
+        self.assertEqual(self.run_stages(), "a!\nb!")
+        self.assertEqual(self.runs, [])
+
+    def test_input_change_which_does_not_change_data_only_reruns_its_stage(self):
+        self.run_stages()
+
+        self.write_file(self.words_path, "# A comment\na\nb\n")
+        self.assertEqual(self.run_stages(), "a!\nb!")
+        self.assertEqual(self.runs, ["LoadWords"])
+
+    def test_input_change_reruns_later_stages_whose_data_changes(self):
+        self.run_stages()
+
+        self.write_file(self.suffix_path, "?")
+        self.assertEqual(self.run_stages(), "a?\nb?")
+        self.assertEqual(self.runs, ["AddSuffix", "WriteWords"])
+
+        self.write_file(self.words_path, "a\nc\n")
+        self.assertEqual(self.run_stages(), "a?\nc?")
+        self.assertEqual(self.runs, ["LoadWords", "AddSuffix", "WriteWords"])
@@ -0,0 +1,55 @@
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from os import path
+
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src.lib import RawDataSnapshot
+
+TEST_USER = "test"
+HISTORY_LENGTH = 5000
+
+
+class TestRawDataSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.raw_data_path = path.join(self.test_dir, "raw_data.jsonl")
+        with open(self.raw_data_path, "w") as f:
+            f.write("{}\n")
+        self.snapshot_path = path.join(self.test_dir, "raw_data.pickle")
+
+        # Start from Python's default recursion limit, so that the snapshot has to raise it itself.
+        self.recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(1000)
+
+    def tearDown(self):
+        sys.setrecursionlimit(self.recursion_limit)
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def make_deep_traced_data():
+        td = TracedData({"count": 0}, Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+        for i in range(1, HISTORY_LENGTH):
+            td.append_data({"count": i}, Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+        return td
+
+    def test_save_and_load_deep_traced_data(self):
+        RawDataSnapshot.save(self.snapshot_path, [self.raw_data_path], [[self.make_deep_traced_data()]])
+        sys.setrecursionlimit(1000)
+
+        datasets = RawDataSnapshot.load(self.snapshot_path, [self.raw_data_path])
+
+        self.assertIsNotNone(datasets)
+        self.assertEqual(len(datasets), 1)
+        self.assertEqual(len(datasets[0]), 1)
+        self.assertEqual(dict(datasets[0][0].items()), {"count": HISTORY_LENGTH - 1})
+
+    def test_stale_snapshot_is_not_loaded(self):
+        RawDataSnapshot.save(self.snapshot_path, [self.raw_data_path], [[self.make_deep_traced_data()]])
+        with open(self.raw_data_path, "w") as f:
+            f.write("{}\n{}\n")
+
+        self.assertIsNone(RawDataSnapshot.load(self.snapshot_path, [self.raw_data_path]))
@@ -0,0 +1,105 @@
+import time
+import unittest
+from unittest import mock
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.traced_data import TracedData, Metadata
+
+from src.lib import CodingPlanRegistry
+from src.lib.pipeline_configuration import CodeSchemes
+from src.ws_correction import WSCorrection
+
+TEST_USER = "test"
+
+
+def _derive_traced_data_by_copying(user, parent, new_data):
+    """The way WSCorrection derived each RQA message's TracedData before it shared the parent's history."""
+    derived = parent.copy()
+    derived.append_data(new_data, Metadata(user, Metadata.get_call_location(), time.time()))
+    return derived
+
+
+class TestWSCorrection(unittest.TestCase):
+    def setUp(self):
+        self.rqa_plans = [plan for plan in CodingPlanRegistry.RQA_PLANS if plan.ws_code is not None]
+
+        # Labels are timestamped when they are made, so make each label once, so that every group made by
+        # `make_groups` has the same values.
+        self.ws_labels = {
+            code.code_id: CleaningUtils.make_label_from_cleaner_code(
+                CodeSchemes.WS_CORRECT_DATASET, code, Metadata.get_call_location()).to_dict()
+            for code in [CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.NOT_REVIEWED),
+                         self.rqa_plans[3].ws_code]
+        }
+
+    def make_ws_label(self, code):
+        return self.ws_labels[code.code_id]
+
+    def make_group(self, uid, rqa_plans, moved_message_index=None, move_to_plan=None):
+        """
+        Makes the TracedData for one uid, with one message for each of `rqa_plans` and the same survey answer on every
+        message.
+
+        Each message has a history of several entries, like the messages which reach WSCorrection in the pipeline.
+        """
+        not_reviewed = self.make_ws_label(CodeSchemes.WS_CORRECT_DATASET.get_code_with_control_code(Codes.NOT_REVIEWED))
+        survey_plan = CodingPlanRegistry.SURVEY_PLANS[0]
+
+        group = []
+        for i, plan in enumerate(rqa_plans):
+            td = TracedData({"uid": uid, "message_id": f"{uid}-{i}"},
+                            Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+            td.append_data({survey_plan.raw_field: "survey answer", survey_plan.time_field: "2019-01-01T00:00:00Z",
+                            survey_plan.ws_correct_dataset_field: not_reviewed},
+                           Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+            td.append_data({plan.raw_field: f"message {i}", plan.time_field: f"2019-01-0{i + 2}T00:00:00Z"},
+                           Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+
+            ws_label = not_reviewed
+            if i == moved_message_index:
+                ws_label = self.make_ws_label(move_to_plan.ws_code)
+            td.append_data({plan.ws_correct_dataset_field: ws_label},
+                           Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+            group.append(td)
+        return group
+
+    def make_groups(self):
+        rqa_plans = self.rqa_plans
+        return [
+            # Several RQA messages, one of which is moved to another RQA field.
+            self.make_group("uid-1", rqa_plans[:3], moved_message_index=1, move_to_plan=rqa_plans[3]),
+            # Several RQA messages, none of which are moved.
+            self.make_group("uid-2", rqa_plans[:2]),
+            # A single RQA message.
+            self.make_group("uid-3", rqa_plans[:1])
+        ]
+
+    def test_derived_traced_data_match_copies(self):
+        expected_groups = self.make_groups()
+        with mock.patch.object(WSCorrection, "_derive_traced_data", _derive_traced_data_by_copying):
+            expected, _ = WSCorrection._correct_uid_groups(
+                TEST_USER, expected_groups, CodingPlanRegistry.WS_CODE_ID_TO_RAW_FIELD)
+
+        actual, _ = WSCorrection._correct_uid_groups(
+            TEST_USER, self.make_groups(), CodingPlanRegistry.WS_CODE_ID_TO_RAW_FIELD)
+
+        self.assertEqual(len(actual), 6)
+        self.assertEqual([dict(td.items()) for td in actual], [dict(td.items()) for td in expected])
+
+    def test_derived_traced_data_are_independent(self):
+        parent = self.make_groups()[0][0]
+        parent_values = dict(parent.items())
+
+        first = WSCorrection._derive_traced_data(TEST_USER, parent, {"sent_on": "first"})
+        second = WSCorrection._derive_traced_data(TEST_USER, parent, {"sent_on": "second"})
+        first.append_data({"message_id": "changed"}, Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+        second.hide_keys({"uid"}, Metadata(TEST_USER, Metadata.get_call_location(), time.time()))
+
+        self.assertEqual(dict(parent.items()), parent_values)
+        self.assertEqual(first["sent_on"], "first")
+        self.assertEqual(first["message_id"], "changed")
+        self.assertEqual(first["uid"], parent["uid"])
+        self.assertEqual(second["sent_on"], "second")
+        self.assertEqual(second["message_id"], parent["message_id"])
+        self.assertNotIn("uid", second)